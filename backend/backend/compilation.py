@@ -0,0 +1,237 @@
+# Optional torch.compile execution of the UNet forward and the VAE decode.
+# Compiled graphs are specialised (dynamic=False) per key: function, model architecture and the shape and dtype of every
+# input, i.e. resolution, batch size and prompt length. Calls run eagerly whenever something can change the graph:
+# ControlNet, transformer patches and block modifiers, online LoRA, quantized weights, or a model that is only partly
+# on the GPU. A key that fails to compile stays eager for the rest of the session.
+# Inductor's on-disk caches are pointed at a directory under models/, so after a restart graphs are re-traced but
+# kernels are not rebuilt. Recently compiled keys are recorded there too and compiled again when a model is loaded.
+
+
+import os
+import json
+import time
+import torch
+
+from backend import memory_management
+from backend.args import dynamic_args
+
+
+cache_dir = None
+recent_keys_limit = 8
+warmup_keys_limit = 2
+
+# transformer options that sampling always sets and that the plain UNet forward does not read
+plain_transformer_options = {'cond_or_uncond', 'sigmas', 'cond_mark', 'cond_indices', 'uncond_indices'}
+
+
+def compile_mode():
+    return dynamic_args.get('forge_compile_mode', 'None')
+
+
+def unet_enabled():
+    return compile_mode() in ['UNet', 'UNet + VAE'] and hasattr(torch, 'compile')
+
+
+def vae_enabled():
+    return compile_mode() == 'UNet + VAE' and hasattr(torch, 'compile')
+
+
+def setup_cache(directory):
+    global cache_dir
+
+    if cache_dir == directory:
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    cache_dir = directory
+
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = os.path.join(directory, 'inductor')
+    os.environ['TORCHINDUCTOR_FX_GRAPH_CACHE'] = '1'
+    os.environ['TORCHINDUCTOR_AUTOGRAD_CACHE'] = '1'
+
+    try:
+        import torch._inductor.config
+        import torch._dynamo.config
+        torch._inductor.config.fx_graph_cache = True
+        # one graph per resolution, batch size and prompt length
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+    except Exception as e:
+        print(f'[Compile] Could not configure the compile cache: {e}')
+
+
+def value_spec(value):
+    if isinstance(value, torch.Tensor):
+        return 'tensor', tuple(value.shape), str(value.dtype).replace('torch.', '')
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return 'value', value
+    return None
+
+
+def make_key(name, model, args, kwargs):
+    specs = [value_spec(x) for x in args]
+    kwspecs = [(k, value_spec(v)) for k, v in sorted(kwargs.items())]
+    if any(x is None for x in specs) or any(x is None for _, x in kwspecs):
+        return None
+    return name, model.__class__.__name__, tuple(specs), tuple(kwspecs)
+
+
+def describe(key):
+    tensors = [spec[1] for spec in key[2] if spec[0] == 'tensor']
+    return f"{key[1]} {'x'.join(str(d) for d in tensors[0])}" if tensors else key[1]
+
+
+def rebuild(spec, device):
+    if spec[0] == 'tensor':
+        return torch.zeros(spec[1], dtype=getattr(torch, spec[2]), device=device)
+    return spec[1]
+
+
+def key_from_json(data):
+    to_spec = lambda s: (s[0], tuple(s[1]), s[2]) if s[0] == 'tensor' else (s[0], s[1])
+    return data[0], data[1], tuple(to_spec(s) for s in data[2]), tuple((k, to_spec(s)) for k, s in data[3])
+
+
+def recent_keys_path():
+    return os.path.join(cache_dir, 'recent.json')
+
+
+def load_recent_keys():
+    if cache_dir is None or not os.path.exists(recent_keys_path()):
+        return []
+    try:
+        with open(recent_keys_path(), 'r', encoding='utf-8') as f:
+            return [key_from_json(x) for x in json.load(f)]
+    except Exception:
+        return []
+
+
+def remember_key(key):
+    if cache_dir is None:
+        return
+
+    keys = [key] + [k for k in load_recent_keys() if k != key]
+    try:
+        with open(recent_keys_path() + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(keys[:recent_keys_limit], f)
+        os.replace(recent_keys_path() + '.tmp', recent_keys_path())
+    except OSError as e:
+        print(f'[Compile] Could not record compiled shapes: {e}')
+
+
+class CompiledFunction:
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.compiled = None
+        self.ready = set()
+        self.failed = set()
+
+    def __call__(self, model, *args, **kwargs):
+        key = make_key(self.name, model, args, kwargs)
+
+        if key is None or key in self.failed:
+            return self.function(model, *args, **kwargs)
+
+        if self.compiled is None:
+            self.compiled = torch.compile(self.function, dynamic=False)
+
+        if key in self.ready:
+            return self.compiled(model, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            result = self.compiled(model, *args, **kwargs)
+        except memory_management.OOM_EXCEPTION:
+            raise
+        except Exception as e:
+            self.failed.add(key)
+            print(f'[Compile] {self.name} for {describe(key)} could not be compiled, running it eagerly: {e}')
+            return self.function(model, *args, **kwargs)
+
+        self.ready.add(key)
+        remember_key(key)
+        print(f'[Compile] {self.name} for {describe(key)} compiled in {time.perf_counter() - start:.2f}s')
+        return result
+
+
+def unet_forward(model, x, timesteps, context, **extra_conds):
+    return model(x, timesteps, context=context, control=None, transformer_options={}, **extra_conds)
+
+
+def vae_decode_forward(model, samples):
+    return model.decode(samples)
+
+
+compiled_unet = CompiledFunction('UNet', unet_forward)
+compiled_vae_decode = CompiledFunction('VAE decode', vae_decode_forward)
+
+
+def partially_loaded(patcher):
+    return any(m.model is patcher and m.model_accelerated for m in memory_management.current_loaded_models)
+
+
+def unet_fallback_reason(unet):
+    if unet.model.storage_dtype in ['gguf', 'nf4', 'fp4']:
+        return 'quantized weights'
+    if unet.has_online_lora():
+        return 'online LoRA'
+    if partially_loaded(unet):
+        return 'the UNet is only partly in VRAM'
+    return None
+
+
+def begin_sampling(unet):
+    """Returns whether the UNet may run compiled during this sampling run."""
+
+    if not unet_enabled():
+        return False
+
+    reason = unet_fallback_reason(unet)
+    if reason is not None:
+        print(f'[Compile] UNet runs eagerly: {reason}')
+        return False
+
+    return True
+
+
+def is_plain_graph(control, transformer_options):
+    return control is None and all(k in plain_transformer_options or not v for k, v in transformer_options.items())
+
+
+def vae_decode(vae, samples):
+    if vae_enabled() and not partially_loaded(vae.patcher):
+        return compiled_vae_decode(vae.first_stage_model, samples)
+    return vae.first_stage_model.decode(samples)
+
+
+def warmup(sd_model):
+    """Compiles the most recently used shapes of this model's architecture again, so that the first generation after
+    a model load does not pay for compilation."""
+
+    targets = []
+    if unet_enabled() and unet_fallback_reason(sd_model.forge_objects.unet) is None:
+        unet = sd_model.forge_objects.unet
+        targets.append((compiled_unet, unet, unet.model.diffusion_model, unet.model.computation_dtype))
+    if vae_enabled():
+        vae = sd_model.forge_objects.vae
+        targets.append((compiled_vae_decode, vae.patcher, vae.first_stage_model, vae.vae_dtype))
+
+    recent = load_recent_keys()
+
+    for function, patcher, model, dtype in targets:
+        dtype = str(dtype).replace('torch.', '')
+        keys = [k for k in recent if k[0] == function.name and k[1] == model.__class__.__name__ and k[2][0][2] == dtype][:warmup_keys_limit]
+        if len(keys) == 0:
+            continue
+
+        memory_management.load_models_gpu([patcher])
+        device = patcher.load_device
+
+        for key in keys:
+            args = [rebuild(spec, device) for spec in key[2]]
+            kwargs = {k: rebuild(spec, device) for k, spec in key[3]}
+            try:
+                with torch.inference_mode():
+                    function(model, *args, **kwargs)
+            except Exception as e:
+                print(f'[Compile] Warm-up of {function.name} for {describe(key)} failed: {e}')
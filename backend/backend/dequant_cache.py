@@ -0,0 +1,182 @@
+# Cache of dequantized GGUF and bnb-4bit weights for the duration of one sampling run.
+# Every forward of a quantized Linear dequantizes its full weight, identically for all steps and for cond and uncond.
+# While a run is active, dequantized weights are kept up to a byte budget. When the budget is full, a layer is only
+# admitted if it displaces layers that are used less often per byte they occupy. Everything is dropped when the run ends.
+
+
+import time
+import torch
+
+
+class Entry:
+    def __init__(self, key, tensor, size):
+        self.key = key
+        self.tensor = tensor
+        self.size = size
+
+
+class LayerStats:
+    def __init__(self):
+        self.uses = 0
+        self.hits = 0
+        self.seconds = None
+        self.events = None
+
+
+class DequantizedWeightCache:
+    def __init__(self):
+        self.entries = {}
+        self.layers = {}
+        self.total_size = 0
+        self.budget = 0
+        self.active = False
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def begin(self, budget):
+        self.clear()
+        self.reset_counters()
+        self.budget = int(budget)
+        self.active = self.budget > 0
+
+    def end(self):
+        if not self.active:
+            return None
+
+        stats = self.stats()
+        self.clear()
+        self.active = False
+
+        if stats['hits'] + stats['misses'] > 0:
+            mb = 1024 * 1024
+            print(f"[Dequant Cache] {stats['entries']} layers ({stats['size'] / mb:.2f} MB of {stats['budget'] / mb:.2f} MB), "
+                  f"hits {stats['hits']}, misses {stats['misses']}, evictions {stats['evictions']}, "
+                  f"dequantized in {stats['dequant_seconds']:.2f}s, saved {stats['saved_seconds']:.2f}s")
+
+        return stats
+
+    def clear(self):
+        self.entries.clear()
+        self.layers.clear()
+        self.total_size = 0
+
+    @staticmethod
+    def score(stats, size):
+        return stats.uses / max(size, 1)
+
+    def get(self, layer, weight, weight_args, weight_fn, source=None):
+        """Returns weight_fn(weight) moved to weight_args (device, dtype), from the cache when possible.
+        `source` is the parameter the entry is validated against when `weight` is a prefetched copy of it."""
+
+        if source is None:
+            source = weight
+
+        device = weight_args.get('device', weight.device)
+        dtype = weight_args.get('dtype', None)
+        key = (source.data_ptr(), source.device, str(device), dtype)
+
+        stats = self.layers.get(id(layer))
+        if stats is None:
+            stats = self.layers[id(layer)] = LayerStats()
+        stats.uses += 1
+
+        entry = self.entries.get(id(layer))
+        if entry is not None:
+            if entry.key == key:
+                self.hits += 1
+                stats.hits += 1
+                return entry.tensor
+            self.remove(id(layer))
+
+        self.misses += 1
+
+        measure = stats.seconds is None and stats.events is None
+        if measure and torch.device(device).type == 'cuda':
+            stats.events = (torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True))
+            stats.events[0].record()
+        start = time.perf_counter()
+
+        result = weight.to(device=device) if weight.device != torch.device(device) else weight
+        result = weight_fn(result)
+        result = result.to(**weight_args)
+
+        if measure:
+            if stats.events is not None:
+                stats.events[1].record()
+            else:
+                stats.seconds = time.perf_counter() - start
+
+        self.admit(id(layer), Entry(key, result, result.numel() * result.element_size()), stats)
+        return result
+
+    def admit(self, layer_id, entry, stats):
+        if entry.size > self.budget:
+            self.rejected += 1
+            return
+
+        needed = self.total_size + entry.size - self.budget
+        victims = []
+
+        if needed > 0:
+            candidate = self.score(stats, entry.size)
+            ranked = sorted(self.entries.items(), key=lambda x: self.score(self.layers[x[0]], x[1].size))
+            for victim_id, victim in ranked:
+                if needed <= 0 or self.score(self.layers[victim_id], victim.size) >= candidate:
+                    break
+                victims.append(victim_id)
+                needed -= victim.size
+
+            if needed > 0:
+                self.rejected += 1
+                return
+
+        for victim_id in victims:
+            self.remove(victim_id)
+            self.evictions += 1
+
+        self.entries[layer_id] = entry
+        self.total_size += entry.size
+
+    def remove(self, layer_id):
+        entry = self.entries.pop(layer_id, None)
+        if entry is not None:
+            self.total_size -= entry.size
+
+    def layer_seconds(self, stats):
+        if stats.seconds is None and stats.events is not None:
+            start, end = stats.events
+            end.synchronize()
+            stats.seconds = start.elapsed_time(end) / 1000.0
+            stats.events = None
+        return stats.seconds
+
+    def stats(self):
+        dequant_seconds = 0.0
+        saved_seconds = 0.0
+
+        for stats in self.layers.values():
+            seconds = self.layer_seconds(stats)
+            if seconds is None:
+                continue
+            dequant_seconds += seconds * (stats.uses - stats.hits)
+            saved_seconds += seconds * stats.hits
+
+        return dict(
+            entries=len(self.entries),
+            size=self.total_size,
+            budget=self.budget,
+            hits=self.hits,
+            misses=self.misses,
+            rejected=self.rejected,
+            evictions=self.evictions,
+            dequant_seconds=dequant_seconds,
+            saved_seconds=saved_seconds,
+        )
+
+
+dequant_cache = DequantizedWeightCache()
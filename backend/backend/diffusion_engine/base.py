@@ -50,6 +50,12 @@ class ForgeDiffusionEngine:
     def decode_first_stage(self, x):
         pass
 
+    @torch.inference_mode()
+    def decode_first_stage_uint8(self, x, check_for_nans=False):
+        """Streaming VAE decode; returns a uint8 numpy array of shape (batch, height, width, 3)."""
+        sample = self.forge_objects.vae.first_stage_model.process_out(x)
+        return self.forge_objects.vae.decode_streaming(sample, check_for_nans=check_for_nans)
+
     def get_prompt_lengths_on_ui(self, prompt):
         return 0, 75
 
@@ -0,0 +1,213 @@
+# Look-ahead prefetch for layers whose weights stay on the offload device (low-VRAM swap).
+# Without it, a swapped layer copies its weights host->device when it runs, so the copy and the layer's computation
+# never overlap. The prefetcher records the order in which swapped layers run during the first forward pass. From then
+# on, when a layer asks for its weights, copies for the next `depth` layers are issued into a fixed ring of device
+# buffers on the mover stream, so transfers overlap the computation of the layers before them and no device memory is
+# allocated per call. Without a mover stream the copies are made synchronously into the same ring.
+
+
+import torch
+
+
+alignment = 256
+
+
+def aligned(n):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def swapped_tensors(layer, offload_device):
+    tensors = [('weight', layer.weight), ('bias', getattr(layer, 'bias', None))]
+    return [(name, t) for name, t in tensors if t is not None and t.device.type == offload_device.type]
+
+
+def is_supported(layer):
+    weight = getattr(layer, 'weight', None)
+    if weight is None:
+        return False
+    # bnb weights keep their quant state next to the data, they stay on the regular path
+    return not hasattr(weight, 'quant_state')
+
+
+def layer_bytes(layer, offload_device):
+    return sum(aligned(t.data.numel() * t.data.element_size()) for _, t in swapped_tensors(layer, offload_device))
+
+
+def ring_bytes(layers, depth):
+    """Upper bound of the device memory a prefetcher over these layers allocates, for any split of them between the
+    device and the offload device: depth + 1 slots the size of the largest layer."""
+
+    sizes = []
+    for layer in layers:
+        if is_supported(layer):
+            tensors = [layer.weight, getattr(layer, 'bias', None)]
+            sizes.append(sum(aligned(t.data.numel() * t.data.element_size()) for t in tensors if t is not None))
+
+    if len(sizes) < 2:
+        return 0
+
+    return max(sizes) * min(max(1, int(depth)) + 1, len(sizes))
+
+
+class StreamMover:
+    """Copies on the mover stream; events order the copies against the compute stream."""
+
+    def __init__(self, mover_stream, compute_stream, context):
+        self.mover_stream = mover_stream
+        self.compute_stream = compute_stream
+        self.context = context
+
+    def copy(self, pairs, release):
+        with self.context(self.mover_stream):
+            if release is not None:
+                self.mover_stream.wait_event(release)
+            for destination, source in pairs:
+                destination.copy_(source, non_blocking=True)
+            return self.mover_stream.record_event()
+
+    def wait(self, ready):
+        if ready is not None:
+            self.compute_stream.wait_event(ready)
+
+    def marker(self):
+        return self.compute_stream.record_event()
+
+    def synchronize(self):
+        self.mover_stream.synchronize()
+
+
+class SyncMover:
+    def copy(self, pairs, release):
+        for destination, source in pairs:
+            destination.copy_(source)
+        return None
+
+    def wait(self, ready):
+        return
+
+    def marker(self):
+        return None
+
+    def synchronize(self):
+        return
+
+
+class Slot:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = None  # None = free, -1 = being used by the current layer, otherwise the layer it holds
+        self.tensors = None
+        self.ready = None
+        self.release = None
+
+
+class LayerPrefetcher:
+    def __init__(self, layers, device, offload_device, depth, mover):
+        self.candidates = {id(m) for m in layers if is_supported(m)}
+        self.device = torch.device(device)
+        self.offload_device = torch.device(offload_device)
+        self.depth = max(1, int(depth))
+        self.mover = mover
+        self.order = []
+        self.position = {}
+        self.recorded = False
+        self.slots = []
+        self.inflight = {}
+        self.current = None
+        self.hits = 0
+        self.misses = 0
+        self.buffer_bytes = 0
+
+    def record(self, layer):
+        if len(self.order) > 0 and layer is self.order[0]:
+            self.finish_recording()
+            return
+
+        if id(layer) not in self.position:
+            self.position[id(layer)] = len(self.order)
+            self.order.append(layer)
+
+    def finish_recording(self):
+        self.recorded = True
+        if len(self.order) < 2:
+            return
+
+        slot_bytes = max(layer_bytes(m, self.offload_device) for m in self.order)
+        count = min(self.depth + 1, len(self.order))
+        self.slots = [Slot(torch.empty(slot_bytes, dtype=torch.uint8, device=self.device)) for _ in range(count)]
+        self.buffer_bytes = slot_bytes * count
+
+    def issue(self, position):
+        slot = next((s for s in self.slots if s.position is None), None)
+        layer = self.order[position]
+        if slot is None or layer_bytes(layer, self.offload_device) > slot.buffer.numel():
+            return False
+
+        offset = 0
+        pairs = []
+        slot.tensors = {}
+        for name, t in swapped_tensors(layer, self.offload_device):
+            data = t.data
+            n = data.numel() * data.element_size()
+            view = slot.buffer[offset:offset + n].view(data.dtype).view(data.shape)
+            pairs.append((view, data))
+            slot.tensors[name] = t.copy_with_data(view) if hasattr(t, 'copy_with_data') else view
+            offset += aligned(n)
+
+        slot.ready = self.mover.copy(pairs, slot.release)
+        slot.position = position
+        self.inflight[position] = slot
+        return True
+
+    def fetch(self, layer):
+        """Returns the layer's (weight, bias) on the device, or None when the regular path should be used."""
+
+        if id(layer) not in self.candidates:
+            return None
+
+        if not self.recorded:
+            self.record(layer)
+
+        position = self.position.get(id(layer))
+        if not self.recorded or position is None or len(self.slots) == 0:
+            return None
+
+        # the previous layer's kernels are all enqueued by now, its slot is free once the compute stream passes here
+        if self.current is not None:
+            self.current.release = self.mover.marker()
+            self.current.position = None
+            self.current = None
+
+        slot = self.inflight.pop(position, None)
+
+        if slot is None:
+            # not the layer that was expected: drop the look-ahead and restart from this one
+            self.misses += 1
+            for stale in self.inflight.values():
+                stale.position = None
+            self.inflight.clear()
+            if not self.issue(position):
+                return None
+            slot = self.inflight.pop(position)
+        else:
+            self.hits += 1
+
+        slot.position = -1
+        self.current = slot
+
+        for k in range(1, min(self.depth, len(self.order) - 1) + 1):
+            following = (position + k) % len(self.order)
+            if following not in self.inflight and not self.issue(following):
+                break
+
+        self.mover.wait(slot.ready)
+        return slot.tensors.get('weight', layer.weight), slot.tensors.get('bias', layer.bias)
+
+    def close(self):
+        self.mover.synchronize()
+        self.slots.clear()
+        self.inflight.clear()
+        self.current = None
+
+    def stats(self):
+        return dict(layers=len(self.order), depth=self.depth, hits=self.hits, misses=self.misses, buffer_bytes=self.buffer_bytes)
@@ -159,6 +159,7 @@ def load_huggingface_component(guess, component_name, lib_name, cls_name, repo_p
                 model.config = unet_config
 
             model.storage_dtype = storage_dtype
+            model.state_dict_dtype = state_dict_dtype
             model.computation_dtype = computation_dtype
             model.load_device = load_device
             model.initial_device = initial_device
@@ -274,7 +275,12 @@ def forge_loader(sd, additional_state_dicts=None):
         state_dicts, estimated_config = split_state_dict(sd, additional_state_dicts=additional_state_dicts)
     except:
         raise ValueError('Failed to recognize model type!')
-    
+
+    unet_quant_cache_filename = backend.args.dynamic_args.get('forge_unet_quant_cache')
+    if unet_quant_cache_filename is not None and estimated_config.unet_target in state_dicts:
+        print(f'Using quantized UNet from cache: {unet_quant_cache_filename}')
+        state_dicts[estimated_config.unet_target] = load_torch_file(unet_quant_cache_filename)
+
     repo_name = estimated_config.huggingface_repo
 
     local_path = os.path.join(dir_path, 'huggingface', repo_name)
@@ -7,8 +7,8 @@ import torch
 import platform
 
 from enum import Enum
-from backend import stream, utils
-from backend.args import args
+from backend import layer_prefetch, metrics, residency, stream, tracing, utils
+from backend.args import args, dynamic_args
 
 
 cpu = torch.device('cpu')
@@ -210,6 +210,7 @@ if args.vae_in_cpu:
     VAE_DTYPES = [torch.float32]
 
 VAE_ALWAYS_TILED = False
+VAE_TILED_THREE_PASS = False
 
 if ENABLE_PYTORCH_ATTENTION:
     torch.backends.cuda.enable_math_sdp(True)
@@ -338,16 +339,18 @@ def state_dict_dtype(state_dict):
 
 
 def bake_gguf_model(model):
-    if getattr(model, 'gguf_baked', False):
-        return
+    # parameters offloaded back to their file mapping are unbaked again, so every load checks all of them
+    baked_any = False
 
     for p in model.parameters():
         gguf_cls = getattr(p, 'gguf_cls', None)
-        if gguf_cls is not None:
+        if gguf_cls is not None and not p.baked:
             gguf_cls.bake(p)
+            baked_any = True
 
-    global signal_empty_cache
-    signal_empty_cache = True
+    if baked_any:
+        global signal_empty_cache
+        signal_empty_cache = True
 
     model.gguf_baked = True
     return model
@@ -447,6 +450,7 @@ class LoadedModel:
         self.device = model.load_device
         self.inclusive_memory = 0
         self.exclusive_memory = 0
+        self.layer_prefetcher = None
 
     def compute_inclusive_exclusive_memory(self):
         self.inclusive_memory = module_size(self.model.model, include_device=self.device)
@@ -474,6 +478,13 @@ class LoadedModel:
         if do_not_need_cpu_swap:
             print('All loaded to GPU.')
         else:
+            prefetch_depth = int(dynamic_args.get('forge_layer_prefetch_depth', 0))
+            if prefetch_depth > 0:
+                # the prefetch ring lives next to the GPU-resident modules, so it comes out of their budget
+                prefetch_ring = layer_prefetch.ring_bytes([m for m in self.real_model.modules() if hasattr(m, 'parameters_manual_cast')], prefetch_depth)
+                model_gpu_memory_when_using_cpu_swap = max(0, model_gpu_memory_when_using_cpu_swap - prefetch_ring)
+                print(f"Layer prefetch ring: {prefetch_ring / (1024 * 1024):.2f} MB")
+
             gpu_modules, gpu_modules_only_extras, cpu_modules = build_module_profile(self.real_model, model_gpu_memory_when_using_cpu_swap)
             pin_memory = PIN_SHARED_MEMORY and is_device_cpu(self.model.offload_device)
 
@@ -504,6 +515,9 @@ class LoadedModel:
                 mem_counter += m.extra_mem
                 swap_counter += m.weight_mem
 
+            if prefetch_depth > 0:
+                self.attach_layer_prefetcher(cpu_modules + gpu_modules_only_extras, prefetch_depth)
+
             swap_flag = 'Shared' if PIN_SHARED_MEMORY else 'CPU'
             method_flag = 'asynchronous' if stream.should_use_stream() else 'blocked'
             print(f"{swap_flag} Swap Loaded ({method_flag} method): {swap_counter / (1024 * 1024):.2f} MB, GPU Loaded: {mem_counter / (1024 * 1024):.2f} MB")
@@ -522,12 +536,38 @@ class LoadedModel:
 
         return self.real_model
 
+    def attach_layer_prefetcher(self, modules, depth):
+        if stream.mover_stream is not None and stream.current_stream is not None:
+            mover = layer_prefetch.StreamMover(stream.mover_stream, stream.current_stream, stream.stream_context())
+        else:
+            mover = layer_prefetch.SyncMover()
+
+        self.layer_prefetcher = layer_prefetch.LayerPrefetcher(modules, self.device, self.model.offload_device, depth, mover)
+        for m in modules:
+            m.forge_prefetcher = self.layer_prefetcher
+
+    def detach_layer_prefetcher(self):
+        if self.layer_prefetcher is None:
+            return
+
+        self.layer_prefetcher.close()
+        stats = self.layer_prefetcher.stats()
+        self.layer_prefetcher = None
+
+        if stats['hits'] + stats['misses'] > 0:
+            print(f"[Layer Prefetch] {stats['layers']} layers, depth {stats['depth']}, hits {stats['hits']}, misses {stats['misses']}, "
+                  f"buffers {stats['buffer_bytes'] / (1024 * 1024):.2f} MB")
+
     def model_unload(self, avoid_model_moving=False):
         if self.model_accelerated:
             for m in self.real_model.modules():
                 if hasattr(m, "prev_parameters_manual_cast"):
                     m.parameters_manual_cast = m.prev_parameters_manual_cast
                     del m.prev_parameters_manual_cast
+                if hasattr(m, "forge_prefetcher"):
+                    del m.forge_prefetcher
+
+            self.detach_layer_prefetcher()
 
             self.model_accelerated = False
 
@@ -560,6 +600,8 @@ def unload_model_clones(model):
 
 
 def free_memory(memory_required, device, keep_loaded=[], free_all=False):
+    wait_for_prefetch()
+
     # this check fully unloads any 'abandoned' models
     for i in range(len(current_loaded_models) - 1, -1, -1):
         if sys.getrefcount(current_loaded_models[i].model) <= 2:
@@ -571,21 +613,25 @@ def free_memory(memory_required, device, keep_loaded=[], free_all=False):
     else:
         print(f"[Unload] Trying to free {memory_required / (1024 * 1024):.2f} MB for {device} with {len(keep_loaded)} models keep loaded ... ", end="")
 
+    candidates = current_loaded_models[::-1]
+    if current_residency_job is not None:
+        candidates = current_residency_job.eviction_order(candidates)
+
     offload_everything = ALWAYS_VRAM_OFFLOAD or vram_state == VRAMState.NO_VRAM
     unloaded_model = False
-    for i in range(len(current_loaded_models) - 1, -1, -1):
+    for shift_model in candidates:
         if not offload_everything:
             free_memory = get_free_memory(device)
             print(f"Current free memory is {free_memory / (1024 * 1024):.2f} MB ... ", end="")
             if free_memory > memory_required:
                 break
-        shift_model = current_loaded_models[i]
         if shift_model.device == device:
             if shift_model not in keep_loaded:
-                m = current_loaded_models.pop(i)
-                print(f"Unload model {m.model.model.__class__.__name__} ", end="")
-                m.model_unload()
-                del m
+                current_loaded_models.remove(shift_model)
+                print(f"Unload model {shift_model.model.model.__class__.__name__} ", end="")
+                if current_residency_job is not None:
+                    current_residency_job.record(shift_model.model, module_size(shift_model.model.model, include_device=device), 0, 'unload')
+                shift_model.model_unload()
                 unloaded_model = True
 
     if unloaded_model:
@@ -611,9 +657,12 @@ def compute_model_gpu_memory_when_using_cpu_swap(current_free_mem, inference_mem
     return int(max(0, suggestion))
 
 
+@tracing.traced('load models to gpu')
 def load_models_gpu(models, memory_required=0, hard_memory_preservation=0):
     global vram_state
 
+    wait_for_prefetch()
+
     execution_start_time = time.perf_counter()
     memory_to_free = max(minimum_inference_memory(), memory_required) + hard_memory_preservation
     memory_for_inference = minimum_inference_memory() + hard_memory_preservation
@@ -630,6 +679,9 @@ def load_models_gpu(models, memory_required=0, hard_memory_preservation=0):
         else:
             models_to_load.append(loaded_model)
 
+    if current_residency_job is not None:
+        current_residency_job.advance(models)
+
     if len(models_to_load) == 0:
         devs = set(map(lambda a: a.device, models_already_loaded))
         for d in devs:
@@ -640,6 +692,7 @@ def load_models_gpu(models, memory_required=0, hard_memory_preservation=0):
         if moving_time > 0.1:
             print(f'Memory cleanup has taken {moving_time:.2f} seconds')
 
+        schedule_prefetch(memory_to_free)
         return
 
     for loaded_model in models_to_load:
@@ -681,12 +734,17 @@ def load_models_gpu(models, memory_required=0, hard_memory_preservation=0):
         if vram_set_state == VRAMState.NO_VRAM:
             model_gpu_memory_when_using_cpu_swap = 0
 
+        model_start_time = time.perf_counter()
         loaded_model.model_load(model_gpu_memory_when_using_cpu_swap)
         current_loaded_models.insert(0, loaded_model)
 
+        if current_residency_job is not None:
+            current_residency_job.record(model, loaded_model.exclusive_memory, time.perf_counter() - model_start_time, 'load')
+
     moving_time = time.perf_counter() - execution_start_time
     print(f'Moving model(s) has taken {moving_time:.2f} seconds')
 
+    schedule_prefetch(memory_to_free)
     return
 
 
@@ -694,6 +752,130 @@ def load_model_gpu(model):
     return load_models_gpu([model])
 
 
+current_residency_job = None
+residency_job_depth = 0
+last_residency_report = None
+prefetch_executor = None
+prefetch_future = None
+
+
+def begin_residency_job(stages, components, prefetch=False):
+    """Declares the stages of a job (lists of component names, see backend.residency) so that free_memory evicts the
+    model needed farthest in the future, and optionally loads the next stage's models while the current one runs.
+    `components` is a callable returning {name: model patcher}.
+    Jobs nest: a job started while another one runs (e.g. a script calling process_images from postprocess_image) keeps
+    the outer job's plan, and only the outermost begin/end pair creates and ends it. Every call must be matched by one
+    end_residency_job call."""
+    global current_residency_job, residency_job_depth
+
+    residency_job_depth += 1
+    if residency_job_depth > 1:
+        return current_residency_job
+
+    wait_for_prefetch()
+
+    device = get_torch_device()
+    patchers = {name: patcher for name, patcher in components().items() if patcher is not None}
+    sizes = {name: patcher.model_size() for name, patcher in patchers.items()}
+    resident = [name for name, patcher in patchers.items() if LoadedModel(patcher) in current_loaded_models]
+    budget = get_free_memory(device) + sum(module_size(m.model.model, include_device=device) for m in current_loaded_models)
+
+    prefetch = prefetch and not is_device_cpu(device) and not ALWAYS_VRAM_OFFLOAD and vram_state not in (VRAMState.LOW_VRAM, VRAMState.NO_VRAM)
+
+    current_residency_job = residency.ResidencyJob(stages, components, sizes, budget, resident, reserve=minimum_inference_memory(), prefetch=prefetch)
+    return current_residency_job
+
+
+def end_residency_job(report=True):
+    global current_residency_job, residency_job_depth, last_residency_report
+
+    residency_job_depth = max(0, residency_job_depth - 1)
+    if residency_job_depth > 0:
+        return None
+
+    wait_for_prefetch()
+
+    job = current_residency_job
+    current_residency_job = None
+
+    if job is None:
+        return None
+
+    last_residency_report = job.report()
+    if report:
+        print(job.summary())
+
+    return last_residency_report
+
+
+def schedule_prefetch(memory_required):
+    """Starts loading the models planned for the next stage in the background, if they fit next to the memory the
+    current stage needs. Copies are issued on the mover stream when one exists, so they overlap the current stage."""
+    global prefetch_executor, prefetch_future
+
+    if current_residency_job is None or prefetch_future is not None:
+        return
+
+    to_prefetch = []
+    for model in current_residency_job.prefetch_candidates():
+        loaded_model = LoadedModel(model)
+        if loaded_model in current_loaded_models or is_device_cpu(loaded_model.device):
+            continue
+        loaded_model.compute_inclusive_exclusive_memory()
+        memory_required += loaded_model.exclusive_memory * 1.3
+        if get_free_memory(loaded_model.device) < memory_required:
+            break
+        unload_model_clones(model)
+        to_prefetch.append(loaded_model)
+
+    if len(to_prefetch) == 0:
+        return
+
+    def task():
+        results = []
+        with torch.no_grad():
+            context = stream.stream_context() if stream.mover_stream is not None else None
+            for loaded_model in to_prefetch:
+                start = time.perf_counter()
+                if context is not None:
+                    with context(stream.mover_stream):
+                        loaded_model.model_load()
+                else:
+                    loaded_model.model_load()
+                results.append((loaded_model, time.perf_counter() - start))
+        return results
+
+    if prefetch_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='forge-prefetch')
+
+    prefetch_future = prefetch_executor.submit(task)
+
+
+def wait_for_prefetch():
+    global prefetch_future
+
+    if prefetch_future is None:
+        return
+
+    future = prefetch_future
+    prefetch_future = None
+
+    try:
+        results = future.result()
+    except Exception as e:
+        print(f'[Residency] Prefetch failed: {e}')
+        return
+
+    if stream.mover_stream is not None and stream.current_stream is not None:
+        stream.current_stream.wait_stream(stream.mover_stream)
+
+    for loaded_model, seconds in results:
+        current_loaded_models.insert(0, loaded_model)
+        if current_residency_job is not None:
+            current_residency_job.record(loaded_model.model, loaded_model.exclusive_memory, seconds, 'load', prefetched=True)
+
+
 def cleanup_models():
     to_delete = []
     for i in range(len(current_loaded_models)):
@@ -706,6 +888,23 @@ def cleanup_models():
         del x
 
 
+def unload_models_by_module(modules):
+    ids = {id(m) for m in modules}
+    unloaded_model = False
+
+    for i in range(len(current_loaded_models) - 1, -1, -1):
+        if id(current_loaded_models[i].model.model) in ids:
+            m = current_loaded_models.pop(i)
+            m.model_unload()
+            del m
+            unloaded_model = True
+
+    if unloaded_model:
+        soft_empty_cache()
+
+    return unloaded_model
+
+
 def dtype_size(dtype):
     dtype_size = 4
     if dtype == torch.float16 or dtype == torch.bfloat16:
@@ -1205,5 +1404,42 @@ def soft_empty_cache(force=False):
     return
 
 
+def device_memory_metrics():
+    device = get_torch_device()
+    if is_device_cuda(device):
+        free, total = torch.cuda.mem_get_info(device)
+        return {('allocated',): torch.cuda.memory_allocated(device), ('reserved',): torch.cuda.memory_reserved(device), ('free',): free, ('total',): total}
+    if is_intel_xpu():
+        return {('allocated',): torch.xpu.memory_allocated(device), ('reserved',): torch.xpu.memory_reserved(device)}
+    return {}
+
+
+metrics.device_memory.add_source(device_memory_metrics)
+metrics.resident_memory.add_source(lambda: psutil.Process().memory_info().rss)
+
+
+def reserve_inference_memory(memory_required, device=None):
+    # Allocates and frees one block of memory_required bytes. The CUDA caching allocator keeps it as a single free
+    # segment, and the activations of the following sampling run are split from it instead of being allocated one
+    # segment at a time. Skipped when it would not fit next to the loaded models; soft_empty_cache releases it.
+    if device is None:
+        device = get_torch_device()
+
+    if not is_device_cuda(device) or directml_enabled:
+        return False
+
+    memory_required = int(memory_required)
+    if get_free_memory(device) - minimum_inference_memory() < memory_required:
+        return False
+
+    try:
+        block = torch.empty(memory_required, dtype=torch.uint8, device=device)
+        del block
+    except OOM_EXCEPTION:
+        return False
+
+    return True
+
+
 def unload_all_models():
     free_memory(1e30, get_torch_device(), free_all=True)
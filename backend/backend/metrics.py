@@ -0,0 +1,194 @@
+# Process-wide metrics in the Prometheus text exposition format.
+# Counters and histograms are updated in place where the work happens (a dict lookup and an addition under a lock),
+# so a scrape only formats the current values. Gauges and counters that other components already maintain (queue
+# length, memory, existing cache statistics) are read through callbacks at scrape time; those callbacks must be cheap.
+
+
+import math
+import time
+import functools
+import threading
+
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.sources = []
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.label_names)
+
+    def add_source(self, function):
+        """function() returns {label tuple: value} (or a number when the metric has no labels), read at scrape time."""
+
+        self.sources.append(function)
+
+    def collect(self):
+        with self.lock:
+            values = dict(self.values)
+
+        for function in self.sources:
+            try:
+                result = function()
+            except Exception:
+                continue
+            if not isinstance(result, dict):
+                result = {(): result}
+            for key, value in result.items():
+                key = key if isinstance(key, tuple) else (key,)
+                values[key] = values.get(key, 0) + value
+
+        return values
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class HistogramValue:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=default_buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = HistogramValue(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry.counts[i] += 1
+                    break
+            entry.sum += value
+            entry.count += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted((key, list(v.counts), v.sum, v.count) for key, v in self.values.items())
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, key, ("le", format_value(float(bound))))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, key)} {count}')
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+jobs = Counter('forge_jobs_total', 'Generation jobs finished', ['kind', 'status'])
+job_seconds = Histogram('forge_job_duration_seconds', 'Time to run a generation job, excluding the queue', ['kind'])
+images = Counter('forge_images_generated_total', 'Images generated, grids excluded', ['kind'])
+queue_depth = Gauge('forge_queue_depth', 'Jobs waiting for the queue lock')
+api_request_seconds = Histogram('forge_api_request_duration_seconds', 'Time to handle API requests', ['handler', 'method'])
+queue_wait_seconds = Histogram('forge_queue_wait_seconds', 'Time jobs waited for the queue lock', ['source'])
+sampling_steps = Counter('forge_sampling_steps_total', 'Denoiser steps run; rate() over forge_sampling_seconds_total gives it/s', ['sampler'])
+sampling_seconds = Counter('forge_sampling_seconds_total', 'Time spent in denoiser steps', ['sampler'])
+model_loads = Counter('forge_model_loads_total', 'Checkpoint loads')
+model_load_seconds = Histogram('forge_model_load_duration_seconds', 'Time to load a checkpoint')
+cache_requests = Counter('forge_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+vae_seconds = Histogram('forge_vae_duration_seconds', 'Time to run the VAE on a batch', ['operation'])
+resident_memory = Gauge('forge_process_resident_memory_bytes', 'Resident set size of the process')
+device_memory = Gauge('forge_device_memory_bytes', 'Memory of the torch device', ['kind'])
+
+
+def cache_hit(cache):
+    cache_requests.inc(cache=cache, result='hit')
+
+
+def cache_miss(cache):
+    cache_requests.inc(cache=cache, result='miss')
+
+
+def cache_info_source(cache, cache_info):
+    """Reads hits and misses of a functools.lru_cache, e.g. cache_info_source('lora_file', f.cache_info)."""
+
+    def source():
+        info = cache_info()
+        return {(cache, 'hit'): info.hits, (cache, 'miss'): info.misses}
+
+    cache_requests.add_source(source)
+
+
+def timed(histogram, **labels):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
@@ -1,6 +1,6 @@
 import torch
 
-from backend import memory_management, attention
+from backend import memory_management, attention, compilation
 from backend.modules.k_prediction import k_prediction_from_diffusers_scheduler
 
 
@@ -16,6 +16,7 @@ class KModel(torch.nn.Module):
         print(f'K-Model Created: {dict(storage_dtype=self.storage_dtype, computation_dtype=self.computation_dtype)}')
 
         self.diffusion_model = model
+        self.compile_allowed = False
 
         if k_predictor is None:
             self.predictor = k_prediction_from_diffusers_scheduler(diffusers_scheduler)
@@ -42,7 +43,10 @@ class KModel(torch.nn.Module):
                     extra = extra.to(dtype)
             extra_conds[o] = extra
 
-        model_output = self.diffusion_model(xc, t, context=context, control=control, transformer_options=transformer_options, **extra_conds).float()
+        if self.compile_allowed and compilation.is_plain_graph(control, transformer_options):
+            model_output = compilation.compiled_unet(self.diffusion_model, xc, t, context, **extra_conds).float()
+        else:
+            model_output = self.diffusion_model(xc, t, context=context, control=control, transformer_options=transformer_options, **extra_conds).float()
         return self.predictor.calculate_denoised(sigma, model_output, x)
 
     def memory_required(self, input_shape):
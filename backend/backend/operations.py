@@ -5,13 +5,14 @@ import torch
 import contextlib
 
 from backend import stream, memory_management, utils
+from backend.dequant_cache import dequant_cache
 from backend.patcher.lora import merge_lora_to_weight
 
 
 stash = {}
 
 
-def get_weight_and_bias(layer, weight_args=None, bias_args=None, weight_fn=None, bias_fn=None):
+def get_weight_and_bias(layer, weight_args=None, bias_args=None, weight_fn=None, bias_fn=None, prefetched=None):
     patches = getattr(layer, 'forge_online_loras', None)
     weight_patches, bias_patches = None, None
 
@@ -21,10 +22,15 @@ def get_weight_and_bias(layer, weight_args=None, bias_args=None, weight_fn=None,
     if patches is not None:
         bias_patches = patches.get('bias', None)
 
+    if prefetched is None:
+        prefetched = layer.weight, layer.bias
+
     weight = None
     if layer.weight is not None:
-        weight = layer.weight
-        if weight_fn is not None:
+        weight = prefetched[0]
+        if weight_fn is not None and weight_args is not None and dequant_cache.active:
+            weight = dequant_cache.get(layer, weight, weight_args, weight_fn, source=layer.weight)
+        elif weight_fn is not None:
             if weight_args is not None:
                 fn_device = weight_args.get('device', None)
                 if fn_device is not None:
@@ -37,7 +43,7 @@ def get_weight_and_bias(layer, weight_args=None, bias_args=None, weight_fn=None,
 
     bias = None
     if layer.bias is not None:
-        bias = layer.bias
+        bias = prefetched[1]
         if bias_fn is not None:
             if bias_args is not None:
                 fn_device = bias_args.get('device', None)
@@ -71,7 +77,13 @@ def weights_manual_cast(layer, x, skip_weight_dtype=False, skip_bias_dtype=False
     else:
         bias_args = dict(device=target_device, dtype=target_dtype, non_blocking=non_blocking)
 
-    if stream.should_use_stream():
+    prefetcher = getattr(layer, 'forge_prefetcher', None)
+    prefetched = prefetcher.fetch(layer) if prefetcher is not None else None
+
+    if prefetched is not None:
+        # already ordered against the compute stream by the prefetcher
+        weight, bias = get_weight_and_bias(layer, weight_args, bias_args, weight_fn=weight_fn, bias_fn=bias_fn, prefetched=prefetched)
+    elif stream.should_use_stream():
         with stream.stream_context()(stream.mover_stream):
             weight, bias = get_weight_and_bias(layer, weight_args, bias_args, weight_fn=weight_fn, bias_fn=bias_fn)
             signal = stream.mover_stream.record_event()
@@ -358,7 +370,7 @@ try:
                     # And it only invokes one time, and most linear does not have bias
                     self.bias = utils.tensor2parameter(self.bias.to(x.dtype))
 
-                if hasattr(self, 'forge_online_loras'):
+                if hasattr(self, 'forge_online_loras') or (dequant_cache.active and self.weight.bnb_quantized):
                     weight, bias, signal = weights_manual_cast(self, x, weight_fn=functional_dequantize_4bit, bias_fn=None, skip_bias_dtype=True)
                     with main_stream_worker(weight, bias, signal):
                         return torch.nn.functional.linear(x, weight, bias)
@@ -16,6 +16,19 @@ quants_mapping = {
 }
 
 
+def reader_tensor_data(tensor):
+    data = tensor.data
+
+    if isinstance(data, torch.Tensor):
+        return data
+
+    if not data.dtype.isnative:
+        return torch.tensor(data)
+
+    # zero-copy view of the reader's memmap; pages are read on first access and shared with the page cache
+    return torch.from_numpy(data)
+
+
 class ParameterGGUF(torch.nn.Parameter):
     def __init__(self, tensor=None, requires_grad=False, no_init=False):
         super().__init__()
@@ -26,6 +39,7 @@ class ParameterGGUF(torch.nn.Parameter):
         self.real_shape = torch.Size(reversed(list(tensor.shape)))
         self.computation_dtype = torch.float16
         self.baked = False
+        self.mapped_data = self.data if self.device.type == 'cpu' else None
         return
 
     @property
@@ -33,7 +47,7 @@ class ParameterGGUF(torch.nn.Parameter):
         return self.real_shape
 
     def __new__(cls, tensor=None, requires_grad=False, no_init=False):
-        return super().__new__(cls, torch.tensor(tensor.data), requires_grad=requires_grad)
+        return super().__new__(cls, reader_tensor_data(tensor), requires_grad=requires_grad)
 
     def dequantize_as_pytorch_parameter(self):
         if self.gguf_cls is not None:
@@ -46,9 +60,18 @@ class ParameterGGUF(torch.nn.Parameter):
         new.real_shape = self.real_shape
         new.computation_dtype = self.computation_dtype
         new.baked = self.baked
+        new.mapped_data = self.mapped_data
         return new
 
     def to(self, *args, **kwargs):
+        device, dtype, non_blocking, memory_format = torch._C._nn._parse_to(*args, **kwargs)
+
+        if self.mapped_data is not None and device is not None and device.type == 'cpu' and self.device.type != 'cpu' and dtype is None:
+            # unmodified weights go back to the file mapping instead of a fresh host copy; they are baked again on load
+            new = self.copy_with_data(self.mapped_data)
+            new.baked = False
+            return new
+
         return self.copy_with_data(self.data.to(*args, **kwargs))
 
     def pin_memory(self, device=None):
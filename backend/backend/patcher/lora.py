@@ -3,7 +3,7 @@ import torch
 import packages_3rdparty.webui_lora_collection.lora as lora_utils_webui
 import packages_3rdparty.comfyui_lora_collection.lora as lora_utils_comfyui
 
-from backend import memory_management, utils
+from backend import memory_management, metrics, utils, tracing
 
 
 extra_weight_calculators = {}
@@ -303,8 +303,13 @@ class LoraLoader:
         hashes = str(list(lora_patches.keys()))
 
         if hashes == self.loaded_hash and not force_refresh:
+            if len(lora_patches) > 0:
+                metrics.cache_hit('lora_merge')
             return
 
+        metrics.cache_miss('lora_merge')
+        span = tracing.open_span('lora merge', loras=len(lora_patches))
+
         # Merge Patches
 
         all_patches = {}
@@ -394,4 +399,5 @@ class LoraLoader:
 
         set_parameter_devices(self.model, parameter_devices=parameter_devices)
         self.loaded_hash = hashes
+        tracing.close_span(span)
         return
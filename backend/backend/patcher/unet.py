@@ -118,6 +118,11 @@ class UnetPatcher(ModelPatcher):
         self.append_model_option('sampler_pre_cfg_function', modifier, ensure_uniqueness)
         return
 
+    def set_reserve_inference_memory(self, enabled=True):
+        # Allocate and free the estimated inference memory right before sampling, see memory_management.reserve_inference_memory
+        self.model_options['reserve_inference_memory'] = enabled
+        return
+
     def set_memory_peak_estimation_modifier(self, modifier):
         self.model_options['memory_peak_estimation_modifier'] = modifier
         return
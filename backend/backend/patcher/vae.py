@@ -1,12 +1,17 @@
 import torch
 import math
 import itertools
+import numpy as np
 
 from tqdm import trange
-from backend import memory_management
+from backend import memory_management, compilation, metrics, tracing
 from backend.patcher.base import ModelPatcher
 
 
+class VAEDecodeNaNException(Exception):
+    pass
+
+
 @torch.inference_mode()
 def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu"):
     dims = len(tile)
@@ -49,6 +54,79 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_am
     return output
 
 
+def get_tile_positions(size, tile, overlap):
+    if size <= tile:
+        return [0]
+
+    positions = list(range(0, size - tile, tile - overlap))
+    positions.append(size - tile)
+    return positions
+
+
+def get_feather_mask(shape, feather, device="cpu"):
+    # Separable linear ramp over `feather` elements at every tile edge, same weights as tiled_scale_multidim.
+    mask = torch.ones(shape, device=device)
+
+    for d, size in enumerate(shape):
+        f = min(feather, size // 2)
+        if f <= 0:
+            continue
+
+        view = [1] * len(shape)
+        view[d] = f
+        ramp = (torch.arange(1, f + 1, dtype=torch.float32, device=device) / f).view(view)
+        mask.narrow(d, 0, f).mul_(ramp)
+        mask.narrow(d, size - f, f).mul_(ramp.flip(d))
+
+    return mask
+
+
+@torch.inference_mode()
+def tiled_scale_feathered(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu", tile_batch_size=1):
+    # Single-pass tiling: all tiles have the same size (the last tile in each dimension is shifted back to the edge),
+    # so they can be stacked and passed through `function` in batches, and one precomputed blend mask serves them all.
+    dims = len(tile)
+    spatial = samples.shape[2:]
+    tile = [min(t, s) for t, s in zip(tile, spatial)]
+    out_spatial = [round(s * upscale_amount) for s in spatial]
+
+    output = torch.zeros([samples.shape[0], out_channels] + out_spatial, device=output_device)
+    weights = torch.zeros([samples.shape[0], 1] + out_spatial, device=output_device)
+
+    positions = list(itertools.product(*[get_tile_positions(s, t, overlap) for s, t in zip(spatial, tile)]))
+    jobs = [(b, pos) for b in range(samples.shape[0]) for pos in positions]
+    tile_batch_size = max(1, int(tile_batch_size))
+
+    mask = None
+    for i in trange(0, len(jobs), tile_batch_size):
+        batch = jobs[i:i + tile_batch_size]
+
+        tiles = []
+        for b, pos in batch:
+            s = samples[b:b + 1]
+            for d in range(dims):
+                s = s.narrow(d + 2, pos[d], tile[d])
+            tiles.append(s)
+
+        ps = function(torch.cat(tiles)).to(output_device)
+
+        if mask is None:
+            mask = get_feather_mask(ps.shape[2:], round(overlap * upscale_amount), output_device)
+
+        for (b, pos), p in zip(batch, ps):
+            o = output[b]
+            w = weights[b]
+            for d in range(dims):
+                o = o.narrow(d + 1, round(pos[d] * upscale_amount), mask.shape[d])
+                w = w.narrow(d + 1, round(pos[d] * upscale_amount), mask.shape[d])
+
+            o += p * mask
+            w += mask
+
+    output /= weights
+    return output
+
+
 def get_tiled_scale_steps(width, height, tile_x, tile_y, overlap):
     return math.ceil((height / (tile_y - overlap))) * math.ceil((width / (tile_x - overlap)))
 
@@ -101,7 +179,44 @@ class VAE:
         n.output_device = self.output_device
         return n
 
+    def plan_tiles(self, shape, tile, overlap, memory_used):
+        """
+        Returns (tile, tile_batch_size) for single-pass tiling of a tensor with the given NCHW shape.
+        The tile is shrunk until one tile fits into free memory, then as many tiles as fit are batched together.
+        """
+
+        free_memory = memory_management.get_free_memory(self.device)
+        tile = min(tile, max(shape[2], shape[3]))
+        tile_memory = lambda t: memory_used((1, shape[1], min(t, shape[2]), min(t, shape[3])), self.vae_dtype)
+
+        while tile > overlap * 2 and tile_memory(tile) > free_memory:
+            tile = max(overlap * 2, tile // 2)
+
+        tile_count = len(get_tile_positions(shape[2], tile, overlap)) * len(get_tile_positions(shape[3], tile, overlap)) * shape[0]
+        tile_batch_size = max(1, min(tile_count, int(free_memory / max(1, tile_memory(tile)))))
+        return tile, tile_batch_size
+
     def decode_tiled_(self, samples, tile_x=64, tile_y=64, overlap=16):
+        if memory_management.VAE_TILED_THREE_PASS:
+            return self.decode_tiled_three_pass_(samples, tile_x, tile_y, overlap)
+
+        tile, tile_batch_size = self.plan_tiles(samples.shape, max(tile_x, tile_y), overlap, self.memory_used_decode)
+
+        decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
+        output = tiled_scale_feathered(samples, decode_fn, (tile, tile), overlap, upscale_amount=self.downscale_ratio, output_device=self.output_device, tile_batch_size=tile_batch_size)
+        return torch.clamp((output + 1.0) / 2.0, min=0.0, max=1.0)
+
+    def encode_tiled_(self, pixel_samples, tile_x=512, tile_y=512, overlap=64):
+        if memory_management.VAE_TILED_THREE_PASS:
+            return self.encode_tiled_three_pass_(pixel_samples, tile_x, tile_y, overlap)
+
+        tile, tile_batch_size = self.plan_tiles(pixel_samples.shape, max(tile_x, tile_y), overlap, self.memory_used_encode)
+        tile = max(self.downscale_ratio, tile // self.downscale_ratio * self.downscale_ratio)
+
+        encode_fn = lambda a: self.first_stage_model.encode((2. * a - 1.).to(self.vae_dtype).to(self.device)).float()
+        return tiled_scale_feathered(pixel_samples, encode_fn, (tile, tile), overlap, upscale_amount=(1 / self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, tile_batch_size=tile_batch_size)
+
+    def decode_tiled_three_pass_(self, samples, tile_x=64, tile_y=64, overlap=16):
         steps = samples.shape[0] * get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x, tile_y, overlap)
         steps += samples.shape[0] * get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += samples.shape[0] * get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x * 2, tile_y // 2, overlap)
@@ -113,7 +228,7 @@ class VAE:
                               / 3.0) / 2.0, min=0.0, max=1.0)
         return output
 
-    def encode_tiled_(self, pixel_samples, tile_x=512, tile_y=512, overlap=64):
+    def encode_tiled_three_pass_(self, pixel_samples, tile_x=512, tile_y=512, overlap=64):
         steps = pixel_samples.shape[0] * get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x, tile_y, overlap)
         steps += pixel_samples.shape[0] * get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += pixel_samples.shape[0] * get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x * 2, tile_y // 2, overlap)
@@ -139,7 +254,7 @@ class VAE:
             pixel_samples = torch.empty((samples_in.shape[0], 3, round(samples_in.shape[2] * self.downscale_ratio), round(samples_in.shape[3] * self.downscale_ratio)), device=self.output_device)
             for x in range(0, samples_in.shape[0], batch_number):
                 samples = samples_in[x:x + batch_number].to(self.vae_dtype).to(self.device)
-                pixel_samples[x:x + batch_number] = torch.clamp((self.first_stage_model.decode(samples).to(self.output_device).float() + 1.0) / 2.0, min=0.0, max=1.0)
+                pixel_samples[x:x + batch_number] = torch.clamp((compilation.vae_decode(self, samples).to(self.output_device).float() + 1.0) / 2.0, min=0.0, max=1.0)
         except memory_management.OOM_EXCEPTION as e:
             print("Warning: Ran out of memory when regular VAE decoding, retrying with tiled VAE decoding.")
             pixel_samples = self.decode_tiled_(samples_in)
@@ -147,6 +262,8 @@ class VAE:
         pixel_samples = pixel_samples.to(self.output_device).movedim(1, -1)
         return pixel_samples
 
+    @tracing.traced('vae decode')
+    @metrics.timed(metrics.vae_seconds, operation='decode')
     def decode(self, samples_in):
         wrapper = self.patcher.model_options.get('model_vae_decode_wrapper', None)
         if wrapper is None:
@@ -154,6 +271,72 @@ class VAE:
         else:
             return wrapper(self.decode_inner, samples_in)
 
+    def plan_band_rows(self, shape, overlap, max_rows=128):
+        free_memory = memory_management.get_free_memory(self.device)
+        row_memory = max(1, self.memory_used_decode((1, shape[1], 1, shape[3]), self.vae_dtype))
+        return max(overlap * 2, min(max_rows, shape[2], int(free_memory / row_memory)))
+
+    @tracing.traced('vae decode')
+    @metrics.timed(metrics.vae_seconds, operation='decode')
+    @torch.inference_mode()
+    def decode_streaming(self, samples_in, band_rows=None, overlap=8, check_for_nans=False):
+        """
+        Decodes latents in full-width horizontal bands and converts every finished band straight to uint8, so peak memory
+        is bounded by the band size rather than the image size. Rows shared by neighbouring bands are blended linearly.
+        Returns a uint8 numpy array of shape (batch, height, width, 3). With check_for_nans, raises VAEDecodeNaNException
+        as soon as a band decodes to NaNs, since they would be lost in the uint8 conversion.
+        """
+
+        batch, channels, height, width = samples_in.shape
+        memory_management.load_models_gpu([self.patcher], memory_required=self.memory_used_decode((1, channels, min(height, band_rows or overlap * 2), width), self.vae_dtype))
+
+        if band_rows is None:
+            band_rows = self.plan_band_rows(samples_in.shape, overlap)
+
+        while True:
+            try:
+                return self.decode_streaming_(samples_in, band_rows, overlap, check_for_nans)
+            except memory_management.OOM_EXCEPTION:
+                if band_rows <= overlap * 2:
+                    raise
+
+                print("Warning: Ran out of memory when streaming VAE decoding, retrying with smaller bands.")
+                memory_management.soft_empty_cache()
+                band_rows = max(overlap * 2, band_rows // 2)
+
+    def decode_streaming_(self, samples_in, band_rows, overlap, check_for_nans=False):
+        batch, channels, height, width = samples_in.shape
+        ratio = self.downscale_ratio
+
+        band_rows = min(height, band_rows)
+        positions = get_tile_positions(height, band_rows, overlap)
+        output = np.empty((batch, height * ratio, width * ratio, 3), dtype=np.uint8)
+
+        for b in range(batch):
+            carry = None
+
+            for i, start in enumerate(positions):
+                band = samples_in[b:b + 1, :, start:start + band_rows].to(self.vae_dtype).to(self.device)
+                pixels = self.first_stage_model.decode(band)[0].float()
+
+                if check_for_nans and torch.isnan(pixels).any():
+                    raise VAEDecodeNaNException(f'A tensor with NaNs was produced by the VAE in {self.vae_dtype}.')
+
+                if carry is not None:
+                    n = carry.shape[1]
+                    w = ((torch.arange(n, device=pixels.device, dtype=torch.float32) + 0.5) / n)[:, None]
+                    pixels[:, :n] = carry * (1.0 - w) + pixels[:, :n] * w
+
+                top = start * ratio
+                end = positions[i + 1] * ratio if i + 1 < len(positions) else (start + band_rows) * ratio
+                carry = pixels[:, end - top:]
+
+                rows = torch.clamp((pixels[:, :end - top] + 1.0) / 2.0, min=0.0, max=1.0)
+                output[b, top:end] = (255. * rows).to(torch.uint8).movedim(0, -1).cpu().numpy()
+
+        return output
+
+    @tracing.traced('vae decode')
     def decode_tiled(self, samples, tile_x=64, tile_y=64, overlap=16):
         memory_management.load_model_gpu(self.patcher)
         output = self.decode_tiled_(samples, tile_x, tile_y, overlap)
@@ -183,6 +366,8 @@ class VAE:
 
         return samples
 
+    @tracing.traced('vae encode')
+    @metrics.timed(metrics.vae_seconds, operation='encode')
     def encode(self, pixel_samples):
         wrapper = self.patcher.model_options.get('model_vae_encode_wrapper', None)
         if wrapper is None:
@@ -190,6 +375,7 @@ class VAE:
         else:
             return wrapper(self.encode_inner, pixel_samples)
 
+    @tracing.traced('vae encode')
     def encode_tiled(self, pixel_samples, tile_x=512, tile_y=512, overlap=64):
         memory_management.load_model_gpu(self.patcher)
         pixel_samples = pixel_samples.movedim(-1, 1)
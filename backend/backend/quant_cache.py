@@ -0,0 +1,148 @@
+# On-disk cache of quantized UNet weights.
+# Selecting a bnb (nf4/fp4) or float8 storage dtype for a fp16/fp32 checkpoint quantizes the whole UNet on every load.
+# After the first load the quantized state dict (the same format as ForgeDiffusionEngine.save_unet) is stored here,
+# keyed by checkpoint hash, storage dtype and forge version, and later loads read it instead of converting again.
+# Entries are evicted least recently used first when the cache grows beyond its size limit.
+#
+# Maintenance from the command line (from the backend directory):
+#     python -m backend.quant_cache --list
+#     python -m backend.quant_cache --prune 20
+#     python -m backend.quant_cache --clear
+
+
+import os
+import re
+import json
+import time
+import argparse
+
+import torch
+import safetensors.torch
+
+
+cacheable_dtypes = {
+    'nf4': 'nf4',
+    'fp4': 'fp4',
+    torch.float8_e4m3fn: 'fp8_e4m3fn',
+    torch.float8_e5m2: 'fp8_e5m2',
+}
+
+
+def is_cacheable(storage_dtype, state_dict_dtype=None):
+    if state_dict_dtype is not None and state_dict_dtype == storage_dtype:
+        # the checkpoint is already stored this way (e.g. fp8 or nf4 checkpoints), a cached copy would not save any work
+        return False
+
+    if storage_dtype in ['nf4', 'fp4']:
+        # bnb weights are quantized when moved to a CUDA device, see utils.get_state_dict_after_quant
+        return torch.cuda.is_available()
+
+    return storage_dtype in cacheable_dtypes
+
+
+class QuantizedUNetCache:
+    def __init__(self, directory, max_size=0):
+        self.directory = directory
+        self.max_size = max_size
+
+    def filename(self, checkpoint_hash, storage_dtype, version):
+        name = f'{checkpoint_hash[:16]}-{cacheable_dtypes[storage_dtype]}-{version}'
+        name = re.sub(r'[^\w.\-]', '_', name)
+        return os.path.join(self.directory, name + '.safetensors')
+
+    def has(self, filename):
+        if not os.path.isfile(filename):
+            return False
+
+        # mark as recently used
+        os.utime(filename)
+        return True
+
+    def put(self, filename, state_dict, metadata=None):
+        os.makedirs(self.directory, exist_ok=True)
+
+        metadata = {k: str(v) for k, v in (metadata or {}).items()}
+        temporary_filename = filename + '.tmp'
+        safetensors.torch.save_file({k: v.contiguous() for k, v in state_dict.items()}, temporary_filename, metadata=metadata)
+        os.replace(temporary_filename, filename)
+
+        print(f'Stored quantized UNet in cache: {filename} ({os.path.getsize(filename) / (1024 ** 3):.2f} GB)')
+
+        self.prune(keep=filename)
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+
+        result = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.safetensors'):
+                stat = entry.stat()
+                result.append(dict(filename=entry.path, size=stat.st_size, last_used=stat.st_mtime))
+
+        return sorted(result, key=lambda x: x['last_used'])
+
+    def prune(self, max_size=None, keep=None):
+        max_size = self.max_size if max_size is None else max_size
+        if max_size <= 0:
+            return []
+
+        entries = self.entries()
+        total = sum(x['size'] for x in entries)
+        removed = []
+
+        for entry in entries:
+            if total <= max_size:
+                break
+            if entry['filename'] == keep:
+                continue
+
+            os.remove(entry['filename'])
+            total -= entry['size']
+            removed.append(entry['filename'])
+            print(f'Removed quantized UNet from cache: {entry["filename"]}')
+
+        return removed
+
+    def clear(self):
+        removed = []
+        for entry in self.entries():
+            os.remove(entry['filename'])
+            removed.append(entry['filename'])
+
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    os.remove(os.path.join(self.directory, name))
+
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the cache of quantized UNet weights.')
+    parser.add_argument('--dir', default=os.path.join('models', 'quant-cache'), help='cache directory')
+    parser.add_argument('--list', action='store_true', help='list cached entries, least recently used first')
+    parser.add_argument('--prune', type=float, default=None, metavar='GB', help='remove least recently used entries until the cache fits in GB')
+    parser.add_argument('--clear', action='store_true', help='remove all entries')
+    args = parser.parse_args()
+
+    cache = QuantizedUNetCache(args.dir)
+
+    if args.clear:
+        print(f'Removed {len(cache.clear())} entries.')
+    elif args.prune is not None:
+        print(f'Removed {len(cache.prune(max_size=int(args.prune * 1024 ** 3)))} entries.')
+
+    if args.list or not (args.clear or args.prune is not None):
+        total = 0
+        for entry in cache.entries():
+            total += entry['size']
+            with safetensors.safe_open(entry['filename'], framework='pt') as f:
+                metadata = f.metadata() or {}
+            print(f'{os.path.basename(entry["filename"])}: {entry["size"] / (1024 ** 3):.2f} GB, '
+                  f'last used {time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))}, {json.dumps(metadata)}')
+        print(f'Total: {total / (1024 ** 3):.2f} GB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# Residency planner for the models used by one generation job.
+# A job declares the order in which it uses its components (text encoder -> UNet -> VAE -> upscaler -> ...). The planner
+# decides which components stay on the device and which are swapped out: when memory runs out, the resident component
+# whose next use is farthest away is evicted first. Components of the next stage that fit next to the current stage are
+# marked for prefetching, so their transfer can overlap the current stage.
+# This module has no torch dependency; memory_management feeds it sizes and budgets, so plans can be simulated on CPU.
+
+
+import time
+
+
+infinity = float('inf')
+
+
+class Stage:
+    def __init__(self, name, components, reserve=0):
+        self.name = name
+        self.components = list(components)
+        self.reserve = reserve
+
+
+class StepPlan:
+    def __init__(self, stage):
+        self.stage = stage
+        self.load = []
+        self.evict = []
+        self.prefetch = []
+        self.swap = []
+        self.resident = []
+
+
+class ResidencyPlan:
+    def __init__(self, steps, sizes, budget):
+        self.steps = steps
+        self.sizes = sizes
+        self.budget = budget
+
+    def transfer_bytes(self):
+        return sum(self.sizes.get(c, 0) for step in self.steps for c in step.load)
+
+    def prefetch_bytes(self):
+        return sum(self.sizes.get(c, 0) for step in self.steps for c in step.prefetch)
+
+
+def as_stages(stages, reserve=0):
+    return [s if isinstance(s, Stage) else Stage('+'.join(s), s, reserve) for s in stages]
+
+
+def next_use(stages, component, after):
+    for i in range(after + 1, len(stages)):
+        if component in stages[i].components:
+            return i
+    return infinity
+
+
+def plan_residency(stages, sizes, budget, resident=()):
+    """Plans residency for `stages` (Stage objects or lists of component names) with component `sizes` in bytes on a
+    device that can hold `budget` bytes. `resident` lists the components already on the device."""
+
+    stages = as_stages(stages)
+    resident = [c for c in resident if c in sizes]
+    steps = []
+
+    for i, stage in enumerate(stages):
+        step = StepPlan(stage)
+        required = [c for c in stage.components if c in sizes]
+
+        for c in required:
+            if c not in resident:
+                step.load.append(c)
+
+        in_use = sum(sizes[c] for c in set(resident) | set(required)) + stage.reserve
+        candidates = sorted((c for c in resident if c not in required), key=lambda c: (-next_use(stages, c, i), -sizes[c]))
+
+        for c in candidates:
+            if in_use <= budget:
+                break
+            step.evict.append(c)
+            resident.remove(c)
+            in_use -= sizes[c]
+
+        if in_use > budget:
+            # the stage does not fit even alone, its largest components are streamed from the offload device
+            step.swap = sorted(required, key=lambda c: -sizes[c])
+
+        resident += step.load
+        step.resident = list(resident)
+        steps.append(step)
+
+    for i in range(len(steps) - 1):
+        current, following = steps[i], steps[i + 1]
+        if current.swap or following.swap:
+            continue
+
+        # components that leave before the next stage and are idle now can be evicted early to make room
+        idle = [c for c in following.evict if c not in current.stage.components]
+        room = budget - current.stage.reserve - sum(sizes[c] for c in current.resident) + sum(sizes[c] for c in idle)
+
+        for c in following.load:
+            if sizes[c] <= room:
+                current.prefetch.append(c)
+                room -= sizes[c]
+
+    return ResidencyPlan(steps, sizes, budget)
+
+
+def simulate_reactive(stages, sizes, budget, resident=()):
+    """Bytes transferred by the reactive policy of memory_management.free_memory, which evicts the least recently
+    loaded models until the current stage fits."""
+
+    stages = as_stages(stages)
+    loaded = [c for c in resident if c in sizes]
+    transferred = 0
+
+    for stage in stages:
+        required = [c for c in stage.components if c in sizes]
+
+        for c in required:
+            if c in loaded:
+                loaded.remove(c)
+            else:
+                transferred += sizes[c]
+            loaded.insert(0, c)
+
+        in_use = sum(sizes[c] for c in loaded) + stage.reserve
+        for c in reversed(loaded.copy()):
+            if in_use <= budget:
+                break
+            if c not in required:
+                loaded.remove(c)
+                in_use -= sizes[c]
+
+    return transferred
+
+
+class Transfer:
+    def __init__(self, component, size, seconds, direction, prefetched=False, planned=True):
+        self.component = component
+        self.size = size
+        self.seconds = seconds
+        self.direction = direction
+        self.prefetched = prefetched
+        self.planned = planned
+
+
+class ResidencyJob:
+    """Follows a running job through its planned stages. `components` is a callable returning {name: model patcher};
+    it is resolved on every lookup because the job may replace its patchers (LoRA clones, refiner) while it runs."""
+
+    def __init__(self, stages, components, sizes, budget, resident=(), reserve=0, prefetch=False):
+        self.stages = as_stages(stages, reserve)
+        self.components = components
+        self.plan = plan_residency(self.stages, sizes, budget, resident)
+        self.reactive_bytes = simulate_reactive(self.stages, sizes, budget, resident)
+        self.prefetch_enabled = prefetch
+        self.index = -1
+        self.extras = {}
+        self.transfers = []
+        self.started = time.perf_counter()
+
+    def component_of(self, model):
+        for name, patcher in self.components().items():
+            if patcher is not None and patcher.model is model.model:
+                return name
+
+        for name, extras in self.extras.items():
+            if id(model.model) in extras:
+                return name
+
+        return None
+
+    def advance(self, models):
+        """Moves to the first stage at or after the current one that uses all of `models`. Models that are no declared
+        component (ControlNets and other patchers loaded together with the UNet) are attached to that component."""
+
+        names = [self.component_of(m) for m in models]
+        known = [n for n in names if n is not None]
+
+        if len(known) == 0:
+            return False
+
+        for i in range(max(self.index, 0), len(self.stages)):
+            if all(n in self.stages[i].components for n in known):
+                self.index = i
+                break
+        else:
+            return False
+
+        for m, n in zip(models, names):
+            if n is None:
+                self.extras.setdefault(known[0], set()).add(id(m.model))
+
+        return True
+
+    def next_use(self, model):
+        name = self.component_of(model)
+        if name is None:
+            return infinity
+
+        current = self.stages[self.index] if self.index >= 0 else None
+        if current is not None and name in current.components:
+            return self.index
+        return next_use(self.stages, name, self.index)
+
+    def eviction_order(self, loaded_models):
+        """Orders eviction candidates (memory_management.LoadedModel, given oldest first) so that models not needed
+        again go first, then the one needed farthest in the future."""
+        return sorted(loaded_models, key=lambda m: -self.next_use(m.model))
+
+    def prefetch_candidates(self):
+        if not self.prefetch_enabled or not 0 <= self.index < len(self.plan.steps) - 1:
+            return []
+
+        patchers = self.components()
+        return [patchers[c] for c in self.plan.steps[self.index].prefetch if patchers.get(c) is not None]
+
+    def record(self, model, size, seconds, direction, prefetched=False):
+        name = self.component_of(model)
+        label = name or model.model.__class__.__name__
+        self.transfers.append(Transfer(label, size, seconds, direction, prefetched=prefetched, planned=name is not None))
+
+    def report(self):
+        loads = [t for t in self.transfers if t.direction == 'load']
+        unloads = [t for t in self.transfers if t.direction == 'unload']
+
+        return dict(
+            stages=[s.name for s in self.stages],
+            completed_stages=self.index + 1,
+            loads=[dict(component=t.component, size=t.size, seconds=t.seconds, prefetched=t.prefetched, planned=t.planned) for t in loads],
+            unloads=[dict(component=t.component, size=t.size) for t in unloads],
+            loaded_bytes=sum(t.size for t in loads),
+            prefetched_bytes=sum(t.size for t in loads if t.prefetched),
+            unloaded_bytes=sum(t.size for t in unloads),
+            transfer_seconds=sum(t.seconds for t in loads),
+            blocking_seconds=sum(t.seconds for t in loads if not t.prefetched),
+            planned_bytes=self.plan.transfer_bytes(),
+            reactive_bytes=self.reactive_bytes,
+            seconds=time.perf_counter() - self.started,
+        )
+
+    def summary(self):
+        r = self.report()
+        mb = 1024 * 1024
+        prefetched = sum(1 for t in r['loads'] if t['prefetched'])
+        unplanned = sum(1 for t in r['loads'] if not t['planned'])
+        return (f"[Residency] {r['completed_stages']}/{len(r['stages'])} stages, "
+                f"loaded {len(r['loads'])} ({r['loaded_bytes'] / mb:.2f} MB in {r['transfer_seconds']:.2f}s, {r['blocking_seconds']:.2f}s blocking), "
+                f"prefetched {prefetched} ({r['prefetched_bytes'] / mb:.2f} MB), "
+                f"unloaded {len(r['unloads'])} ({r['unloaded_bytes'] / mb:.2f} MB), unplanned loads {unplanned}; "
+                f"planned {r['planned_bytes'] / mb:.2f} MB, reactive policy {r['reactive_bytes'] / mb:.2f} MB")
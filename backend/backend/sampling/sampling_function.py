@@ -7,9 +7,10 @@ import torch
 import math
 import collections
 
-from backend import memory_management
+from backend import memory_management, compilation
 from backend.sampling.condition import Condition, compile_conditions, compile_weighted_conditions
 from backend.operations import cleanup_cache
+from backend.dequant_cache import dequant_cache
 from backend.args import dynamic_args, args
 from backend import utils
 
@@ -380,6 +381,11 @@ def sampling_prepare(unet, x):
         lora_memory = utils.nested_compute_size(unet.lora_patches, element_size=utils.dtype_to_element_size(unet.model.computation_dtype))
         additional_inference_memory += lora_memory
 
+    dequant_cache_budget = 0
+    if unet.model.storage_dtype in ['gguf', 'nf4', 'fp4']:
+        dequant_cache_budget = int(dynamic_args.get('forge_dequant_cache_size', 0) * 1024 * 1024)
+        additional_inference_memory += dequant_cache_budget
+
     memory_management.load_models_gpu(
         models=[unet] + additional_model_patchers,
         memory_required=unet_inference_memory,
@@ -389,6 +395,10 @@ def sampling_prepare(unet, x):
     if unet.has_online_lora():
         utils.nested_move_to_device(unet.lora_patches, device=unet.current_device, dtype=unet.model.computation_dtype)
 
+    if unet.model_options.get('reserve_inference_memory', False):
+        # after load_models_gpu, whose free_memory may call soft_empty_cache and release a block reserved earlier
+        memory_management.reserve_inference_memory(unet_inference_memory, unet.load_device)
+
     real_model = unet.model
 
     percent_to_timestep_function = lambda p: real_model.predictor.percent_to_sigma(p)
@@ -396,6 +406,8 @@ def sampling_prepare(unet, x):
     for cnet in unet.list_controlnets():
         cnet.pre_run(real_model, percent_to_timestep_function)
 
+    dequant_cache.begin(dequant_cache_budget)
+    real_model.compile_allowed = compilation.begin_sampling(unet)
     return
 
 
@@ -405,4 +417,6 @@ def sampling_cleanup(unet):
     for cnet in unet.list_controlnets():
         cnet.cleanup()
     cleanup_cache()
+    dequant_cache.end()
+    unet.model.compile_allowed = False
     return
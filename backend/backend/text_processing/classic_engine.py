@@ -1,7 +1,8 @@
 import math
 import torch
+import threading
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from backend.text_processing import parsing, emphasis
 from backend.text_processing.textual_inversion import EmbeddingDatabase
 from backend import memory_management
@@ -12,6 +13,9 @@ from modules.shared import opts
 PromptChunkFix = namedtuple('PromptChunkFix', ['offset', 'embedding'])
 last_extra_generation_params = {}
 
+# tokenized prompt lines kept per engine; the live token counter and repeated generations hit the same lines
+line_cache_size = 256
+
 
 class PromptChunk:
     def __init__(self):
@@ -58,7 +62,9 @@ class ClassicTextProcessingEngine:
     ):
         super().__init__()
 
-        self.embeddings = EmbeddingDatabase(tokenizer, embedding_expected_shape)
+        # HF fast tokenizers must not be used from two threads at once; token counting runs outside the model thread
+        self.tokenizer_lock = threading.Lock()
+        self.embeddings = EmbeddingDatabase(tokenizer, embedding_expected_shape, tokenizer_lock=self.tokenizer_lock)
 
         if isinstance(embedding_dir, str):
             self.embeddings.add_embedding_dir(embedding_dir)
@@ -78,6 +84,9 @@ class ClassicTextProcessingEngine:
 
         self.chunk_length = chunk_length
 
+        self.line_cache = OrderedDict()
+        self.line_cache_lock = threading.Lock()
+
         self.id_start = self.tokenizer.bos_token_id
         self.id_end = self.tokenizer.eos_token_id
         self.id_pad = self.tokenizer.pad_token_id
@@ -117,7 +126,8 @@ class ClassicTextProcessingEngine:
         return math.ceil(max(token_count, 1) / self.chunk_length) * self.chunk_length
 
     def tokenize(self, texts):
-        tokenized = self.tokenizer(texts, truncation=False, add_special_tokens=False)["input_ids"]
+        with self.tokenizer_lock:
+            tokenized = self.tokenizer(texts, truncation=False, add_special_tokens=False)["input_ids"]
 
         return tokenized
 
@@ -231,6 +241,27 @@ class ClassicTextProcessingEngine:
 
         return chunks, token_count
 
+    def tokenize_line_cached(self, line):
+        """tokenize_line, memoized by line, emphasis mode and embedding database version; the returned chunks are shared
+        and must not be modified."""
+
+        key = (line, self.emphasis.name, self.embeddings.version)
+
+        with self.line_cache_lock:
+            result = self.line_cache.get(key, None)
+            if result is not None:
+                self.line_cache.move_to_end(key)
+                return result
+
+        result = self.tokenize_line(line)
+
+        with self.line_cache_lock:
+            self.line_cache[key] = result
+            while len(self.line_cache) > line_cache_size:
+                self.line_cache.popitem(last=False)
+
+        return result
+
     def process_texts(self, texts):
         token_count = 0
 
@@ -240,7 +271,7 @@ class ClassicTextProcessingEngine:
             if line in cache:
                 chunks = cache[line]
             else:
-                chunks, current_token_count = self.tokenize_line(line)
+                chunks, current_token_count = self.tokenize_line_cached(line)
                 token_count = max(current_token_count, token_count)
 
                 cache[line] = chunks
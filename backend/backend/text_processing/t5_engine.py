@@ -1,4 +1,5 @@
 import torch
+import threading
 
 from collections import namedtuple
 from backend.text_processing import parsing, emphasis
@@ -27,6 +28,7 @@ class T5TextProcessingEngine:
         self.min_length = min_length
         self.id_end = 1
         self.id_pad = 0
+        self.tokenizer_lock = threading.Lock()
 
         vocab = self.tokenizer.get_vocab()
 
@@ -51,7 +53,8 @@ class T5TextProcessingEngine:
                 self.token_mults[ident] = mult
 
     def tokenize(self, texts):
-        tokenized = self.tokenizer(texts, truncation=False, add_special_tokens=False)["input_ids"]
+        with self.tokenizer_lock:
+            tokenized = self.tokenizer(texts, truncation=False, add_special_tokens=False)["input_ids"]
         return tokenized
 
     def encode_with_transformers(self, tokens):
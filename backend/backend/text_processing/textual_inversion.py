@@ -3,9 +3,13 @@ import torch
 import base64
 import json
 import zlib
+import struct
+import threading
 import numpy as np
 import safetensors.torch
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 
 
@@ -77,6 +81,9 @@ def extract_image_data_embed(image):
     return json.loads(data, cls=EmbeddingDecoder)
 
 
+embedding_extensions = ['.PNG', '.WEBP', '.JXL', '.AVIF', '.BIN', '.PT', '.SAFETENSORS']
+
+
 class Embedding:
     def __init__(self, vec, name, step=None):
         self.vec = vec
@@ -86,6 +93,222 @@ class Embedding:
         self.vectors = 0
         self.sd_checkpoint = None
         self.sd_checkpoint_name = None
+        self.lazy_key = None
+
+    @property
+    def vec(self):
+        if self._vec is None and self.lazy_key is not None:
+            return vector_cache.get(self)
+        return self._vec
+
+    @vec.setter
+    def vec(self, value):
+        self._vec = value
+
+
+class EmbeddingVectorCache:
+    """Vectors of embeddings that are loaded on first use; the least recently used are dropped first."""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.vectors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, embedding):
+        with self.lock:
+            vec = self.vectors.get(embedding.lazy_key, None)
+            if vec is not None:
+                self.vectors.move_to_end(embedding.lazy_key)
+                return vec
+
+        data = safetensors.torch.load_file(embedding.filename, device="cpu")
+        vec = create_embedding_from_data(data, embedding.name, filename=embedding.filename).vec
+
+        with self.lock:
+            self.vectors[embedding.lazy_key] = vec
+            while len(self.vectors) > self.capacity:
+                self.vectors.popitem(last=False)
+
+        return vec
+
+    def clear(self):
+        with self.lock:
+            self.vectors.clear()
+
+
+vector_cache = EmbeddingVectorCache()
+
+
+def read_safetensors_header(path):
+    with open(path, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        return json.loads(f.read(n))
+
+
+def embedding_from_safetensors_header(path, name, embedding_class=Embedding):
+    """Describes a safetensors embedding from its header only; the vectors are loaded on first use."""
+
+    header = read_safetensors_header(path)
+    shapes = {k: v['shape'] for k, v in header.items() if k != '__metadata__'}
+
+    if 'clip_g' in shapes and 'clip_l' in shapes:  # SDXL embedding
+        shape = shapes['clip_g'][-1] + shapes['clip_l'][-1]
+        vectors = shapes['clip_g'][0]
+    elif len(shapes) == 1:  # diffuser concepts
+        emb_shape = next(iter(shapes.values()))
+        shape = emb_shape[-1]
+        vectors = emb_shape[0] if len(emb_shape) > 1 else 1
+    else:
+        raise Exception(f"Couldn't identify {os.path.basename(path)} as neither textual inversion embedding nor diffuser concept.")
+
+    embedding = embedding_class(None, name)
+    embedding.vectors = vectors
+    embedding.shape = shape
+    embedding.filename = path
+    embedding.lazy_key = (path, os.path.getmtime(path))
+    return embedding
+
+
+def read_embedding_file(path, filename):
+    name, ext = os.path.splitext(filename)
+    ext = ext.upper()
+
+    if ext in ['.PNG', '.WEBP', '.JXL', '.AVIF']:
+        _, second_ext = os.path.splitext(name)
+        if second_ext.upper() == '.PREVIEW':
+            return None
+
+        embed_image = Image.open(path)
+        if hasattr(embed_image, 'text') and 'sd-ti-embedding' in embed_image.text:
+            data = embedding_from_b64(embed_image.text['sd-ti-embedding'])
+            name = data.get('name', name)
+        else:
+            data = extract_image_data_embed(embed_image)
+            if data:
+                name = data.get('name', name)
+            else:
+                return None
+    elif ext in ['.BIN', '.PT']:
+        data = torch.load(path, map_location="cpu")
+    elif ext in ['.SAFETENSORS']:
+        return embedding_from_safetensors_header(path, name)
+    else:
+        return None
+
+    if data is None:
+        print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
+        return None
+
+    return create_embedding_from_data(data, name, filename=filename, filepath=path)
+
+
+class EmbeddingFileIndex:
+    """Embeddings found in directories, per file. A file is only read again when its mtime or size changes, and files
+    that need reading are read in parallel. report_error, if given, is called with a message from inside the except
+    block when a file fails to load."""
+
+    def __init__(self, read_file, max_workers=8, report_error=None):
+        self.read_file = read_file
+        self.max_workers = max_workers
+        self.report_error = report_error
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def read(self, path, filename):
+        try:
+            return self.read_file(path, filename)
+        except Exception:
+            if self.report_error is not None:
+                self.report_error(f"Error loading embedding {filename}")
+            else:
+                print(f"Error loading embedding {filename}")
+            return None
+
+    def scan(self, directories):
+        files = []
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+
+            for root, _, fns in os.walk(directory, followlinks=True):
+                for fn in fns:
+                    if os.path.splitext(fn)[1].upper() not in embedding_extensions:
+                        continue
+
+                    fullfn = os.path.join(root, fn)
+                    try:
+                        st = os.stat(fullfn)
+                    except OSError:
+                        continue
+
+                    if st.st_size == 0:
+                        continue
+
+                    files.append((fullfn, fn, (st.st_mtime_ns, st.st_size)))
+
+        with self.lock:
+            changed = [x for x in files if self.entries.get(x[0], (None, None))[0] != x[2]]
+
+            if len(changed) > 0:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(changed))) as executor:
+                    results = executor.map(lambda x: self.read(x[0], x[1]), changed)
+                    for (fullfn, _, stamp), embedding in zip(changed, results):
+                        self.entries[fullfn] = (stamp, embedding)
+
+            found = {x[0] for x in files}
+            roots = tuple(os.path.join(d, '') for d in directories)
+            for fullfn in [k for k in self.entries if k not in found and k.startswith(roots)]:
+                del self.entries[fullfn]
+
+            return [self.entries[x[0]][1] for x in files if self.entries[x[0]][1] is not None]
+
+
+embedding_file_index = EmbeddingFileIndex(read_embedding_file)
+
+
+class TokenTrie:
+    """Embedding names by their token ids, for finding the longest embedding name that starts at a position."""
+
+    def __init__(self):
+        self.root = {}
+
+    def clear(self):
+        self.root.clear()
+
+    def add(self, ids, embedding):
+        node = self.root
+        for token in ids:
+            node = node.setdefault(token, {})
+        node.setdefault(None, []).append(embedding)
+
+    def remove(self, ids, name):
+        path = [self.root]
+        for token in ids:
+            node = path[-1].get(token, None)
+            if node is None:
+                return
+            path.append(node)
+
+        terminal = path[-1]
+        terminal[None] = [x for x in terminal.get(None, []) if x.name != name]
+        if len(terminal[None]) == 0:
+            del terminal[None]
+
+        for depth in range(len(ids), 0, -1):
+            if len(path[depth]) > 0:
+                break
+            del path[depth - 1][ids[depth - 1]]
+
+    def longest_match(self, tokens, offset):
+        node = self.root
+        match = None, None
+        for i in range(offset, len(tokens)):
+            node = node.get(tokens[i], None)
+            if node is None:
+                break
+            if None in node:
+                match = node[None][0], i - offset + 1
+        return match
 
 
 class DirWithTextualInversionEmbeddings:
@@ -109,14 +332,18 @@ class DirWithTextualInversionEmbeddings:
 
 
 class EmbeddingDatabase:
-    def __init__(self, tokenizer, expected_shape=-1):
-        self.ids_lookup = {}
+    def __init__(self, tokenizer, expected_shape=-1, tokenizer_lock=None):
+        self.token_trie = TokenTrie()
+        self.token_ids = {}
         self.word_embeddings = {}
         self.embedding_dirs = {}
         self.skipped_embeddings = {}
         self.expected_shape = expected_shape
         self.tokenizer = tokenizer
+        # shared with the text processing engine that owns the tokenizer, which may be tokenizing for the UI meanwhile
+        self.tokenizer_lock = tokenizer_lock if tokenizer_lock is not None else threading.Lock()
         self.fixes = []
+        self.version = 0
 
     def add_embedding_dir(self, path):
         self.embedding_dirs[path] = DirWithTextualInversionEmbeddings(path)
@@ -124,106 +351,73 @@ class EmbeddingDatabase:
     def clear_embedding_dirs(self):
         self.embedding_dirs.clear()
 
+    def tokenize(self, texts):
+        with self.tokenizer_lock:
+            return self.tokenizer(texts, truncation=False, add_special_tokens=False)["input_ids"]
+
     def register_embedding(self, embedding):
         return self.register_embedding_by_name(embedding, embedding.name)
 
-    def register_embedding_by_name(self, embedding, name):
-        ids = self.tokenizer([name], truncation=False, add_special_tokens=False)["input_ids"][0]
-        first_id = ids[0]
-        if first_id not in self.ids_lookup:
-            self.ids_lookup[first_id] = []
+    def register_embedding_by_name(self, embedding, name, ids=None):
+        if ids is None:
+            ids = self.tokenize([name])[0]
+
         if name in self.word_embeddings:
-            lookup = [x for x in self.ids_lookup[first_id] if x[1].name != name]
-        else:
-            lookup = self.ids_lookup[first_id]
-        if embedding is not None:
-            lookup += [(ids, embedding)]
-        self.ids_lookup[first_id] = sorted(lookup, key=lambda x: len(x[0]), reverse=True)
-        if embedding is None:
-            if name in self.word_embeddings:
-                del self.word_embeddings[name]
-            if len(self.ids_lookup[first_id]) == 0:
-                del self.ids_lookup[first_id]
-            return None
-        self.word_embeddings[name] = embedding
-        return embedding
+            self.token_trie.remove(self.token_ids.pop(name), name)
+            del self.word_embeddings[name]
 
-    def load_from_file(self, path, filename):
-        name, ext = os.path.splitext(filename)
-        ext = ext.upper()
+        if embedding is not None:
+            self.token_trie.add(ids, embedding)
+            self.token_ids[name] = ids
+            self.word_embeddings[name] = embedding
 
-        if ext in ['.PNG', '.WEBP', '.JXL', '.AVIF']:
-            _, second_ext = os.path.splitext(name)
-            if second_ext.upper() == '.PREVIEW':
-                return
+        # bumped only after the change, so that a token count running concurrently cannot cache chunks of the old
+        # database under the new version
+        self.version += 1
+        return embedding
 
-            embed_image = Image.open(path)
-            if hasattr(embed_image, 'text') and 'sd-ti-embedding' in embed_image.text:
-                data = embedding_from_b64(embed_image.text['sd-ti-embedding'])
-                name = data.get('name', name)
-            else:
-                data = extract_image_data_embed(embed_image)
-                if data:
-                    name = data.get('name', name)
-                else:
-                    return
-        elif ext in ['.BIN', '.PT']:
-            data = torch.load(path, map_location="cpu")
-        elif ext in ['.SAFETENSORS']:
-            data = safetensors.torch.load_file(path, device="cpu")
-        else:
+    def register_embeddings(self, embeddings):
+        if len(embeddings) == 0:
             return
 
-        if data is not None:
-            embedding = create_embedding_from_data(data, name, filename=filename, filepath=path)
+        names = [embedding.name for embedding in embeddings]
+        all_ids = self.tokenize(names)
+        for embedding, ids in zip(embeddings, all_ids):
+            self.register_embedding_by_name(embedding, embedding.name, ids=ids)
 
-            if self.expected_shape == -1 or self.expected_shape == embedding.shape:
-                self.register_embedding(embedding)
-            else:
-                self.skipped_embeddings[name] = embedding
-        else:
-            print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
-
-    def load_from_dir(self, embdir):
-        if not os.path.isdir(embdir.path):
+    def load_from_file(self, path, filename):
+        embedding = read_embedding_file(path, filename)
+        if embedding is None:
             return
 
-        for root, _, fns in os.walk(embdir.path, followlinks=True):
-            for fn in fns:
-                try:
-                    fullfn = os.path.join(root, fn)
-
-                    if os.stat(fullfn).st_size == 0:
-                        continue
-
-                    self.load_from_file(fullfn, fn)
-                except Exception:
-                    print(f"Error loading embedding {fn}")
-                    continue
+        if self.expected_shape == -1 or self.expected_shape == embedding.shape:
+            self.register_embedding(embedding)
+        else:
+            self.skipped_embeddings[embedding.name] = embedding
 
     def load_textual_inversion_embeddings(self):
-        self.ids_lookup.clear()
+        self.token_trie.clear()
+        self.token_ids.clear()
         self.word_embeddings.clear()
         self.skipped_embeddings.clear()
 
+        accepted = []
+        for embedding in embedding_file_index.scan([embdir.path for embdir in self.embedding_dirs.values()]):
+            if self.expected_shape == -1 or self.expected_shape == embedding.shape:
+                accepted.append(embedding)
+            else:
+                self.skipped_embeddings[embedding.name] = embedding
+
+        self.register_embeddings(accepted)
+
         for embdir in self.embedding_dirs.values():
-            self.load_from_dir(embdir)
             embdir.update()
 
+        self.version += 1
         return
 
     def find_embedding_at_position(self, tokens, offset):
-        token = tokens[offset]
-        possible_matches = self.ids_lookup.get(token, None)
-
-        if possible_matches is None:
-            return None, None
-
-        for ids, embedding in possible_matches:
-            if tokens[offset:offset + len(ids)] == ids:
-                return embedding, len(ids)
-
-        return None, None
+        return self.token_trie.longest_match(tokens, offset)
 
 
 def create_embedding_from_data(data, name, filename='unknown embedding file', filepath=None):
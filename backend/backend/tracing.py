@@ -0,0 +1,257 @@
+# Per-job performance tracing.
+# A trace is begun for a generation job (by the queue wrapper or the API) and collects nested spans: queue wait, model
+# load, text encoding, LoRA merge, every sampling step, VAE decode, postprocessing and image saving. Spans nest per
+# thread. Only one trace is current at a time, since generations run one at a time under the queue lock; when no trace
+# is current, span() returns a shared no-op context, so instrumented code costs one global lookup.
+# Finished traces are kept in memory, the most recent `keep_traces`, and can be exported in the Chrome trace format
+# (chrome://tracing, Perfetto).
+
+
+import time
+import functools
+import threading
+
+from collections import OrderedDict
+
+
+keep_traces = 64
+
+current = None
+finished = OrderedDict()
+finished_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('id', 'name', 'parent', 'start', 'end', 'thread', 'attrs')
+
+    def __init__(self, id, name, parent, start, thread, attrs):
+        self.id = id
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end = None
+        self.thread = thread
+        self.attrs = attrs
+
+
+class SpanContext:
+    __slots__ = ('trace', 'name', 'attrs', 'span')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+
+    def __enter__(self):
+        self.span = self.trace.open(self.name, self.attrs)
+        return self.span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.span.attrs['error'] = exc_type.__name__
+        self.trace.close(self.span)
+
+
+class NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return
+
+
+null_span = NullSpan()
+
+
+class Trace:
+    def __init__(self, trace_id, name, synchronize=False, start=None, attrs=None):
+        self.id = trace_id
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter() if start is None else start
+        self.wall_start = time.time() - (time.perf_counter() - self.start)
+        self.end = None
+        self.spans = []
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.synchronize = None
+
+        if synchronize:
+            import torch
+            if torch.cuda.is_available():
+                self.synchronize = torch.cuda.synchronize
+
+    def open(self, name, attrs, start=None):
+        if self.synchronize is not None and start is None:
+            self.synchronize()
+
+        thread = threading.get_ident()
+        with self.lock:
+            stack = self.stacks.setdefault(thread, [])
+            span = Span(len(self.spans), name, stack[-1].id if stack else None, time.perf_counter() if start is None else start, thread, attrs)
+            self.spans.append(span)
+            stack.append(span)
+        return span
+
+    def close(self, span, end=None):
+        if self.synchronize is not None and end is None:
+            self.synchronize()
+
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            stack = self.stacks.get(span.thread, [])
+            # spans left open by an exception below this one end with it
+            while stack:
+                top = stack.pop()
+                top.end = end
+                if top is span:
+                    break
+
+    def record(self, name, start, end, attrs):
+        self.close(self.open(name, attrs, start=start), end=end)
+
+    def span(self, name, **attrs):
+        return SpanContext(self, name, attrs)
+
+    def finish(self):
+        self.end = time.perf_counter()
+        with self.lock:
+            for stack in self.stacks.values():
+                for span in stack:
+                    span.end = self.end
+                    span.attrs.setdefault('error', 'not closed')
+            self.stacks.clear()
+
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def summary(self):
+        return dict(id=self.id, name=self.name, start=self.wall_start, duration=self.duration(), spans=len(self.spans), attrs=self.attrs)
+
+    def to_dict(self):
+        data = self.summary()
+        data['spans'] = [dict(
+            id=s.id,
+            name=s.name,
+            parent=s.parent,
+            start=s.start - self.start,
+            duration=(s.end if s.end is not None else time.perf_counter()) - s.start,
+            thread=s.thread,
+            attrs=s.attrs,
+        ) for s in self.spans]
+        return data
+
+    def to_chrome(self):
+        """Chrome trace event format: complete events in microseconds, one track per thread."""
+
+        threads = {}
+        events = []
+        for s in self.spans:
+            tid = threads.setdefault(s.thread, len(threads))
+            end = s.end if s.end is not None else time.perf_counter()
+            events.append(dict(name=s.name, ph='X', ts=(s.start - self.start) * 1e6, dur=(end - s.start) * 1e6, pid=0, tid=tid, args=s.attrs))
+
+        events.append(dict(name='process_name', ph='M', pid=0, args=dict(name=f'{self.name} {self.id}')))
+        for thread, tid in threads.items():
+            events.append(dict(name='thread_name', ph='M', pid=0, tid=tid, args=dict(name='main' if tid == 0 else f'thread {thread}')))
+
+        return dict(traceEvents=events, displayTimeUnit='ms', otherData=dict(trace_id=self.id, wall_start=self.wall_start, **self.attrs))
+
+
+def begin(trace_id, name, synchronize=False, queued=None, **attrs):
+    """Starts the current trace. `queued` is the perf_counter() time at which the job was queued; the wait is recorded
+    as a 'queue' span."""
+
+    global current
+
+    trace = Trace(trace_id, name, synchronize=synchronize, start=queued, attrs=attrs)
+    if queued is not None:
+        trace.record('queue', queued, time.perf_counter(), {})
+
+    current = trace
+    return trace
+
+
+def end(trace):
+    global current
+
+    if trace is None:
+        return
+
+    if current is trace:
+        current = None
+
+    trace.finish()
+
+    with finished_lock:
+        finished.pop(trace.id, None)
+        finished[trace.id] = trace
+        while len(finished) > keep_traces:
+            finished.popitem(last=False)
+
+
+def span(name, **attrs):
+    trace = current
+    if trace is None:
+        return null_span
+    return SpanContext(trace, name, attrs)
+
+
+def span_of(trace, name, **attrs):
+    if trace is None:
+        return null_span
+    return SpanContext(trace, name, attrs)
+
+
+def open_span(name, **attrs):
+    """For code where a with block does not fit; a span that is never closed ends with its parent or the trace."""
+
+    trace = current
+    if trace is None:
+        return None
+    return trace, trace.open(name, attrs)
+
+
+def close_span(handle):
+    if handle is not None:
+        trace, s = handle
+        trace.close(s)
+
+
+def record(name, duration, **attrs):
+    """Records an interval that ended now and was measured elsewhere, e.g. by modules.timer.Timer."""
+
+    trace = current
+    if trace is not None:
+        end_time = time.perf_counter()
+        trace.record(name, end_time - duration, end_time, attrs)
+
+
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = current
+            if trace is None:
+                return function(*args, **kwargs)
+            with SpanContext(trace, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get(trace_id):
+    with finished_lock:
+        trace = finished.get(trace_id)
+    if trace is None and current is not None and current.id == trace_id:
+        trace = current
+    return trace
+
+
+def list_traces():
+    with finished_lock:
+        traces = list(finished.values())
+    if current is not None and current.id not in finished:
+        traces.append(current)
+    return [t.summary() for t in reversed(traces)]
@@ -25,7 +25,8 @@ def load_torch_file(ckpt, safe_load=False, device=None):
     if ckpt.lower().endswith(".safetensors"):
         sd = safetensors.torch.load_file(ckpt, device=device.type)
     elif ckpt.lower().endswith(".gguf"):
-        reader = gguf.GGUFReader(ckpt)
+        # copy-on-write mapping: tensors are views of the file and only pages that are written get private copies
+        reader = gguf.GGUFReader(ckpt, mode='c')
         sd = {}
         for tensor in reader.tensors:
             sd[str(tensor.name)] = ParameterGGUF(tensor)
@@ -147,7 +148,7 @@ def nested_move_to_device(obj, **kwargs):
     return obj
 
 
-def get_state_dict_after_quant(model, prefix=''):
+def get_state_dict_after_quant(model, prefix='', clone=True):
     for m in model.modules():
         if hasattr(m, 'weight') and hasattr(m.weight, 'bnb_quantized'):
             if not m.weight.bnb_quantized:
@@ -156,7 +157,7 @@ def get_state_dict_after_quant(model, prefix=''):
                 m.to(original_device)
 
     sd = model.state_dict()
-    sd = {(prefix + k): v.clone() for k, v in sd.items()}
+    sd = {(prefix + k): (v.clone() if clone else v) for k, v in sd.items()}
     return sd
 
 
@@ -0,0 +1,125 @@
+"""Benchmark for the compiled UNet execution mode (backend.compilation), on a tiny SD-style UNet.
+
+Reports, per resolution:
+ - eager: time per step of the plain forward,
+ - first call: the compiled forward's first call (tracing and kernel compilation),
+ - compiled: time per step once compiled,
+and then runs the first call again in a fresh process against the same cache directory, which re-traces the graph but
+loads the kernels from the persistent inductor cache. Checks that compiled outputs match the eager ones (exits
+non-zero if not).
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_compile.py --sizes 32 48 --batch 2 --steps 10 --device cpu
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+os.environ.setdefault('IGNORE_CMD_ARGS_ERRORS', '1')
+
+import torch  # noqa: E402
+
+from backend import compilation  # noqa: E402
+from backend.nn.unet import IntegratedUNet2DConditionModel  # noqa: E402
+
+
+def build_model(device, seed=0):
+    torch.manual_seed(seed)
+    model = IntegratedUNet2DConditionModel(
+        in_channels=4, model_channels=64, out_channels=4, num_res_blocks=1, channel_mult=(1, 2), num_head_channels=32,
+        use_spatial_transformer=True, transformer_depth=[1, 1], transformer_depth_output=[1, 1, 1, 1],
+        transformer_depth_middle=1, context_dim=128, use_linear_in_transformer=True)
+    return model.to(device).eval()
+
+
+def make_inputs(size, batch, device):
+    generator = torch.Generator().manual_seed(size)
+    x = torch.randn((batch, 4, size, size), generator=generator).to(device)
+    timesteps = torch.full((batch,), 500.0).to(device)
+    context = torch.randn((batch, 77, 128), generator=generator).to(device)
+    return x, timesteps, context
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def timed(fn, device):
+    synchronize(device)
+    start = time.perf_counter()
+    result = fn()
+    synchronize(device)
+    return time.perf_counter() - start, result
+
+
+def per_step(fn, steps, device):
+    return timed(lambda: [fn() for _ in range(steps)], device)[0] / steps
+
+
+def first_call(size, batch, device):
+    model = build_model(device)
+    inputs = make_inputs(size, batch, device)
+    with torch.inference_mode():
+        seconds, _ = timed(lambda: compilation.compiled_unet(model, *inputs), device)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 48], help='latent sizes')
+    parser.add_argument('--batch', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--cache-dir', default=None, help='compile cache directory, a temporary one by default')
+    parser.add_argument('--child', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+
+    if args.child is not None:
+        compilation.setup_cache(args.cache_dir)
+        print(json.dumps(first_call(args.child, args.batch, device)))
+        return
+
+    with tempfile.TemporaryDirectory() as temporary:
+        cache_dir = args.cache_dir or temporary
+        compilation.setup_cache(cache_dir)
+
+        model = build_model(device)
+        failures = 0
+
+        for size in args.sizes:
+            inputs = make_inputs(size, args.batch, device)
+
+            with torch.inference_mode():
+                eager = per_step(lambda inputs=inputs: model(*inputs), args.steps, device)
+                reference = model(*inputs)
+                compile_seconds, output = timed(lambda inputs=inputs: compilation.compiled_unet(model, *inputs), device)
+                compiled = per_step(lambda inputs=inputs: compilation.compiled_unet(model, *inputs), args.steps, device)
+
+            same = torch.allclose(output.float(), reference.float(), rtol=1e-3, atol=1e-3)
+            failures += not same
+            print(f'{size}x{size}: eager {eager * 1000:.1f} ms, compiled {compiled * 1000:.1f} ms per step '
+                  f'({eager / compiled:.2f}x), first call {compile_seconds:.2f}s' + ('' if same else '  OUTPUT MISMATCH'))
+
+        command = [sys.executable, os.path.abspath(__file__), '--child', str(args.sizes[0]), '--batch', str(args.batch),
+                   '--device', args.device, '--cache-dir', cache_dir]
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        seconds = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f'{args.sizes[0]}x{args.sizes[0]}: first call in a new process with the persistent cache {seconds:.2f}s')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark for the textual inversion embedding index (backend.text_processing.textual_inversion).
+
+Writes a directory of small safetensors embeddings and compares:
+ - eager: every file loaded serially with safetensors.torch.load_file (previous behaviour),
+ - index, first scan: headers only, read in parallel,
+ - index, rescan: nothing changed, files are only stat'ed,
+ - index, rescan after touching 1% of the files,
+and the time to find embeddings in a long token sequence with the token trie. Vectors are loaded on first use; the
+benchmark checks that the lazily loaded vectors equal the written ones (exits non-zero if not).
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_embeddings.py --count 3000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+import torch  # noqa: E402
+import safetensors.torch  # noqa: E402
+
+from backend.text_processing import textual_inversion  # noqa: E402
+
+
+class CharacterTokenizer:
+    """Stands in for the CLIP tokenizer: one token per character."""
+
+    def __call__(self, texts, truncation=False, add_special_tokens=False):
+        return {"input_ids": [[ord(c) for c in text] for text in texts]}
+
+
+def generate(directory, count, dim, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    vectors = {}
+    for i in range(count):
+        name = f'emb{i:05d}'
+        vec = torch.randn((1 + i % 8, dim), generator=generator)
+        safetensors.torch.save_file({'emb_params': vec}, os.path.join(directory, f'{name}.safetensors'))
+        vectors[name] = vec
+    return vectors
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=3000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--tokens', type=int, default=100000, help='length of the token sequence searched')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        vectors = generate(directory, args.count, args.dim)
+
+        def eager():
+            for fn in sorted(os.listdir(directory)):
+                safetensors.torch.load_file(os.path.join(directory, fn), device='cpu')
+
+        database = textual_inversion.EmbeddingDatabase(CharacterTokenizer(), args.dim)
+        database.add_embedding_dir(directory)
+
+        seconds, _ = timed(eager)
+        print(f'eager load      : {seconds:.3f}s')
+
+        seconds, _ = timed(database.load_textual_inversion_embeddings)
+        print(f'index first scan: {seconds:.3f}s, {len(database.word_embeddings)} embeddings')
+
+        seconds, _ = timed(database.load_textual_inversion_embeddings)
+        print(f'index rescan    : {seconds:.3f}s')
+
+        touched = random.Random(0).sample(sorted(os.listdir(directory)), max(1, args.count // 100))
+        for fn in touched:
+            os.utime(os.path.join(directory, fn), ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        seconds, _ = timed(database.load_textual_inversion_embeddings)
+        print(f'index rescan    : {seconds:.3f}s after touching {len(touched)} files')
+
+        rng = random.Random(1)
+        names = list(vectors)
+        tokens = []
+        while len(tokens) < args.tokens:
+            tokens += [ord(c) for c in rng.choice(names)] if rng.random() < 0.1 else [rng.randrange(32, 48)]
+
+        def search():
+            found = 0
+            position = 0
+            while position < len(tokens):
+                embedding, length = database.find_embedding_at_position(tokens, position)
+                if embedding is None:
+                    position += 1
+                else:
+                    found += 1
+                    position += length
+            return found
+
+        seconds, found = timed(search)
+        print(f'trie search     : {seconds:.3f}s for {len(tokens)} tokens, {found} embeddings found')
+
+        failures = 0
+        seconds, _ = timed(lambda: [database.word_embeddings[name].vec for name in names[:256]])
+        for name in names[:256]:
+            failures += not torch.equal(database.word_embeddings[name].vec, vectors[name])
+        print(f'lazy vectors    : {seconds:.3f}s for the first use of 256 embeddings' + ('' if failures == 0 else f'  {failures} MISMATCHES'))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Benchmark for loading GGUF state dicts (backend.utils.load_torch_file).
+
+Writes a GGUF file with random Q8_0/Q4_0 blocks and F16 tensors, then loads it in a fresh process per run and reports
+load time, anonymous (private) resident memory after the load, peak resident memory, and the time and memory after
+reading every tensor once:
+ - copy: every tensor copied out of the reader's memmap into process memory (previous behaviour),
+ - mmap: parameters are zero-copy views of the memmap, pages are shared with the page cache.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_gguf_load.py --size 2 --runs 2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_path():
+    sys.path.insert(0, backend_dir)
+    sys.path.insert(0, os.path.join(backend_dir, 'packages_3rdparty'))
+
+
+def memory_status():
+    result = dict(anon=0, file=0, peak=0)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('RssAnon', 'RssFile', 'VmHWM'):
+                    result[dict(RssAnon='anon', RssFile='file', VmHWM='peak')[key]] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['peak'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return result
+
+
+def generate(path, size_gb):
+    setup_path()
+
+    import numpy as np
+    import gguf
+
+    rng = np.random.default_rng(0)
+    writer = gguf.GGUFWriter(path, 'bench', use_temp_file=True)
+    layer_bytes = 64 * 1024 * 1024
+    count = max(1, int(size_gb * 1024 ** 3 / layer_bytes))
+
+    for i in range(count):
+        qtype = gguf.GGMLQuantizationType.Q8_0 if i % 2 == 0 else gguf.GGMLQuantizationType.Q4_0
+        block_size, type_size = gguf.GGML_QUANT_SIZES[qtype]
+        rows = layer_bytes // (3072 // block_size * type_size)
+        blocks = rng.integers(0, 256, size=(rows, 3072 // block_size, type_size), dtype=np.uint8)
+        blocks[..., :2] = np.full(blocks.shape[:-1], 0.01, dtype=np.float16).view(np.uint8).reshape(*blocks.shape[:-1], 2)
+        writer.add_tensor(f'blocks.{i}.weight', blocks.reshape(rows, -1), raw_dtype=qtype)
+        writer.add_tensor(f'blocks.{i}.bias', rng.standard_normal(rows).astype(np.float16))
+
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+
+def run_child(args):
+    setup_path()
+
+    import torch
+    import gguf
+    from backend.utils import load_torch_file
+    from backend.operations_gguf import ParameterGGUF
+
+    start = time.perf_counter()
+
+    if args.mode == 'copy':
+        reader = gguf.GGUFReader(args.file)
+        sd = {}
+        for tensor in reader.tensors:
+            copied = types.SimpleNamespace(data=torch.tensor(tensor.data), tensor_type=tensor.tensor_type, shape=tensor.shape)
+            sd[str(tensor.name)] = ParameterGGUF(copied)
+    else:
+        sd = load_torch_file(args.file)
+
+    load_time = time.perf_counter() - start
+    after_load = memory_status()
+
+    start = time.perf_counter()
+    checksum = 0
+    for v in sd.values():
+        checksum += v.data.view(torch.uint8).view(-1).sum(dtype=torch.int64).item()
+    touch_time = time.perf_counter() - start
+    after_touch = memory_status()
+
+    device_time = 0.0
+    if args.device != 'cpu':
+        start = time.perf_counter()
+        for v in sd.values():
+            v.to(args.device)
+        torch.cuda.synchronize()
+        device_time = time.perf_counter() - start
+
+    print(json.dumps(dict(load=load_time, touch=touch_time, device=device_time, anon_load=after_load['anon'], anon_touch=after_touch['anon'],
+                          file_touch=after_touch['file'], peak=after_touch['peak'], checksum=checksum)))
+
+
+def run(mode, args, path):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode, '--file', path, '--device', args.device]
+    output = subprocess.run(command, cwd=backend_dir, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=float, default=1.0, help='size of the generated GGUF file in GB')
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--device', default='cpu', help='also time moving every tensor to this device, e.g. cuda')
+    parser.add_argument('--file', default=None, help='use an existing GGUF file instead of generating one')
+    parser.add_argument('--child', choices=['copy', 'mmap'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        args.mode = args.child
+        run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        path = args.file
+        if path is None:
+            path = os.path.join(temporary_dir, 'bench.gguf')
+            generate(path, args.size)
+
+        print(f'{path}: {os.path.getsize(path) / 1024 ** 3:.2f} GB')
+
+        gb = 1024 ** 3
+        for i in range(args.runs):
+            for mode in ['copy', 'mmap']:
+                r = run(mode, args, path)
+                device = f", to {args.device} {r['device']:.2f}s" if args.device != 'cpu' else ''
+                print(f"{mode} #{i + 1}: load {r['load']:.3f}s (private RSS {r['anon_load'] / gb:.2f} GB), "
+                      f"read all {r['touch']:.2f}s (private RSS {r['anon_touch'] / gb:.2f} GB, file-backed {r['file_touch'] / gb:.2f} GB), "
+                      f"peak RSS {r['peak'] / gb:.2f} GB{device}")
+
+
+if __name__ == '__main__':
+    main()
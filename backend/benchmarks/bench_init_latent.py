@@ -0,0 +1,87 @@
+"""CPU benchmark for img2img init latent encoding (modules_forge.init_latent_cache), on a reduced-width SD VAE.
+
+Compares, for one init image and a batch of `--batch-size`:
+ - per row: every row of the repeated batch encoded separately (the previous behaviour),
+ - once: the image encoded once and the latent repeated to the batch,
+ - cache hit: the content hash of the prepared image plus a lookup in the init latent cache,
+and reports the cost of the content hash alone.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_init_latent.py --size 1024 --batch-size 4 --runs 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.argv += ["--always-cpu"]
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+from backend.nn.vae import IntegratedAutoencoderKL  # noqa: E402
+from modules_forge.init_latent_cache import InitLatentCache, content_hash  # noqa: E402
+
+
+def make_vae(width_multiplier):
+    torch.manual_seed(0)
+    ch = 32 * width_multiplier
+    return IntegratedAutoencoderKL(
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        block_out_channels=(ch, ch, ch * 2, ch * 2),
+        layers_per_block=1,
+    ).eval()
+
+
+def best_of(runs, fn):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--width-multiplier", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads, 0 = torch default")
+    args, _ = parser.parse_known_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    vae = make_vae(args.width_multiplier)
+    img = np.random.default_rng(0).random((3, args.size, args.size), dtype=np.float32)
+    batch = torch.from_numpy(np.expand_dims(img, axis=0).repeat(args.batch_size, axis=0))
+
+    cache = InitLatentCache()
+    cache.budget = lambda: 64 * 1024 * 1024
+
+    def encode(x):
+        return vae.encode(x * 2 - 1)
+
+    with torch.inference_mode():
+        per_row = best_of(args.runs, lambda: torch.stack([encode(row[None])[0] for row in batch]))
+        once = best_of(args.runs, lambda: encode(torch.from_numpy(img[None])).repeat(args.batch_size, 1, 1, 1))
+
+        key = content_hash(img)
+        cache.put(key, encode(torch.from_numpy(img[None])))
+        hit = best_of(args.runs, lambda: cache.get(content_hash(img)).repeat(args.batch_size, 1, 1, 1))
+        hashing = best_of(args.runs, lambda: content_hash(img))
+
+    print(f"{args.size}x{args.size}, batch {args.batch_size}:")
+    print(f"  per row   {per_row * 1000:9.1f} ms")
+    print(f"  once      {once * 1000:9.1f} ms  ({per_row / once:.1f}x)")
+    print(f"  cache hit {hit * 1000:9.1f} ms  ({per_row / hit:.0f}x), of which content hash {hashing * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
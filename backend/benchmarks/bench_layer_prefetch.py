@@ -0,0 +1,150 @@
+"""Simulation of the look-ahead layer prefetcher (backend.layer_prefetch) for low-VRAM swap, on CPU.
+
+Runs a stack of manual-cast Linear layers whose weights live on the "offload device", with the host->device link
+simulated by a copy thread that takes bytes / bandwidth per transfer. Reports, per configuration, time per step:
+ - compute: no transfer cost at all (lower bound),
+ - blocking: every layer waits for its own transfer before it runs (what swapped layers did before),
+ - depth N: transfers for the next N layers run while the current layer computes,
+together with the prefetch hit rate and the ring buffer size against the size of the swapped weights. Checks that every
+configuration produces the output of the plain model (exits non-zero if not).
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_layer_prefetch.py --layers 24 --dim 2048 --bandwidth 2 --depths 1 2 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+os.environ.setdefault('IGNORE_CMD_ARGS_ERRORS', '1')
+
+import torch  # noqa: E402
+
+from backend import memory_management  # noqa: E402
+from backend.layer_prefetch import LayerPrefetcher  # noqa: E402
+from backend.operations import using_forge_operations  # noqa: E402
+
+
+class SimulatedMover:
+    """Host->device link simulated by one copy thread; `blocking` makes every copy run inline."""
+
+    def __init__(self, bandwidth, blocking=False):
+        self.bandwidth = bandwidth
+        self.blocking = blocking
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.transferred = 0
+
+    def transfer(self, pairs):
+        size = sum(source.numel() * source.element_size() for _, source in pairs)
+        time.sleep(size / self.bandwidth)
+        for destination, source in pairs:
+            destination.copy_(source)
+        self.transferred += size
+
+    def copy(self, pairs, release):
+        # CPU layers finish before the next fetch, so `release` is always None here
+        if self.blocking:
+            self.transfer(pairs)
+            return None
+        return self.executor.submit(self.transfer, pairs)
+
+    def wait(self, ready):
+        if ready is not None:
+            ready.result()
+
+    def marker(self):
+        return None
+
+    def synchronize(self):
+        self.executor.submit(lambda: None).result()
+
+
+def build_model(layers, dim, seed=0):
+    with using_forge_operations(device=memory_management.cpu, dtype=torch.float32, manual_cast_enabled=True):
+        model = torch.nn.Sequential(*[torch.nn.Linear(dim, dim) for _ in range(layers)])
+
+    generator = torch.Generator().manual_seed(seed)
+    state_dict = {}
+    for i in range(layers):
+        state_dict[f'{i}.weight'] = torch.randn((dim, dim), generator=generator) / dim ** 0.5
+        state_dict[f'{i}.bias'] = torch.randn((dim,), generator=generator) * 0.01
+
+    model.load_state_dict(state_dict, strict=False)
+    return model
+
+
+def attach(model, prefetcher):
+    for m in model:
+        if prefetcher is None:
+            if hasattr(m, 'forge_prefetcher'):
+                del m.forge_prefetcher
+        else:
+            m.forge_prefetcher = prefetcher
+
+
+def run(model, x, steps):
+    outputs = []
+    seconds = []
+    with torch.no_grad():
+        for _ in range(steps):
+            start = time.perf_counter()
+            outputs.append(model(x))
+            seconds.append(time.perf_counter() - start)
+    # the first step records the layer order and runs without look-ahead
+    return sum(seconds[1:]) / max(1, len(seconds) - 1), torch.cat(outputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layers', type=int, default=24)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--tokens', type=int, default=1024, help='rows per forward')
+    parser.add_argument('--steps', type=int, default=6)
+    parser.add_argument('--bandwidth', type=float, default=2.0, help='simulated host to device rate in GB/s')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=0, help='torch CPU threads, 0 = default')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    model = build_model(args.layers, args.dim)
+    x = torch.randn((args.tokens, args.dim), generator=torch.Generator().manual_seed(1))
+    bandwidth = args.bandwidth * 1024 ** 3
+    swapped = sum(p.numel() * p.element_size() for p in model.parameters())
+    mb = 1024 * 1024
+
+    compute, reference = run(model, x, args.steps)
+    print(f'swapped weights {swapped / mb:.1f} MB, transfer {swapped / bandwidth:.3f}s per step')
+    print(f'compute    : {compute:.3f}s per step')
+
+    failures = 0
+    configurations = [('blocking', 1, True)] + [(f'depth {d}', d, False) for d in args.depths]
+
+    for name, depth, blocking in configurations:
+        mover = SimulatedMover(bandwidth, blocking=blocking)
+        prefetcher = LayerPrefetcher(list(model), memory_management.cpu, memory_management.cpu, depth, mover)
+        attach(model, prefetcher)
+        seconds, output = run(model, x, args.steps)
+        prefetcher.close()
+        attach(model, None)
+
+        stats = prefetcher.stats()
+        same = torch.equal(output, reference)
+        failures += not same
+        print(f"{name:11}: {seconds:.3f}s per step, hits {stats['hits']}, misses {stats['misses']}, "
+              f"ring {stats['buffer_bytes'] / mb:.1f} MB ({stats['buffer_bytes'] / swapped:.1%} of swapped weights), "
+              f"moved {mover.transferred / mb:.0f} MB" + ('' if same else '  OUTPUT MISMATCH'))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark for the metrics registry behind /metrics (backend.metrics).
+
+Reports the cost of the updates made on the hot paths (counter increment, histogram observation) and of rendering a
+scrape once the registry holds a realistic number of label combinations, and prints an excerpt of the output.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_metrics.py --iterations 200000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from backend import metrics  # noqa: E402
+
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def populate(rng):
+    samplers = ['Euler a', 'Euler', 'DPM++ 2M', 'DPM++ SDE', 'UniPC']
+    for _ in range(10000):
+        sampler = rng.choice(samplers)
+        metrics.sampling_steps.inc(sampler=sampler)
+        metrics.sampling_seconds.inc(rng.uniform(0.02, 0.3), sampler=sampler)
+    for _ in range(500):
+        kind = rng.choice(['txt2img', 'img2img'])
+        metrics.jobs.inc(kind=kind, status='completed')
+        metrics.job_seconds.observe(rng.uniform(1, 60), kind=kind)
+        metrics.images.inc(4, kind=kind)
+        metrics.queue_wait_seconds.observe(rng.expovariate(1.0), source=rng.choice(['ui', 'api']))
+        metrics.vae_seconds.observe(rng.uniform(0.05, 2), operation='decode')
+        for handler in ['text2imgapi', 'img2imgapi', 'progressapi', 'get_memory']:
+            metrics.api_request_seconds.observe(rng.uniform(0.001, 30), handler=handler, method='POST')
+        for cache in ['conds', 'checkpoint', 'lora_merge']:
+            (metrics.cache_hit if rng.random() < 0.8 else metrics.cache_miss)(cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    counter = per_call(lambda: metrics.sampling_steps.inc(sampler='Euler a'), args.iterations)
+    histogram = per_call(lambda: metrics.vae_seconds.observe(0.3, operation='decode'), args.iterations)
+    print(f'counter increment    : {counter * 1e9:.0f} ns')
+    print(f'histogram observation: {histogram * 1e9:.0f} ns')
+
+    populate(random.Random(0))
+    metrics.queue_depth.add_source(lambda: 2)
+
+    text = metrics.render()
+    scrape = per_call(metrics.render, 200)
+    print(f'scrape               : {scrape * 1e3:.2f} ms for {len(text.splitlines())} lines, {len(text)} bytes')
+    print()
+    print('\n'.join(line for line in text.splitlines() if 'bucket' not in line)[:1500])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark for batched initial/ancestral noise generation in modules.rng.
+
+Compares ImageRNG against the previous one-tensor-per-seed implementation, checks that both produce
+bit-identical noise for every noise source, and reports the time per call. Exits non-zero on any mismatch.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_noise.py --batch-size 8 --steps 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('IGNORE_CMD_ARGS_ERRORS', '1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+from modules import devices, options, rng, shared, shared_options  # noqa: E402
+
+
+class LegacyImageRNG(rng.ImageRNG):
+    """ImageRNG as it was before batched noise generation: one generator call and one tensor per seed."""
+
+    def first(self):
+        noise_shape = self.shape if self.seed_resize_from_h <= 0 or self.seed_resize_from_w <= 0 else (self.shape[0], int(self.seed_resize_from_h) // 8, int(self.seed_resize_from_w // 8))
+
+        xs = []
+        for i, (seed, generator) in enumerate(zip(self.seeds, self.generators)):
+            subnoise = None
+            if self.subseeds is not None and self.subseed_strength != 0:
+                subseed = 0 if i >= len(self.subseeds) else self.subseeds[i]
+                subnoise = rng.randn(subseed, noise_shape)
+
+            if noise_shape != self.shape:
+                noise = rng.randn(seed, noise_shape)
+            else:
+                noise = rng.randn(seed, self.shape, generator=generator)
+
+            if subnoise is not None:
+                noise = rng.slerp(self.subseed_strength, noise, subnoise)
+
+            if noise_shape != self.shape:
+                x = rng.randn(seed, self.shape, generator=generator)
+                dx = (self.shape[2] - noise_shape[2]) // 2
+                dy = (self.shape[1] - noise_shape[1]) // 2
+                w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
+                h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
+                tx = 0 if dx < 0 else dx
+                ty = 0 if dy < 0 else dy
+                dx = max(-dx, 0)
+                dy = max(-dy, 0)
+
+                x[:, ty:ty + h, tx:tx + w] = noise[:, dy:dy + h, dx:dx + w]
+                noise = x
+
+            xs.append(noise)
+
+        eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
+        if eta_noise_seed_delta:
+            self.generators = [rng.create_generator(seed + eta_noise_seed_delta) for seed in self.seeds]
+
+        return torch.stack(xs).to(shared.device)
+
+    def next(self):
+        if self.is_first:
+            self.is_first = False
+            return self.first()
+
+        xs = [rng.randn_without_seed(self.shape, generator=generator) for generator in self.generators]
+        return torch.stack(xs).to(shared.device)
+
+
+def run(cls, steps, **kwargs):
+    g = cls(**kwargs)
+    outputs = [g.next() for _ in range(steps)]
+    outputs.append(torch.rand(4, device=devices.device))  # global generator state after generation
+    return outputs
+
+
+def timed(cls, steps, repeats, **kwargs):
+    best = float('inf')
+    for _ in range(repeats):
+        if devices.device.type == 'cuda':
+            torch.cuda.synchronize()
+        t = time.perf_counter()
+        run(cls, steps, **kwargs)
+        if devices.device.type == 'cuda':
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - t)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--steps', type=int, default=20, help='number of next() calls, as done by ancestral samplers')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--sources', default='GPU,CPU,NV')
+    args, _ = parser.parse_known_args()
+
+    shared.opts = options.Options(shared_options.options_templates, shared_options.restricted_opts)
+    shared.device = devices.device
+
+    seeds = list(range(1000, 1000 + args.batch_size))
+    cases = {
+        'plain': dict(),
+        'subseed': dict(subseeds=[s + 1 for s in seeds], subseed_strength=0.3),
+        'resize': dict(seed_resize_from_h=args.height // 2, seed_resize_from_w=args.width * 2),
+        'ensd': dict(),
+    }
+
+    mismatches = []
+    print(f"device={devices.device} batch_size={args.batch_size} steps={args.steps} latent={args.channels}x{args.height // 8}x{args.width // 8}")
+    for source in args.sources.split(','):
+        shared.opts.data['randn_source'] = source
+        for name, extra in cases.items():
+            shared.opts.data['eta_noise_seed_delta'] = 31337 if name == 'ensd' else 0
+            kwargs = dict(shape=(args.channels, args.height // 8, args.width // 8), seeds=seeds, **extra)
+
+            identical = all(torch.equal(a, b) for a, b in zip(run(LegacyImageRNG, args.steps, **kwargs), run(rng.ImageRNG, args.steps, **kwargs)))
+            if not identical:
+                mismatches.append(f'{source} {name}')
+            legacy = timed(LegacyImageRNG, args.steps, args.repeats, **kwargs)
+            batched = timed(rng.ImageRNG, args.steps, args.repeats, **kwargs)
+
+            print(f"{source:>4} {name:<8} legacy {legacy * 1000:9.2f} ms  batched {batched * 1000:9.2f} ms  speedup {legacy / batched:5.2f}x  identical={identical}")
+
+    if mismatches:
+        print(f"batched noise differs from the previous implementation: {', '.join(mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark for the "NV" (Philox) CPU noise source in modules.rng_philox.
+
+For common latent shapes and batch sizes, checks that the chunked engine (Generator.randn / randn_batch) produces
+bit-identical output to the whole-array reference (Generator.randn_reference, the previous implementation), in float32
+and float16, and reports the time per call for the reference, the engine on one thread and the engine on all threads.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_philox.py --runs 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from modules import rng_philox  # noqa: E402
+
+shapes = {
+    "SD1.5 512x512": (4, 64, 64),
+    "SDXL 1024x1024": (4, 128, 128),
+    "Flux 1024x1024": (16, 128, 128),
+    "SDXL 2048x2048": (4, 256, 256),
+}
+
+
+def reference_batch(seeds, shape):
+    return np.stack([rng_philox.Generator(seed).randn_reference(shape) for seed in seeds])
+
+
+def timed(func, runs):
+    best = float("inf")
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=12345)
+    args = parser.parse_args()
+
+    print(f"numpy {np.__version__}, {rng_philox.max_threads} threads")
+
+    failed = False
+    for name, shape in shapes.items():
+        for batch_size in args.batch_sizes:
+            seeds = [args.seed + i for i in range(batch_size)]
+
+            reference, t_reference = timed(lambda seeds=seeds, shape=shape: reference_batch(seeds, shape), args.runs)
+            single, t_single = timed(lambda seeds=seeds, shape=shape: rng_philox.randn_batch([rng_philox.Generator(s) for s in seeds], shape, threads=1), args.runs)
+            threaded, t_threaded = timed(lambda seeds=seeds, shape=shape: rng_philox.randn_batch([rng_philox.Generator(s) for s in seeds], shape, threads=rng_philox.max_threads), args.runs)
+            half = rng_philox.randn_batch([rng_philox.Generator(s) for s in seeds], shape, dtype=np.float16)
+
+            exact = np.array_equal(reference.view(np.uint32), single.view(np.uint32)) and np.array_equal(reference.view(np.uint32), threaded.view(np.uint32))
+            exact_half = np.array_equal(reference.astype(np.float16).view(np.uint16), half.view(np.uint16))
+            failed = failed or not exact or not exact_half
+
+            print(f"{name} x{batch_size}: reference {t_reference * 1000:.1f}ms, engine {t_single * 1000:.1f}ms ({t_reference / t_single:.2f}x), "
+                  f"threaded {t_threaded * 1000:.1f}ms ({t_reference / t_threaded:.2f}x), "
+                  f"bit-exact float32 {'yes' if exact else 'NO'}, float16 {'yes' if exact_half else 'NO'}")
+
+    # the offset advances per call, so the second draw of a generator must match as well
+    g_reference, g_engine = rng_philox.Generator(args.seed), rng_philox.Generator(args.seed)
+    for _ in range(3):
+        if not np.array_equal(g_reference.randn_reference((4, 64, 64)), g_engine.randn((4, 64, 64))):
+            print("consecutive draws: NOT bit-exact")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark for the quantized UNet cache (backend.quant_cache).
+
+Loads a fp16/fp32 checkpoint with a quantized UNet storage dtype in a fresh process per run and reports load time and
+peak resident memory for:
+ - no cache: quantize on every load (previous behaviour),
+ - cold: quantize and store in the cache (first load),
+ - warm: read the quantized UNet from the cache.
+The UNet is moved to the GPU once in every run, because bnb weights are only quantized when moved to a CUDA device.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_quant_cache.py --checkpoint models/Stable-diffusion/model.safetensors --dtype nf4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+dtypes = ["nf4", "fp4", "fp8_e4m3fn", "fp8_e5m2"]
+
+
+def peak_rss():
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+
+
+def run_child(args):
+    sys.path.insert(0, backend_dir)
+
+    import torch
+    from backend import memory_management, quant_cache, utils
+    from backend.args import dynamic_args
+    from backend.loader import forge_loader
+
+    storage_dtype = {"fp8_e4m3fn": torch.float8_e4m3fn, "fp8_e5m2": torch.float8_e5m2}.get(args.dtype, args.dtype)
+    cache = quant_cache.QuantizedUNetCache(args.cache_dir)
+    checkpoint_key = f"{os.path.getsize(args.checkpoint):x}{int(os.path.getmtime(args.checkpoint)):x}"
+    filename = cache.filename(checkpoint_key, storage_dtype, "bench")
+
+    start = time.perf_counter()
+
+    dynamic_args["forge_unet_storage_dtype"] = storage_dtype
+    dynamic_args["forge_unet_quant_cache"] = filename if args.mode == "warm" and cache.has(filename) else None
+    sd_model = forge_loader(args.checkpoint)
+    memory_management.load_model_gpu(sd_model.forge_objects.unet)
+    load_time = time.perf_counter() - start
+
+    store_time = 0.0
+    if args.mode == "cold":
+        start = time.perf_counter()
+        cache.put(filename, utils.get_state_dict_after_quant(sd_model.forge_objects.unet.model.diffusion_model, clone=False))
+        store_time = time.perf_counter() - start
+
+    print(json.dumps(dict(load=load_time, store=store_time, peak_rss=peak_rss(), hit=dynamic_args["forge_unet_quant_cache"] is not None)))
+
+
+def run(mode, args, cache_dir):
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--checkpoint", args.checkpoint, "--dtype", args.dtype, "--cache-dir", cache_dir]
+    output = subprocess.run(command, cwd=backend_dir, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--dtype", choices=dtypes, default="nf4")
+    parser.add_argument("--runs", type=int, default=2, help="warm runs")
+    parser.add_argument("--cache-dir", default=None, help="defaults to a temporary directory that is removed afterwards")
+    parser.add_argument("--child", choices=["none", "cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        args.mode = args.child
+        run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        cache_dir = args.cache_dir or temporary_dir
+
+        results = [("no cache", run("none", args, cache_dir)), ("cold", run("cold", args, cache_dir))]
+        results += [(f"warm #{i + 1}", run("warm", args, cache_dir)) for i in range(args.runs)]
+
+        for name, result in results:
+            store = f", store {result['store']:.2f}s" if result["store"] else ""
+            print(f"{name}: load {result['load']:.2f}s{store}, peak RSS {result['peak_rss'] / 1024 ** 3:.2f} GB" + (" (cache hit)" if result["hit"] else ""))
+
+
+if __name__ == "__main__":
+    main()
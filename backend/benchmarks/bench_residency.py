@@ -0,0 +1,134 @@
+"""Simulation of the model residency planner (backend.residency) on simulated device budgets.
+
+Runs typical job flows with SD1.5, SDXL and Flux component sizes against several VRAM budgets and reports, per flow:
+ - bytes moved to the device by the reactive policy (evict the least recently loaded model) and by the planner,
+ - stage time with transfers blocking each stage, and with planned prefetches overlapping the previous stage,
+ - the bytes moved when a ResidencyJob drives a simulated device the way memory_management.free_memory does.
+No GPU or model files are needed. Exits non-zero if the planner moves more bytes than the reactive policy.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_residency.py --bandwidth 12 --budgets 6 7.5 10 16 24
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import residency  # noqa: E402
+
+GB = 1024 ** 3
+
+models = {
+    "sd15": dict(text_encoder=0.25 * GB, unet=1.7 * GB, vae=0.16 * GB, controlnet=0.7 * GB),
+    "sdxl": dict(text_encoder=1.6 * GB, unet=4.8 * GB, vae=0.16 * GB, controlnet=2.5 * GB),
+    "flux": dict(text_encoder=9.5 * GB, unet=6.4 * GB, vae=0.16 * GB, controlnet=3.3 * GB),
+}
+
+# seconds of compute per stage (approximate, for the overlap estimate)
+compute = dict(text_encoder=0.1, unet=6.0, vae=0.5, upscaler=1.0, controlnet=0.0)
+
+flows = {
+    "txt2img": [["text_encoder"], ["unet"], ["vae"]] * 2,
+    "txt2img+controlnet": [["text_encoder"], ["unet", "controlnet"], ["vae"]] * 2,
+    "hires": [["text_encoder"], ["unet"], ["vae"], ["upscaler"], ["vae"], ["unet"], ["vae"]],
+    "hires+detailer": [["text_encoder"], ["unet"], ["vae"], ["upscaler"], ["vae"], ["unet"], ["vae"]] + [["vae"], ["text_encoder"], ["unet"], ["vae"]] * 2,
+}
+
+
+class FakePatcher:
+    def __init__(self, name):
+        self.model = type(name, (), {})()
+
+
+class FakeLoaded:
+    def __init__(self, patcher):
+        self.model = patcher
+
+
+def stage_time(stage, plan_step, sizes, bandwidth, previous_step):
+    transfer = sum(sizes[c] for c in plan_step.load) / bandwidth
+    overlapped = 0.0
+    if previous_step is not None:
+        overlapped = sum(sizes[c] for c in previous_step.prefetch) / bandwidth
+    run = max((compute.get(c, 0.0) for c in stage), default=0.0)
+    return transfer + run, max(0.0, transfer - overlapped) + run
+
+
+def run_job(stages, sizes, budget, reserve):
+    """Drives a ResidencyJob over a simulated device, mirroring load_models_gpu/free_memory."""
+    patchers = {name: FakePatcher(name) for name in sizes}
+    job = residency.ResidencyJob(stages, lambda: patchers, sizes, budget, reserve=reserve)
+    loaded = []
+    moved = 0
+
+    for stage in stages:
+        requested = [patchers[c] for c in stage if c in patchers]
+        if not requested:
+            continue
+        job.advance(requested)
+
+        for p in requested:
+            current = next((m for m in loaded if m.model is p), None)
+            if current is not None:
+                loaded.remove(current)
+            else:
+                current = FakeLoaded(p)
+                moved += sizes[type(p.model).__name__]
+            loaded.insert(0, current)
+
+        in_use = sum(sizes[type(m.model.model).__name__] for m in loaded) + reserve
+        for m in job.eviction_order(loaded[::-1]):
+            if in_use <= budget:
+                break
+            if m.model not in requested:
+                loaded.remove(m)
+                in_use -= sizes[type(m.model.model).__name__]
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budgets", type=float, nargs="+", default=[6, 7.5, 10, 16, 24], help="device memory in GB")
+    parser.add_argument("--reserve", type=float, default=1.0, help="inference memory per stage in GB")
+    parser.add_argument("--bandwidth", type=float, default=12.0, help="host to device transfer rate in GB/s")
+    args = parser.parse_args()
+
+    failures = 0
+    bandwidth = args.bandwidth * GB
+    reserve = args.reserve * GB
+
+    for model_name, sizes in models.items():
+        for flow_name, flow in flows.items():
+            stages = residency.as_stages(flow, reserve)
+            for budget_gb in args.budgets:
+                budget = budget_gb * GB
+                plan = residency.plan_residency(stages, sizes, budget)
+                reactive = residency.simulate_reactive(stages, sizes, budget)
+                planned = plan.transfer_bytes()
+                job = run_job(flow, sizes, budget, reserve)
+
+                blocking = overlapped = 0.0
+                for i, (stage, step) in enumerate(zip(flow, plan.steps)):
+                    a, b = stage_time(stage, step, sizes, bandwidth, plan.steps[i - 1] if i > 0 else None)
+                    blocking += a
+                    overlapped += b
+
+                ok = planned <= reactive and job == planned
+                failures += not ok
+                swapped = any(step.swap for step in plan.steps)
+
+                print(f"{model_name:5} {flow_name:19} {budget_gb:5.1f} GB: reactive {reactive / GB:6.2f} GB, planned {planned / GB:6.2f} GB, "
+                      f"job {job / GB:6.2f} GB, prefetch {plan.prefetch_bytes() / GB:5.2f} GB, time {blocking:6.2f}s -> {overlapped:6.2f}s"
+                      + (" (swap)" if swapped else "") + ("" if ok else "  MISMATCH"))
+
+    if failures:
+        print(f"{failures} flow(s) moved more data with the planner than the reactive policy, or the job disagreed with its plan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark for txt2img resolution bucketing (modules_forge.resolution_buckets).
+
+Replays a stream of requests at random sizes (multiples of 8 around common aspect ratios) and reports:
+ - the bucket hit rate and padding overhead for the given bucket list,
+ - the number of distinct latent shapes with and without bucketing,
+ - on CUDA, for a small conv + attention workload run at each request's latent shape: device segments allocated by
+   the caching allocator (cudaMalloc calls), reserved memory at the end and time per request, with and without
+   bucketing and pre-reservation.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_resolution_buckets.py --requests 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+os.environ.setdefault('IGNORE_CMD_ARGS_ERRORS', '1')
+
+import torch  # noqa: E402
+
+from backend import memory_management  # noqa: E402
+from modules_forge import resolution_buckets  # noqa: E402
+
+
+default_buckets = '512x512, 512x768, 768x512, 768x768, 640x1536, 768x1344, 832x1216, 896x1152, 1024x1024, 1152x896, 1216x832, 1344x768, 1536x640'
+
+
+def make_requests(count, seed=0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        base = rng.choice([512, 640, 768, 896, 1024])
+        ratio = rng.choice([1.0, 1.0, 0.75, 1.333, 0.5625, 1.777])
+        width = max(256, int(base * ratio ** 0.5) // 8 * 8 + rng.choice([-16, -8, 0, 0, 8]))
+        height = max(256, int(base / ratio ** 0.5) // 8 * 8 + rng.choice([-16, -8, 0, 0, 8]))
+        requests.append((width, height))
+    return requests
+
+
+def workload(latent, weight):
+    batch, channels, height, width = latent.shape
+    h = torch.nn.functional.conv2d(latent, weight, padding=1)
+    tokens = h.flatten(2).transpose(1, 2)
+    h = torch.nn.functional.scaled_dot_product_attention(tokens, tokens, tokens)
+    return h.transpose(1, 2).reshape(batch, -1, height, width).sum()
+
+
+def run_cuda(requests, buckets, reserve, device):
+    torch.cuda.empty_cache()
+    torch.cuda.reset_peak_memory_stats(device)
+    segments = torch.cuda.memory_stats(device).get('segment.all.allocated', 0)
+    weight = torch.randn((64, 4, 3, 3), device=device, dtype=torch.float16)
+
+    start = time.perf_counter()
+    for width, height in requests:
+        bucket = resolution_buckets.choose_bucket(width, height, buckets) if buckets else None
+        width, height = bucket or (width, height)
+        shape = (2, 4, height // 8, width // 8)
+        if reserve and bucket is not None:
+            memory_management.reserve_inference_memory(2 * 64 * shape[2] * shape[3] * 2 * 6, device)
+        workload(torch.randn(shape, device=device, dtype=torch.float16), weight)
+    torch.cuda.synchronize(device)
+    seconds = (time.perf_counter() - start) / len(requests)
+
+    stats = torch.cuda.memory_stats(device)
+    return seconds, stats.get('segment.all.allocated', 0) - segments, stats['reserved_bytes.all.current']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--buckets', default=default_buckets)
+    args = parser.parse_args()
+
+    buckets = resolution_buckets.parse_buckets(args.buckets)
+    requests = make_requests(args.requests)
+
+    stats = resolution_buckets.BucketStats()
+    shapes = set()
+    for width, height in requests:
+        bucket = resolution_buckets.choose_bucket(width, height, buckets)
+        stats.record(width, height, bucket, 1)
+        shapes.add(bucket or (width // 8 * 8, height // 8 * 8))
+
+    print(f'{len(buckets)} buckets, {len(requests)} requests: {stats.summary()}')
+    print(f'distinct latent shapes: {len({(w // 8 * 8, h // 8 * 8) for w, h in requests})} unbucketed, {len(shapes)} bucketed')
+
+    if not torch.cuda.is_available():
+        print('CUDA is not available, skipping the allocator measurement')
+        return
+
+    device = torch.device('cuda')
+    mb = 1024 * 1024
+    for name, use_buckets, reserve in [('unbucketed', False, False), ('bucketed', True, False), ('bucketed + reserve', True, True)]:
+        seconds, segments, reserved = run_cuda(requests, buckets if use_buckets else None, reserve, device)
+        print(f'{name:18}: {seconds * 1000:.2f} ms per request, {segments} segments allocated, {reserved / mb:.0f} MB reserved at the end')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark for API-only startup time.
+
+Starts the backend with --nowebui, with and without --api-fast-startup, and measures:
+ - time until the server answers /sdapi/v1/health (only available early with --api-fast-startup),
+ - time until the full API is available (/sdapi/v1/sd-models answers 200),
+and prints the slowest stages reported by /sdapi/v1/startup-timings for the last run of each mode.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_startup.py --runs 3 -- --skip-prepare-environment --skip-load-model-at-start
+
+Arguments after -- are passed to launch.py unchanged.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, ConnectionError, TimeoutError, ValueError):
+        return None
+
+
+def run_once(fast, port, extra_args, timeout):
+    args = [sys.executable, "launch.py", "--nowebui", "--port", str(port)] + extra_args
+    if fast:
+        args.append("--api-fast-startup")
+
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=backend_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    first_response = None
+    api_ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"backend exited with code {process.returncode}")
+
+            if first_response is None and get_json(f"{base}/sdapi/v1/health") is not None:
+                first_response = time.perf_counter() - start
+
+            if get_json(f"{base}/sdapi/v1/sd-models") is not None:
+                api_ready = time.perf_counter() - start
+                break
+
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f"backend did not become ready in {timeout} seconds")
+
+        timings = get_json(f"{base}/sdapi/v1/startup-timings")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return first_response if first_response is not None else api_ready, api_ready, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=7871)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest startup stages to print")
+    parser.add_argument("launch_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    extra_args = [x for x in args.launch_args if x != "--"]
+
+    for fast in (False, True):
+        name = "--api-fast-startup" if fast else "default"
+        first, ready, timings = [], [], None
+
+        for _ in range(args.runs):
+            first_response, api_ready, timings = run_once(fast, args.port, extra_args, args.timeout)
+            first.append(first_response)
+            ready.append(api_ready)
+
+        print(f"{name}: first response {min(first):.2f}s (median {sorted(first)[len(first) // 2]:.2f}s), "
+              f"full API {min(ready):.2f}s (median {sorted(ready)[len(ready) // 2]:.2f}s)")
+
+        if timings is not None:
+            records = sorted(timings["records"].items(), key=lambda x: x[1], reverse=True)
+            for category, time_taken in records[:args.top]:
+                print(f"    {category}: {time_taken:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
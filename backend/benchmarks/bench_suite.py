@@ -0,0 +1,652 @@
+"""Reproducible benchmark suite for the generation pipeline, on tiny randomly initialized models, on CPU.
+
+The models are built from the configs under backend/huggingface (SD1.5, SDXL, Flux), with the same layout (levels,
+attention placement, conditioning inputs, latent channels, VAE scale) but narrow widths and shallow depths, and are
+loaded through the same path as real checkpoints (forge operations, then a state dict). No model files are needed.
+
+Cases:
+ - pipeline/<model>/<txt2img|img2img|hires>: text encoding of prompt and negative prompt, sampling through
+   sampling_prepare / sampling_function_inner / sampling_cleanup with a k-diffusion sampler, VAE encode (img2img) and
+   decode; hires samples at the base size, upscales the latent and runs a second pass,
+ - micro/sampler/<name>: the samplers of k_diffusion/sampling.py on an analytic denoiser, i.e. the sampler overhead,
+ - micro/calc_cond_uncond_batch/<variant>: one CFG evaluation on the tiny SD1.5 UNet, with one or three (AND) prompts,
+ - micro/lora/<merge|unchanged>: LoraLoader.refresh with a synthetic rank 8 LoRA on every weight of the tiny SDXL UNet,
+ - api/txt2img: POST /sdapi/v1/txt2img against a running server (only with --url); this is the only case that goes
+   through process_images and the API layer, with whatever model the server has loaded.
+
+Every case runs in its own process, so the peak resident memory is its own. Results (latency mean and percentiles,
+it/s where there are sampling steps, peak memory, the time per phase) are written to JSON together with the settings
+and environment, and two result files can be compared: a case regresses when its median latency or peak memory grew,
+or its it/s dropped, by more than the threshold. The exit code is 1 when something regressed.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_suite.py --output base.json
+    python benchmarks/bench_suite.py --cases 'pipeline/sd15/*' 'micro/*' --output new.json --baseline base.json
+    python benchmarks/bench_suite.py --compare base.json new.json --threshold 0.1
+    python benchmarks/bench_suite.py --url http://127.0.0.1:7861 --cases 'api/*'
+"""
+
+import argparse
+import fnmatch
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+huggingface_dir = os.path.join(backend_dir, 'backend', 'huggingface')
+
+models = {
+    'sd15': 'runwayml/stable-diffusion-v1-5',
+    'sdxl': 'stabilityai/stable-diffusion-xl-base-1.0',
+    'flux': 'black-forest-labs/FLUX.1-dev',
+}
+
+samplers = ['euler', 'euler_ancestral', 'heun', 'dpm_2', 'lms', 'dpmpp_2s_ancestral', 'dpmpp_sde', 'dpmpp_2m',
+            'dpmpp_2m_sde', 'dpmpp_3m_sde', 'ipndm', 'deis']
+
+cases = [f'pipeline/{model}/{mode}' for model in models for mode in ['txt2img', 'img2img', 'hires']]
+cases += [f'micro/sampler/{name}' for name in samplers]
+cases += ['micro/calc_cond_uncond_batch/single', 'micro/calc_cond_uncond_batch/and', 'micro/lora/merge', 'micro/lora/unchanged']
+cases += ['api/txt2img']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def describe(seconds):
+    return dict(mean=sum(seconds) / len(seconds), p50=percentile(seconds, 0.5), p90=percentile(seconds, 0.9),
+                p99=percentile(seconds, 0.99), min=min(seconds), max=max(seconds))
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def read_config(model, component, filename='config.json'):
+    with open(os.path.join(huggingface_dir, models[model], component, filename), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Tiny models
+
+
+def tiny_text_config(config, layers=2):
+    hidden = config['hidden_size'] // 16
+    return dict(config, hidden_size=hidden, intermediate_size=hidden * 4, num_attention_heads=hidden // 16,
+                num_hidden_layers=layers, projection_dim=hidden)
+
+
+def tiny_unet_arguments(config, context_dim, pooled_dim, width=32, num_res_blocks=1):
+    """Diffusers UNet2DConditionModel config to IntegratedUNet2DConditionModel arguments, keeping the levels and where
+    attention is but with `width` base channels, `num_res_blocks` per level and one transformer per attention."""
+
+    channels = config['block_out_channels']
+    attention = ['CrossAttn' in t for t in config['down_block_types']]
+    depth = [1 if a else 0 for a in attention]
+
+    arguments = dict(
+        in_channels=config['in_channels'], out_channels=config['out_channels'], model_channels=width,
+        channel_mult=[c // channels[0] for c in channels], num_res_blocks=num_res_blocks, num_head_channels=16,
+        use_spatial_transformer=True, context_dim=context_dim, use_linear_in_transformer=config.get('use_linear_projection', False),
+        transformer_depth=[d for d in depth for _ in range(num_res_blocks)],
+        transformer_depth_output=[d for d in depth for _ in range(num_res_blocks + 1)],
+        transformer_depth_middle=1 if config.get('mid_block_type', 'UNetMidBlock2DCrossAttn') else -1,
+    )
+
+    if config.get('addition_embed_type') == 'text_time':
+        arguments.update(num_classes='sequential', adm_in_channels=pooled_dim + 6 * 256)
+
+    return arguments
+
+
+def tiny_flux_arguments(config, context_dim, pooled_dim, heads=2, head_dim=32):
+    # the axes of the rotary embedding keep their proportions (16, 56, 56 of 128)
+    axes = [head_dim // 8, head_dim * 7 // 16, head_dim * 7 // 16]
+    return dict(in_channels=config['in_channels'] // 4, vec_in_dim=pooled_dim, context_in_dim=context_dim,
+                hidden_size=heads * head_dim, mlp_ratio=4.0, num_heads=heads, depth=1, depth_single_blocks=2,
+                axes_dim=axes, theta=10000, qkv_bias=True, guidance_embed=config['guidance_embeds'])
+
+
+def tiny_vae_config(config, divisor=4):
+    return dict(config, block_out_channels=[c // divisor for c in config['block_out_channels']], layers_per_block=1)
+
+
+def build(constructor, seed):
+    """Random weights from a plain torch construction, loaded into the forge operations the way a checkpoint is."""
+
+    import torch
+    from backend.operations import using_forge_operations
+    from backend.state_dict import load_state_dict
+
+    torch.manual_seed(seed)
+    state_dict = constructor().state_dict()
+
+    with using_forge_operations(device=torch.device('cpu'), dtype=torch.float32):
+        model = constructor()
+
+    load_state_dict(model, state_dict)
+    return model.eval()
+
+
+class TinyModel:
+    def __init__(self, name, seed=0):
+        import torch
+        from transformers import CLIPTextConfig, CLIPTextModel
+        from backend.nn.clip import IntegratedCLIP
+        from backend.nn.t5 import IntegratedT5
+        from backend.nn.unet import IntegratedUNet2DConditionModel, Timestep
+        from backend.nn.vae import IntegratedAutoencoderKL
+        from backend.patcher.unet import UnetPatcher
+        from backend.patcher.vae import VAE
+        from backend.modules.k_prediction import Prediction, PredictionFlux
+
+        self.name = name
+        self.text_encoders = {}
+
+        def clip(component):
+            config = CLIPTextConfig(**tiny_text_config(read_config(name, component)))
+            return build(lambda: IntegratedCLIP(CLIPTextModel, config, add_text_projection=True), seed), config
+
+        self.text_encoders['clip_l'], clip_l_config = clip('text_encoder')
+        pooled_dim = clip_l_config.hidden_size
+
+        if name == 'sd15':
+            context_dim = clip_l_config.hidden_size
+        elif name == 'sdxl':
+            self.text_encoders['clip_g'], clip_g_config = clip('text_encoder_2')
+            context_dim = clip_l_config.hidden_size + clip_g_config.hidden_size
+            pooled_dim = clip_g_config.hidden_size
+            self.embedder = Timestep(256)
+        else:
+            t5_config = read_config(name, 'text_encoder_2')
+            t5_config = dict(t5_config, d_model=t5_config['d_model'] // 64, d_ff=t5_config['d_ff'] // 64, num_heads=4, num_layers=2)
+            self.text_encoders['t5xxl'] = build(lambda: IntegratedT5(t5_config), seed)
+            context_dim = t5_config['d_model']
+
+        scheduler = read_config(name, 'scheduler', 'scheduler_config.json')
+
+        if name == 'flux':
+            config = read_config(name, 'transformer')
+            from backend.nn.flux import IntegratedFluxTransformer2DModel
+            arguments = tiny_flux_arguments(config, context_dim, pooled_dim)
+            unet = build(lambda: IntegratedFluxTransformer2DModel(**arguments), seed)
+            predictor = PredictionFlux(seq_len=4096, base_seq_len=scheduler['base_image_seq_len'], max_seq_len=scheduler['max_image_seq_len'],
+                                       base_shift=scheduler['base_shift'], max_shift=scheduler['max_shift'])
+        else:
+            config = read_config(name, 'unet')
+            arguments = tiny_unet_arguments(config, context_dim, pooled_dim)
+            unet = build(lambda: IntegratedUNet2DConditionModel(**arguments), seed)
+            predictor = Prediction(sigma_data=1.0, prediction_type=scheduler.get('prediction_type', 'epsilon'), beta_schedule='linear',
+                                   linear_start=scheduler['beta_start'], linear_end=scheduler['beta_end'], timesteps=scheduler['num_train_timesteps'])
+
+        cpu = torch.device('cpu')
+        unet.storage_dtype = unet.computation_dtype = torch.float32
+        unet.load_device = unet.initial_device = unet.offload_device = cpu
+        self.unet = UnetPatcher.from_model(model=unet, diffusers_scheduler=None, k_predictor=predictor, config=None)
+
+        vae_config = tiny_vae_config(IntegratedAutoencoderKL.load_config(os.path.join(huggingface_dir, models[name], 'vae')))
+        self.vae = VAE(model=build(lambda: IntegratedAutoencoderKL.from_config(vae_config), seed), device=cpu, dtype=torch.float32)
+
+        self.guidance = 3.5 if name == 'flux' and config['guidance_embeds'] else None
+        self.cfg_scale = 1.0 if name == 'flux' else 7.0
+        self.token_generator = torch.Generator().manual_seed(seed)
+
+    def tokens(self, batch, length, vocab_size, start=None, end=None):
+        import torch
+
+        tokens = torch.randint(1, vocab_size - 2, (batch, length), generator=self.token_generator)
+        if start is not None:
+            tokens[:, 0] = start
+        if end is not None:
+            tokens[:, length // 2:] = end
+        return tokens
+
+    def clip(self, key, tokens, layer):
+        encoder = self.text_encoders[key].transformer
+        outputs = encoder(tokens, output_hidden_states=True)
+        z = encoder.text_model.final_layer_norm(outputs.hidden_states[layer])
+        return z, encoder.text_projection(outputs.pooler_output)
+
+    def encode_text(self, batch):
+        """Conditioning for `batch` prompts, in the format of the diffusion engine's get_learned_conditioning."""
+
+        import torch
+
+        config = self.text_encoders['clip_l'].transformer.config
+        tokens = self.tokens(batch, 77, config.vocab_size, config.bos_token_id, config.eos_token_id)
+
+        if self.name == 'sd15':
+            return self.clip('clip_l', tokens, -1)[0]
+
+        if self.name == 'sdxl':
+            cond_l = self.clip('clip_l', tokens, -2)[0]
+            cond_g, pooled = self.clip('clip_g', tokens, -2)
+            sizes = [self.embedder(torch.Tensor([size])) for size in [1024, 1024, 0, 0, 1024, 1024]]
+            flat = torch.flatten(torch.cat(sizes)).unsqueeze(dim=0).repeat(batch, 1).to(pooled)
+            return dict(crossattn=torch.cat([cond_l, cond_g], dim=2), vector=torch.cat([pooled, flat], dim=1))
+
+        pooled = self.clip('clip_l', tokens, -1)[1]
+        t5 = self.text_encoders['t5xxl'].transformer
+        cond = dict(crossattn=t5(self.tokens(batch, 256, t5.config['vocab_size'], end=1)), vector=pooled)
+        if self.guidance is not None:
+            cond['guidance'] = torch.FloatTensor([self.guidance] * batch)
+        return cond
+
+
+# Sampling
+
+
+def simple_sigmas(predictor, steps):
+    import torch
+
+    stride = len(predictor.sigmas) / steps
+    return torch.FloatTensor([float(predictor.sigmas[-(1 + int(i * stride))]) for i in range(steps)] + [0.0])
+
+
+def sampler_function(name):
+    from k_diffusion import sampling
+    return getattr(sampling, f'sample_{name}')
+
+
+class Denoiser:
+    """What the sampler calls: conditions are compiled every step and CFG is evaluated by sampling_function_inner, like
+    the webui's CFG denoiser does through sampling_function."""
+
+    def __init__(self, unet, cond, uncond, cfg_scale):
+        self.unet = unet
+        self.cond = cond
+        self.uncond = uncond
+        self.cfg_scale = cfg_scale
+        self.steps = 0
+
+    def __call__(self, x, sigma, **kwargs):
+        from backend.sampling.condition import compile_conditions
+        from backend.sampling.sampling_function import sampling_function_inner
+
+        self.steps += 1
+        uncond = compile_conditions(self.uncond) if self.cfg_scale != 1.0 else None
+        return sampling_function_inner(self.unet.model, x, sigma, uncond, compile_conditions(self.cond), self.cfg_scale, self.unet.model_options)
+
+
+def sample(model, sampler, latent, noise, cond, uncond, steps, denoise=1.0):
+    from backend.sampling.sampling_function import sampling_prepare, sampling_cleanup
+
+    predictor = model.unet.model.predictor
+    sampling_prepare(model.unet, x=latent)
+
+    if denoise < 1.0:
+        t_enc = max(1, int(denoise * steps))
+        sigmas = simple_sigmas(predictor, steps)[steps - t_enc - 1:]
+        x = predictor.noise_scaling(sigmas[0], noise, latent)
+    else:
+        sigmas = simple_sigmas(predictor, steps)
+        x = predictor.noise_scaling(sigmas[0], noise, latent * 0)
+
+    denoiser = Denoiser(model.unet, cond, uncond, model.cfg_scale)
+    samples = sampler_function(sampler)(denoiser, x, sigmas, disable=True)
+    sampling_cleanup(model.unet)
+    return predictor.inverse_noise_scaling(sigmas[-1], samples), len(sigmas) - 1
+
+
+class Phases:
+    def __init__(self):
+        self.seconds = {}
+        self.steps = 0
+
+    def measure(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+        return result
+
+
+def decode(model, latent, method):
+    latent = model.vae.first_stage_model.process_out(latent)
+    if method == 'streaming':
+        return model.vae.decode_streaming(latent)
+    return model.vae.decode(latent)
+
+
+def pipeline_job(model, mode, settings, seed):
+    import torch
+
+    torch.manual_seed(seed)
+    phases = Phases()
+    ratio = model.vae.downscale_ratio
+    shape = (settings.batch, model.vae.latent_channels, settings.size // ratio, settings.size // ratio)
+
+    cond = phases.measure('text encoding', model.encode_text, settings.batch)
+    uncond = phases.measure('text encoding', model.encode_text, settings.batch)
+
+    if mode == 'img2img':
+        image = torch.rand((settings.batch, settings.size, settings.size, 3))
+        latent = phases.measure('vae encode', lambda: model.vae.first_stage_model.process_in(model.vae.encode(image)))
+        samples, steps = phases.measure('sampling', sample, model, settings.sampler, latent, torch.randn(shape), cond, uncond, settings.steps, denoise=0.6)
+        phases.steps += steps
+    else:
+        latent = torch.zeros(shape)
+        samples, steps = phases.measure('sampling', sample, model, settings.sampler, latent, torch.randn(shape), cond, uncond, settings.steps)
+        phases.steps += steps
+
+        if mode == 'hires':
+            upscaled = phases.measure('latent upscale', torch.nn.functional.interpolate, samples, scale_factor=1.5, mode='bilinear')
+            samples, steps = phases.measure('sampling', sample, model, settings.sampler, upscaled, torch.randn_like(upscaled), cond, uncond,
+                                            max(1, settings.steps // 2), denoise=0.55)
+            phases.steps += steps
+
+    phases.measure('vae decode', decode, model, samples, settings.vae_decode)
+    return phases
+
+
+# Cases
+
+
+def run_repeated(job, settings):
+    for i in range(settings.warmup):
+        job(settings.repeat + i)
+
+    seconds = []
+    phases = []
+    for i in range(settings.repeat):
+        start = time.perf_counter()
+        phases.append(job(i))
+        seconds.append(time.perf_counter() - start)
+    return seconds, phases
+
+
+def run_pipeline(name, settings):
+    _, model_name, mode = name.split('/')
+    model = TinyModel(model_name)
+    setup_rss = peak_rss()
+
+    seconds, phases = run_repeated(lambda seed: pipeline_job(model, mode, settings, seed), settings)
+    steps = sum(p.steps for p in phases)
+    sampling = sum(p.seconds['sampling'] for p in phases)
+    names = phases[0].seconds.keys()
+    return dict(seconds=seconds, it_per_second=steps / sampling, setup_rss=setup_rss,
+                phases={n: sum(p.seconds[n] for p in phases) / len(phases) for n in names})
+
+
+def run_sampler(name, settings):
+    import torch
+    from k_diffusion.sampling import get_sigmas_karras
+
+    sampler = name.split('/')[-1]
+    x = torch.randn((settings.batch, 4, 128, 128), generator=torch.Generator().manual_seed(0))
+    sigmas = get_sigmas_karras(settings.steps, 0.0292, 14.6146)
+    setup_rss = peak_rss()
+    evaluations = []
+
+    def denoiser(x, sigma, **kwargs):
+        evaluations.append(1)
+        return x / (1.0 + sigma.view(-1, 1, 1, 1) ** 2)
+
+    def job(seed):
+        torch.manual_seed(seed)
+        sampler_function(sampler)(denoiser, x * sigmas[0], sigmas, disable=True)
+
+    seconds, _ = run_repeated(job, settings)
+    return dict(seconds=seconds, it_per_second=settings.steps * settings.repeat / sum(seconds), setup_rss=setup_rss,
+                model_evaluations=len(evaluations) // (settings.repeat + settings.warmup))
+
+
+def run_calc_cond_uncond_batch(name, settings):
+    import torch
+    from backend.sampling.condition import compile_conditions
+    from backend.sampling.sampling_function import calc_cond_uncond_batch, sampling_prepare, sampling_cleanup
+
+    model = TinyModel('sd15')
+    prompts = 3 if name.endswith('/and') else 1
+    x = torch.randn((settings.batch, 4, settings.size // 8, settings.size // 8), generator=torch.Generator().manual_seed(0))
+    sigma = torch.full((settings.batch,), 2.0)
+
+    cond = []
+    for _ in range(prompts):
+        entry = compile_conditions(model.encode_text(settings.batch))[0]
+        entry['strength'] = 1.0 / prompts
+        cond.append(entry)
+    uncond = compile_conditions(model.encode_text(settings.batch))
+
+    sampling_prepare(model.unet, x=x)
+    setup_rss = peak_rss()
+    seconds, _ = run_repeated(lambda seed: calc_cond_uncond_batch(model.unet.model, cond, uncond, x, sigma, model.unet.model_options), settings)
+    sampling_cleanup(model.unet)
+    return dict(seconds=seconds, setup_rss=setup_rss)
+
+
+def run_lora(name, settings):
+    import torch
+
+    model = TinyModel('sdxl')
+    generator = torch.Generator().manual_seed(0)
+    patches = {}
+    for key, weight in model.unet.model.named_parameters():
+        if key.startswith('diffusion_model.') and key.endswith('.weight') and weight.ndim >= 2:
+            rank = min(8, weight.shape[0])
+            up = torch.randn((weight.shape[0], rank), generator=generator) * 0.01
+            down = torch.randn((rank,) + tuple(weight.shape[1:]), generator=generator) * 0.01
+            patches[key] = ('lora', (up, down, float(rank), None, None))
+    model.unet.add_patches(filename='synthetic.safetensors', patches=patches, strength_patch=0.8)
+
+    loader = model.unet.lora_loader
+    loader.refresh(model.unet.lora_patches)
+    setup_rss = peak_rss()
+    force = name.endswith('/merge')
+    seconds, _ = run_repeated(lambda seed: loader.refresh(model.unet.lora_patches, force_refresh=force), settings)
+    return dict(seconds=seconds, setup_rss=setup_rss, patched_weights=len(patches))
+
+
+def run_api(name, settings):
+    import urllib.request
+
+    payload = dict(prompt='a photo of a cat', negative_prompt='blurry', steps=settings.steps, width=settings.size,
+                   height=settings.size, batch_size=settings.batch, sampler_name='Euler', seed=0, send_images=True, save_images=False)
+
+    def job(seed):
+        payload['seed'] = seed
+        request = urllib.request.Request(settings.url.rstrip('/') + '/sdapi/v1/txt2img', data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=600) as response:
+            json.loads(response.read())
+
+    seconds, _ = run_repeated(job, settings)
+    return dict(seconds=seconds, it_per_second=settings.steps * settings.repeat / sum(seconds))
+
+
+runners = {
+    'pipeline': run_pipeline,
+    'micro/sampler': run_sampler,
+    'micro/calc_cond_uncond_batch': run_calc_cond_uncond_batch,
+    'micro/lora': run_lora,
+    'api': run_api,
+}
+
+
+def run_case(name, settings):
+    argv = sys.argv
+    sys.argv = [argv[0], '--always-cpu', '--disable-gpu-warning']
+    sys.path.insert(0, backend_dir)
+    import torch
+    import backend.args  # noqa: F401, parses the flags above
+    sys.argv = argv
+
+    torch.set_num_threads(settings.threads)
+    runner = next(runners[prefix] for prefix in sorted(runners, key=len, reverse=True) if name.startswith(prefix + '/'))
+
+    with torch.inference_mode():
+        result = runner(name, settings)
+
+    seconds = result.pop('seconds')
+    result.update(iterations=len(seconds), latency=describe(seconds), peak_rss=peak_rss())
+    result.setdefault('it_per_second', None)
+    return result
+
+
+# Results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=backend_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def environment(settings):
+    import torch
+
+    return dict(python=platform.python_version(), torch=torch.__version__, platform=platform.platform(),
+                processor=platform.processor(), cpu_count=os.cpu_count(), threads=settings.threads, commit=git_commit())
+
+
+def run_suite(selected, settings):
+    results = {}
+    for name in selected:
+        command = [sys.executable, os.path.abspath(__file__), '--child', name] + settings_arguments(settings)
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f'{name:45} FAILED')
+            print(completed.stderr.strip()[-2000:])
+            results[name] = dict(error=completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed')
+            continue
+
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results[name] = result
+        latency = result['latency']
+        speed = f"{result['it_per_second']:8.2f} it/s" if result['it_per_second'] else ' ' * 13
+        print(f"{name:45} p50 {latency['p50'] * 1000:9.1f} ms  p90 {latency['p90'] * 1000:9.1f} ms  {speed}  peak {result['peak_rss'] / 2 ** 20:7.0f} MB")
+    return results
+
+
+def compare(base, new, threshold, memory_threshold):
+    """Returns the regressions of `new` against `base`, printing every case present in both."""
+
+    regressions = []
+    print(f"{'case':45} {'p50 base':>10} {'p50 new':>10} {'change':>8} {'it/s change':>12} {'memory change':>14}")
+
+    for name in sorted(set(base['results']) & set(new['results'])):
+        a, b = base['results'][name], new['results'][name]
+        if 'error' in a or 'error' in b:
+            continue
+
+        latency = b['latency']['p50'] / a['latency']['p50'] - 1
+        memory = b['peak_rss'] / a['peak_rss'] - 1
+        speed = b['it_per_second'] / a['it_per_second'] - 1 if a['it_per_second'] and b['it_per_second'] else None
+
+        flags = []
+        if latency > threshold:
+            flags.append('latency')
+        if speed is not None and speed < -threshold:
+            flags.append('it/s')
+        if memory > memory_threshold:
+            flags.append('memory')
+        if flags:
+            regressions.append((name, flags))
+
+        speed_text = f'{speed * 100:+.1f}%' if speed is not None else '-'
+        print(f"{name:45} {a['latency']['p50'] * 1000:8.1f}ms {b['latency']['p50'] * 1000:8.1f}ms {latency * 100:+7.1f}% "
+              f"{speed_text:>12} {memory * 100:+13.1f}%" + ('  REGRESSION: ' + ', '.join(flags) if flags else ''))
+
+    for name in sorted(set(base['results']) ^ set(new['results'])):
+        print(f"{name:45} only in {'base' if name in base['results'] else 'new'}")
+
+    if base.get('settings') != new.get('settings'):
+        print('warning: the runs used different settings, the comparison may not be meaningful')
+    if base.get('environment', {}).get('torch') != new.get('environment', {}).get('torch'):
+        print('warning: the runs used different torch versions')
+
+    print(f'{len(regressions)} regression(s) over {threshold * 100:.0f}% latency/it/s, {memory_threshold * 100:.0f}% memory')
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+setting_names = ['steps', 'size', 'batch', 'sampler', 'repeat', 'warmup', 'threads', 'vae_decode', 'url']
+
+
+def settings_arguments(settings):
+    arguments = []
+    for name in setting_names:
+        value = getattr(settings, name)
+        if value is not None:
+            arguments += ['--' + name.replace('_', '-'), str(value)]
+    return arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', default=['pipeline/*', 'micro/*', 'api/*'], help='glob patterns of the cases to run')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    parser.add_argument('--steps', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256, help='image size in pixels')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--sampler', default='euler', choices=samplers, help='sampler of the pipeline cases')
+    parser.add_argument('--repeat', type=int, default=5, help='measured iterations per case')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured iterations per case')
+    parser.add_argument('--threads', type=int, default=4, help='torch CPU threads, fixed for reproducibility')
+    parser.add_argument('--vae-decode', default='full', choices=['full', 'streaming'])
+    parser.add_argument('--url', default=None, help='server for the api cases, which are skipped without it')
+    parser.add_argument('--output', default=None, help='where to write the results')
+    parser.add_argument('--baseline', default=None, help='results to compare this run against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), default=None, help='compare two result files and exit')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative latency or it/s change that counts as a regression')
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help='relative peak memory growth that counts as a regression')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_case(args.child, args)))
+        return
+
+    if args.compare is not None:
+        sys.exit(1 if compare(load(args.compare[0]), load(args.compare[1]), args.threshold, args.memory_threshold) else 0)
+
+    selected = [name for name in cases if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    if args.url is None:
+        selected = [name for name in selected if not name.startswith('api/')]
+
+    if args.list:
+        print('\n'.join(selected))
+        return
+
+    sys.path.insert(0, backend_dir)
+    data = dict(version=1, created=time.strftime('%Y-%m-%dT%H:%M:%S'), environment=environment(args),
+                settings={name: getattr(args, name) for name in setting_names}, results=run_suite(selected, args))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        print(f'results written to {args.output}')
+
+    failed = [name for name, result in data['results'].items() if 'error' in result]
+
+    if args.baseline:
+        print()
+        if compare(load(args.baseline), data, args.threshold, args.memory_threshold):
+            sys.exit(1)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
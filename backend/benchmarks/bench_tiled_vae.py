@@ -0,0 +1,149 @@
+"""CPU benchmark for tiled VAE decode/encode in backend.patcher.vae.
+
+Runs a randomly initialized, reduced-width AutoencoderKL with the SD layout (8x downscale) on CPU and compares:
+ - full: the whole latent/image in one call, the reference,
+ - single pass: one feathered tiling with batched tiles (default tiled mode),
+ - three pass: average of three differently shaped tilings (the previous tiled mode),
+ - streaming: full-width row bands converted straight to uint8 (decode only),
+reporting time per call and the numerical difference of each tiled mode against the reference and each other.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_tiled_vae.py --width 1024 --height 1024 --runs 2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.argv += ["--always-cpu"]
+
+import torch  # noqa: E402
+
+from backend import memory_management  # noqa: E402
+from backend.nn.vae import IntegratedAutoencoderKL  # noqa: E402
+from backend.patcher.vae import VAE  # noqa: E402
+
+
+class DeterministicEncode(torch.nn.Module):
+    """Encodes to the posterior mean instead of a sample, so that differences come from tiling only."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def encode(self, x, regulation=None):
+        return self.model.encode(x, regulation=lambda posterior: posterior.mean)
+
+    def decode(self, z):
+        return self.model.decode(z)
+
+
+def make_vae(width_multiplier):
+    torch.manual_seed(0)
+    ch = 32 * width_multiplier
+    model = IntegratedAutoencoderKL(
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        block_out_channels=(ch, ch, ch * 2, ch * 2),
+        layers_per_block=1,
+    ).eval()
+
+    vae = VAE(no_init=True)
+    vae.first_stage_model = DeterministicEncode(model)
+    vae.downscale_ratio = 8
+    vae.latent_channels = 4
+    vae.device = torch.device("cpu")
+    vae.vae_dtype = torch.float32
+    vae.output_device = torch.device("cpu")
+    vae.memory_used_encode = lambda shape, dtype: (1767 * shape[2] * shape[3]) * memory_management.dtype_size(dtype)
+    vae.memory_used_decode = lambda shape, dtype: (2178 * shape[2] * shape[3] * 64) * memory_management.dtype_size(dtype)
+    return vae
+
+
+def timed(func, runs):
+    result = None
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        with torch.inference_mode():
+            result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def diff_report(name, a, b):
+    d = (a.float() - b.float()).abs()
+    mse = float((d ** 2).mean())
+    psnr = float("inf") if mse == 0 else 10 * torch.log10(torch.tensor(1.0 / mse)).item()
+    print(f"    {name}: max abs {d.max().item():.5f}, mean abs {d.mean().item():.6f}, PSNR {psnr:.2f} dB")
+
+
+def set_three_pass(value):
+    memory_management.VAE_TILED_THREE_PASS = value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--width-multiplier", type=int, default=1, help="channel width of the test VAE in multiples of 32")
+    parser.add_argument("--decode-tile", type=int, default=64, help="decode tile size in latent pixels")
+    parser.add_argument("--decode-overlap", type=int, default=16)
+    parser.add_argument("--band-rows", type=int, default=32, help="streaming decode band height in latent pixels")
+    parser.add_argument("--band-overlap", type=int, default=8)
+    parser.add_argument("--encode-tile", type=int, default=512, help="encode tile size in image pixels")
+    parser.add_argument("--encode-overlap", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads, 0 = torch default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    vae = make_vae(args.width_multiplier)
+    latent = torch.randn((args.batch_size, 4, args.height // 8, args.width // 8), generator=torch.Generator().manual_seed(1))
+
+    tile, tile_batch_size = vae.plan_tiles(latent.shape, args.decode_tile, args.decode_overlap, vae.memory_used_decode)
+    print(f"decode {args.batch_size}x{args.width}x{args.height}, tile {tile}, {tile_batch_size} tiles per batch")
+
+    full, t_full = timed(lambda: torch.clamp((vae.first_stage_model.decode(latent) + 1.0) / 2.0, min=0.0, max=1.0), args.runs)
+    set_three_pass(False)
+    single, t_single = timed(lambda: vae.decode_tiled_(latent, args.decode_tile, args.decode_tile, args.decode_overlap), args.runs)
+    set_three_pass(True)
+    three, t_three = timed(lambda: vae.decode_tiled_(latent, args.decode_tile, args.decode_tile, args.decode_overlap), args.runs)
+    set_three_pass(False)
+
+    print(f"    full {t_full:.3f}s, single pass {t_single:.3f}s, three pass {t_three:.3f}s ({t_three / t_single:.2f}x single pass)")
+    diff_report("single pass vs full", single, full)
+    diff_report("three pass vs full", three, full)
+    diff_report("single pass vs three pass", single, three)
+
+    streamed, t_streamed = timed(lambda: vae.decode_streaming_(latent, args.band_rows, args.band_overlap), args.runs)
+    full_uint8 = (255. * full).to(torch.uint8).movedim(1, -1)
+    print(f"    streaming {t_streamed:.3f}s with {args.band_rows} row bands, output buffer {streamed.nbytes / 2 ** 20:.1f} MB "
+          f"(float32 output would be {full.nelement() * 4 / 2 ** 20:.1f} MB)")
+    diff_report("streaming vs full (uint8 levels / 255)", torch.from_numpy(streamed).float() / 255., full_uint8.float() / 255.)
+
+    image = full
+    tile, tile_batch_size = vae.plan_tiles(image.shape, args.encode_tile, args.encode_overlap, vae.memory_used_encode)
+    print(f"encode {args.batch_size}x{args.width}x{args.height}, tile {tile}, {tile_batch_size} tiles per batch")
+
+    full, t_full = timed(lambda: vae.first_stage_model.encode(2.0 * image - 1.0), args.runs)
+    set_three_pass(False)
+    single, t_single = timed(lambda: vae.encode_tiled_(image, args.encode_tile, args.encode_tile, args.encode_overlap), args.runs)
+    set_three_pass(True)
+    three, t_three = timed(lambda: vae.encode_tiled_(image, args.encode_tile, args.encode_tile, args.encode_overlap), args.runs)
+    set_three_pass(False)
+
+    print(f"    full {t_full:.3f}s, single pass {t_single:.3f}s, three pass {t_three:.3f}s ({t_three / t_single:.2f}x single pass)")
+    scale = max(1e-6, full.abs().max().item())
+    diff_report("single pass vs full (relative to max |latent|)", single / scale, full / scale)
+    diff_report("three pass vs full (relative to max |latent|)", three / scale, full / scale)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark for /sdapi/v1/token-count against a running server.
+
+Sends batches of prompts and reports latency for:
+ - cold: prompts the server has not tokenized yet,
+ - warm: the same prompts again (served from the per-engine tokenization cache),
+ - busy: warm requests while a txt2img job holds the queue (token counting does not wait for it).
+
+Usage (from the backend directory, with the server started with --api and a model loaded):
+
+    python benchmarks/bench_token_count.py --url http://127.0.0.1:7861 --prompts 64 --repeat 20
+"""
+
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.request
+
+
+words = ['masterpiece', 'best quality', 'portrait', 'landscape', 'sunset', 'forest', 'city', 'night', 'neon', 'rain',
+         'detailed', 'cinematic lighting', 'watercolor', 'oil painting', 'mountains', 'river', 'castle', 'dragon']
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.loads(response.read())
+
+
+def make_prompts(count, seed):
+    rng = random.Random(seed)
+    prompts = []
+    for _ in range(count):
+        parts = [f'({w}:{rng.uniform(0.8, 1.4):.1f})' if rng.random() < 0.3 else w for w in rng.sample(words, rng.randint(4, 12))]
+        prompts.append(', '.join(parts) + f', seed {rng.randrange(10 ** 6)}')
+    return prompts
+
+
+def measure(url, prompts, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        post(url, dict(prompts=prompts))
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def describe(name, seconds):
+    print(f'{name:5}: median {statistics.median(seconds) * 1000:.1f} ms, max {max(seconds) * 1000:.1f} ms over {len(seconds)} requests')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:7861')
+    parser.add_argument('--prompts', type=int, default=64, help='prompts per request')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--steps', type=int, default=30, help='steps of the txt2img job used for the busy measurement')
+    args = parser.parse_args()
+
+    endpoint = args.url.rstrip('/') + '/sdapi/v1/token-count'
+
+    cold = []
+    for i in range(args.repeat):
+        cold += measure(endpoint, make_prompts(args.prompts, seed=time.time_ns() + i), 1)
+    describe('cold', cold)
+
+    prompts = make_prompts(args.prompts, seed=0)
+    response = post(endpoint, dict(prompts=prompts))
+    if not response['model_loaded']:
+        print('no model loaded, counts are estimates')
+    describe('warm', measure(endpoint, prompts, args.repeat))
+
+    job = threading.Thread(target=post, args=(args.url.rstrip('/') + '/sdapi/v1/txt2img', dict(prompt=prompts[0], steps=args.steps)))
+    job.start()
+    time.sleep(1.0)
+    describe('busy', measure(endpoint, prompts, args.repeat))
+    print(f'txt2img still running after the busy measurement: {job.is_alive()}')
+    job.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark for per-job tracing (backend.tracing).
+
+Reports the cost of an instrumented block with no trace active (tracing off) and with a trace active, and writes the
+Chrome trace of a simulated job (queue, model load, text encoding, sampling steps, VAE decode, saving) that can be
+opened in chrome://tracing or https://ui.perfetto.dev.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_tracing.py --iterations 1000000 --output trace.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from backend import tracing  # noqa: E402
+
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def empty():
+    return None
+
+
+def instrumented():
+    with tracing.span('step', step=0):
+        return None
+
+
+@tracing.traced('decorated')
+def decorated():
+    return None
+
+
+def simulated_job(steps):
+    queued = time.perf_counter()
+    time.sleep(0.01)
+    trace = tracing.begin('task(benchmark)', 'txt2img', queued=queued)
+
+    handle = tracing.open_span('model load')
+    time.sleep(0.02)
+    tracing.record('forge model load', 0.015)
+    tracing.close_span(handle)
+
+    with tracing.span('text encoding', batch=0):
+        time.sleep(0.005)
+
+    with tracing.span('sampling', batch=0, steps=steps):
+        for i in range(steps):
+            with tracing.span('step', step=i):
+                time.sleep(0.002)
+
+    with tracing.span('vae decode'):
+        time.sleep(0.01)
+
+    with tracing.span('save image'):
+        time.sleep(0.003)
+
+    tracing.end(trace)
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=1000000)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--output', default=None, help='where to write the Chrome trace of the simulated job')
+    args = parser.parse_args()
+
+    baseline = per_call(empty, args.iterations)
+    off = per_call(instrumented, args.iterations)
+    off_decorated = per_call(decorated, args.iterations)
+    print(f'tracing off: span {(off - baseline) * 1e9:.0f} ns, decorated call {(off_decorated - baseline) * 1e9:.0f} ns over a plain call')
+
+    trace = tracing.begin('task(overhead)', 'overhead')
+    on_iterations = min(args.iterations, 200000)
+    on = per_call(instrumented, on_iterations)
+    tracing.end(trace)
+    print(f'tracing on : span {(on - baseline) * 1e9:.0f} ns over a plain call')
+
+    trace = simulated_job(args.steps)
+    data = trace.to_dict()
+    print(f"simulated job: {len(data['spans'])} spans, {data['duration'] * 1000:.1f} ms")
+    for span in data['spans']:
+        if span['name'] != 'step':
+            print(f"  {span['name']:18} {span['duration'] * 1000:7.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(trace.to_chrome(), f)
+        print(f'Chrome trace written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -48,6 +48,7 @@ class LegacyPreprocessor(Preprocessor):
         self.show_control_mode = not legacy_dict['no_control_mode']
         self.sorting_priority = legacy_dict['priority']
         self.tags = legacy_dict['tags']
+        self.output_depends_on_seed = self.name == 'shuffle'
 
         filters_aliases = {
             'instructp2p': ['ip2p'],
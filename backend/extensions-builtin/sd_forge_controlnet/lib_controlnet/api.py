@@ -15,6 +15,7 @@ from .global_state import (
     select_control_type,
 )
 from .utils import judge_image_type
+from .preprocessor_cache import preprocessor_cache
 from .logging import logger
 
 
@@ -79,6 +80,15 @@ def controlnet_api(_: gr.Blocks, app: FastAPI):
             }
         }
 
+    @app.get("/controlnet/preprocessor_cache")
+    async def preprocessor_cache_stats():
+        return preprocessor_cache.stats()
+
+    @app.post("/controlnet/preprocessor_cache/clear")
+    async def preprocessor_cache_clear():
+        preprocessor_cache.clear()
+        return preprocessor_cache.stats()
+
     @app.post("/controlnet/detect")
     async def detect(
         controlnet_module: str = Body("none", title="Controlnet Module"),
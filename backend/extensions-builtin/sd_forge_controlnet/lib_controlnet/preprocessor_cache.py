@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from modules import shared, cache
+from lib_controlnet.utils import ndarray_content_hash
+from lib_controlnet.logging import logger
+
+
+class PreprocessorResultCache:
+    """
+    LRU cache of preprocessor outputs, bounded by the number of bytes held in RAM.
+
+    Entries are keyed by a content hash of the input image and mask plus everything
+    else that changes the output: preprocessor name, resolution and slider values.
+    When `control_net_preprocessor_cache_disk` is enabled, results are also written
+    through to the `controlnet-preprocessor` diskcache so they survive evictions and
+    restarts.
+    """
+
+    disk_subsection = "controlnet-preprocessor"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def max_bytes() -> int:
+        return int(shared.opts.data.get("control_net_preprocessor_cache_size", 512)) * 1024 * 1024
+
+    @staticmethod
+    def use_disk() -> bool:
+        return bool(shared.opts.data.get("control_net_preprocessor_cache_disk", False))
+
+    @staticmethod
+    def make_key(
+        module: str,
+        input_image: np.ndarray,
+        input_mask: Optional[np.ndarray],
+        resolution,
+        slider_1,
+        slider_2,
+        seed: Optional[int] = None,
+    ) -> str:
+        parts = [
+            module,
+            ndarray_content_hash(input_image),
+            ndarray_content_hash(input_mask) if input_mask is not None else "-",
+            repr(resolution),
+            repr(slider_1),
+            repr(slider_2),
+            repr(seed),
+        ]
+        return "|".join(parts)
+
+    def enabled(self) -> bool:
+        return self.max_bytes() > 0 or self.use_disk()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value.copy()
+
+        if self.use_disk():
+            value = cache.cache(self.disk_subsection).get(key)
+            if isinstance(value, np.ndarray):
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, value)
+                return value.copy()
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value) -> None:
+        if not isinstance(value, np.ndarray):
+            return
+
+        value = value.copy()
+        self._put_memory(key, value)
+
+        if self.use_disk():
+            cache.cache(self.disk_subsection)[key] = value
+
+    def _put_memory(self, key: str, value: np.ndarray) -> None:
+        max_bytes = self.max_bytes()
+        if value.nbytes > max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.nbytes
+
+            self.entries[key] = value
+            self.total_bytes += value.nbytes
+
+            while self.total_bytes > max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+        if self.use_disk():
+            cache.cache(self.disk_subsection).clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes(),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def log_stats(self) -> None:
+        stats = self.stats()
+        logger.info(
+            f"Preprocessor cache: {stats['hits']} hits, {stats['disk_hits']} disk hits, "
+            f"{stats['misses']} misses, {stats['entries']} entries, "
+            f"{stats['bytes'] / (1024 * 1024):.1f} MB"
+        )
+
+
+preprocessor_cache = PreprocessorResultCache()
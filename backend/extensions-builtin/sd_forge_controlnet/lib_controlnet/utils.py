@@ -11,6 +11,7 @@ from lib_controlnet.lvminthin import lvmin_thin, nake_nms
 import torch
 import os
 import functools
+import hashlib
 import time
 import base64
 import numpy as np
@@ -37,6 +38,20 @@ def get_state_dict(d):
     return d.get("state_dict", d)
 
 
+def ndarray_content_hash(array: np.ndarray) -> str:
+    """
+    Fast content hash of a numpy array, including its shape and dtype.
+
+    Hashes the array buffer in place instead of going through `tobytes()`,
+    so no copy of the data is made for contiguous arrays.
+    """
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{array.dtype.str}{array.shape}".encode())
+    h.update(memoryview(array).cast("B"))
+    return h.hexdigest()
+
+
 def ndarray_lru_cache(max_size: int = 128, typed: bool = False):
     """
     Decorator to enable caching for functions with numpy array arguments.
@@ -64,8 +79,8 @@ def ndarray_lru_cache(max_size: int = 128, typed: bool = False):
                 return np.array_equal(self, other)
 
             def __hash__(self):
-                # Hash the bytes representing the data of the array.
-                return hash(self.tobytes())
+                # Hash the content of the array without copying it.
+                return hash(ndarray_content_hash(self))
 
         @functools.lru_cache(maxsize=max_size, typed=typed)
         def cached_func(*args, **kwargs):
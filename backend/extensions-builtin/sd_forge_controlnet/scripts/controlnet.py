@@ -23,12 +23,13 @@ from lib_controlnet.infotext import Infotext
 from modules_forge.utils import HWC3, numpy_to_pytorch
 from lib_controlnet.enums import HiResFixOption
 from lib_controlnet.api import controlnet_api
+from lib_controlnet.preprocessor_cache import preprocessor_cache
 
 import numpy as np
-import functools
 
 from PIL import Image
 from modules_forge.shared import try_load_supported_control_model
+from modules_forge.model_cache import aux_model_cache
 from modules_forge.supported_controlnet import ControlModelPatcher
 
 # Gradio 3.32 bug fix
@@ -40,9 +41,8 @@ os.makedirs(gradio_tempfile_path, exist_ok=True)
 global_state.update_controlnet_filenames()
 
 
-@functools.lru_cache(maxsize=shared.opts.data.get("control_net_model_cache_size", 5))
 def cached_controlnet_loader(filename):
-    return try_load_supported_control_model(filename)
+    return aux_model_cache.get_or_load(('controlnet', filename), lambda: try_load_supported_control_model(filename))
 
 
 class ControlNetCachedParameters:
@@ -306,6 +306,7 @@ class ControlNetForForgeOfficial(scripts.Script):
         control_masks = []
         preprocessor_output_is_image = False
         preprocessor_output = None
+        cache_key = None
 
         def optional_tqdm(iterable, use_tqdm):
             from tqdm import tqdm
@@ -325,13 +326,33 @@ class ControlNetForForgeOfficial(scripts.Script):
             logger.info(f"Using preprocessor: {unit.module}")
             logger.info(f'preprocessor resolution = {unit.processor_res}')
 
-            preprocessor_output = preprocessor(
-                input_image=input_image,
-                input_mask=input_mask,
-                resolution=unit.processor_res,
-                slider_1=unit.threshold_a,
-                slider_2=unit.threshold_b,
-            )
+            preprocessor_output = None
+            cache_key = None
+            if unit.module != 'None' and preprocessor_cache.enabled():
+                cache_key = preprocessor_cache.make_key(
+                    unit.module,
+                    input_image,
+                    input_mask,
+                    resolution=unit.processor_res,
+                    slider_1=unit.threshold_a,
+                    slider_2=unit.threshold_b,
+                    seed=seed if preprocessor.output_depends_on_seed else None,
+                )
+                preprocessor_output = preprocessor_cache.get(cache_key)
+                if preprocessor_output is not None:
+                    logger.info(f"Reusing cached preprocessor result for {unit.module}")
+
+            if preprocessor_output is None:
+                preprocessor_output = preprocessor(
+                    input_image=input_image,
+                    input_mask=input_mask,
+                    resolution=unit.processor_res,
+                    slider_1=unit.threshold_a,
+                    slider_2=unit.threshold_b,
+                )
+
+                if cache_key is not None:
+                    preprocessor_cache.put(cache_key, preprocessor_output)
 
             preprocessor_outputs.append(preprocessor_output)
 
@@ -344,6 +365,9 @@ class ControlNetForForgeOfficial(scripts.Script):
                 logger.info('Batch wise input only support controlnet, control-lora, and t2i adapters!')
                 break
 
+        if cache_key is not None:
+            preprocessor_cache.log_stats()
+
         if has_high_res_fix:
             hr_option = HiResFixOption.from_value(unit.hr_option)
         else:
@@ -561,6 +585,9 @@ class ControlNetForForgeOfficial(scripts.Script):
             self.process_unit_before_every_sampling(p, unit, self.current_params[i], *args, **kwargs)
         return
 
+    def needs_postprocess_batch(self, p, *args):
+        return len(self.get_enabled_units(args)) > 0
+
     @torch.no_grad()
     def postprocess_batch_list(self, p, pp, *args, **kwargs):
         for i, unit in enumerate(self.get_enabled_units(args)):
@@ -585,8 +612,12 @@ def on_ui_settings():
     shared.opts.add_option("control_net_unit_count", shared.OptionInfo(
         3, "Multi-ControlNet: ControlNet unit number (requires restart)", gr.Slider,
         {"minimum": 1, "maximum": 10, "step": 1}, section=section))
-    shared.opts.add_option("control_net_model_cache_size", shared.OptionInfo(
-        5, "Model cache size (requires restart)", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}, section=section))
+    shared.opts.add_option("control_net_preprocessor_cache_size", shared.OptionInfo(
+        512, "Preprocessor result cache size in MB (0 = disable in-memory cache)", gr.Slider,
+        {"minimum": 0, "maximum": 8192, "step": 64}, section=section))
+    shared.opts.add_option("control_net_preprocessor_cache_disk", shared.OptionInfo(
+        False, "Also keep preprocessor results in the on-disk cache", gr.Checkbox, {"interactive": True},
+        section=section))
     shared.opts.add_option("control_net_no_detectmap", shared.OptionInfo(
         False, "Do not append detectmap to output", gr.Checkbox, {"interactive": True}, section=section))
     shared.opts.add_option("control_net_detectmap_autosaving", shared.OptionInfo(
@@ -6,6 +6,7 @@ import torch
 import network
 import functools
 
+from backend import metrics
 from backend.args import dynamic_args
 from modules import shared, sd_models, errors, scripts
 from backend.utils import load_torch_file
@@ -58,6 +59,9 @@ def load_lora_state_dict(filename):
     return load_torch_file(filename, safe_load=True)
 
 
+metrics.cache_info_source('lora_file', load_lora_state_dict.cache_info)
+
+
 def load_network(name, network_on_disk):
     net = network.Network(name, network_on_disk)
     net.mtime = os.path.getmtime(network_on_disk.filename)
@@ -3,7 +3,6 @@ import io
 import os
 import time
 import datetime
-import uvicorn
 import ipaddress
 import json
 import requests
@@ -15,7 +14,7 @@ from io import BytesIO
 from fastapi import APIRouter, Body, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 import hashlib
@@ -24,8 +23,8 @@ from uuid import uuid4
 from modules import model_downloader
 
 import modules.shared as shared
-from modules import paths, sd_samplers, deepbooru, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import result_store, history_index, paths, sd_samplers, deepbooru, images, scripts, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, extra_networks, prompt_parser
+from modules.api import models, startup
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images, process_extra_images
 import modules.textual_inversion.textual_inversion
@@ -34,6 +33,7 @@ from modules.shared import cmd_opts
 from PIL import PngImagePlugin
 from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
+from backend import metrics, tracing
 from typing import Any, Union, get_origin, get_args
 import piexif
 import piexif.helper
@@ -84,6 +84,12 @@ def verify_url(url):
 
 
 def decode_base64_to_image(encoding):
+    if result_store.is_reference(encoding):
+        image = result_store.result_store.load_image(encoding)
+        if image is None:
+            raise HTTPException(status_code=404, detail="Result not found")
+        return image
+
     if encoding.startswith("http://") or encoding.startswith("https://"):
         if not opts.api_enable_requests:
             raise HTTPException(status_code=500, detail="Requests not allowed")
@@ -108,10 +114,8 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
-def encode_pil_to_base64(image):
+def encode_pil_to_bytes(image):
     with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
         if opts.samples_format.lower() == 'png':
             use_metadata = False
             metadata = PngImagePlugin.PngInfo()
@@ -136,9 +140,35 @@ def encode_pil_to_base64(image):
         else:
             raise HTTPException(status_code=500, detail="Invalid image format")
 
-        bytes_data = output_bytes.getvalue()
+        return output_bytes.getvalue()
+
+
+def encode_pil_to_base64(image):
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode(encode_pil_to_bytes(image))
+
+
+def encode_results(images, send_images, job):
+    """Encodes each image once; returns base64 images (if send_images) and their result store IDs (if enabled)."""
+
+    b64images = []
+    result_ids = [] if opts.api_result_store else None
 
-    return base64.b64encode(bytes_data)
+    for image in images:
+        if isinstance(image, str):
+            data = None
+        else:
+            data = encode_pil_to_bytes(image)
+
+        if send_images:
+            b64images.append(image if data is None else base64.b64encode(data))
+
+        if result_ids is not None:
+            result_ids.append(None if data is None else result_store.result_store.put(image, data, opts.samples_format, job=job))
+
+    return b64images, result_ids
 
 
 def api_middleware(app: FastAPI):
@@ -205,6 +235,26 @@ def api_middleware(app: FastAPI):
         return handle_exception(request, e)
 
 
+def api_metrics_middleware(app: FastAPI):
+    """Observes forge_api_request_duration_seconds for /sdapi routes, labelled by handler name and method."""
+
+    from starlette.middleware import Middleware
+    from starlette.middleware.base import BaseHTTPMiddleware
+
+    async def observe_duration(req: Request, call_next):
+        ts = time.perf_counter()
+        res: Response = await call_next(req)
+        handler = req.scope.get('endpoint')
+        if handler is not None and req.scope.get('path', '').startswith('/sdapi'):
+            metrics.api_request_seconds.observe(time.perf_counter() - ts, handler=handler.__name__, method=req.method)
+        return res
+
+    # the app may already be serving (gradio launch, --api-fast-startup), where add_middleware is refused;
+    # insert it the way initialize_util.setup_middleware does and rebuild the stack
+    app.user_middleware.insert(0, Middleware(BaseHTTPMiddleware, dispatch=observe_duration))
+    app.middleware_stack = app.build_middleware_stack()
+
+
 class Api:
     def __init__(self, app: FastAPI, queue_lock: Lock):
         if shared.cmd_opts.api_auth:
@@ -216,11 +266,19 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.progress_image = (None, None, None)
         #api_middleware(self.app)  # FIXME: (legacy) this will have to be fixed
+        api_metrics_middleware(self.app)
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
         self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
+        self.add_api_route("/sdapi/v1/results/{result_id}", self.get_result_image, methods=["GET"])
+        self.add_api_route("/sdapi/v1/results/{result_id}/thumbnail", self.get_result_thumbnail, methods=["GET"])
+        self.add_api_route("/sdapi/v1/results/{result_id}/info", self.get_result_info, methods=["GET"], response_model=models.ResultInfoResponse)
+        self.add_api_route("/sdapi/v1/history", self.get_history, methods=["GET"], response_model=models.HistoryResponse)
+        self.add_api_route("/sdapi/v1/history/backfill", self.get_history_backfill, methods=["GET"], response_model=models.HistoryBackfillResponse)
+        self.add_api_route("/sdapi/v1/history/backfill", self.start_history_backfill, methods=["POST"], response_model=models.HistoryBackfillResponse)
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
         self.add_api_route("/sdapi/v1/progress", self.progressapi, methods=["GET"], response_model=models.ProgressResponse)
         self.add_api_route("/sdapi/v1/interrogate", self.interrogateapi, methods=["POST"])
@@ -241,11 +299,17 @@ class Api:
         self.add_api_route("/sdapi/v1/prompt-styles", self.get_prompt_styles, methods=["GET"], response_model=list[models.PromptStyleItem])
         self.add_api_route("/sdapi/v1/embeddings", self.get_embeddings, methods=["GET"], response_model=models.EmbeddingsResponse)
         self.add_api_route("/sdapi/v1/refresh-embeddings", self.refresh_embeddings, methods=["POST"])
+        self.add_api_route("/sdapi/v1/token-count", self.token_count, methods=["POST"], response_model=models.TokenCountResponse)
         self.add_api_route("/sdapi/v1/refresh-checkpoints", self.refresh_checkpoints, methods=["POST"])
         self.add_api_route("/sdapi/v1/refresh-vae", self.refresh_vae, methods=["POST"])
         self.add_api_route("/sdapi/v1/create/embedding", self.create_embedding, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/create/hypernetwork", self.create_hypernetwork, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/sdapi/v1/resolution-buckets", self.get_resolution_buckets, methods=["GET"], response_model=models.ResolutionBucketsResponse)
+        self.add_api_route("/metrics", self.get_metrics, methods=["GET"], response_class=PlainTextResponse)
+        self.add_api_route("/sdapi/v1/traces", self.get_traces, methods=["GET"], response_model=list[models.TraceSummary])
+        self.add_api_route("/sdapi/v1/traces/{trace_id}", self.get_trace, methods=["GET"])
+        self.add_api_route("/sdapi/v1/traces/{trace_id}/chrome", self.get_trace_chrome, methods=["GET"])
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
@@ -269,7 +333,15 @@ class Api:
         img2img_script_runner = scripts.scripts_img2img
 
         if not txt2img_script_runner.scripts or not img2img_script_runner.scripts:
-            ui.create_ui()
+            if shared.cmd_opts.api_fast_startup:
+                # lay out script arguments without building the Gradio UI
+                txt2img_script_runner.initialize_scripts(False)
+                txt2img_script_runner.setup_ui_headless()
+                img2img_script_runner.initialize_scripts(True)
+                img2img_script_runner.setup_ui_headless()
+            else:
+                from modules import ui
+                ui.create_ui()
 
         if not txt2img_script_runner.scripts:
             txt2img_script_runner.initialize_scripts(False)
@@ -506,8 +578,11 @@ class Api:
         args.pop('save_images', None)
 
         add_task_to_queue(task_id)
+        queued = time.perf_counter()
 
         with self.queue_lock:
+            metrics.queue_wait_seconds.observe(time.perf_counter() - queued, source='api')
+            trace = tracing.begin(task_id, "txt2img", synchronize=opts.forge_tracing_sync, queued=queued) if opts.forge_tracing else None
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
                 p.scripts = script_runner
@@ -525,13 +600,20 @@ class Api:
                         processed = process_images(p)
                     process_extra_images(processed)
                     finish_task(task_id)
+                except Exception:
+                    tracing.end(trace)
+                    raise
                 finally:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images + processed.extra_images)) if send_images else []
+        try:
+            with tracing.span_of(trace, 'encode results'):
+                b64images, result_ids = encode_results(processed.images + processed.extra_images, send_images, "txt2img")
+        finally:
+            tracing.end(trace)
 
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+        return models.TextToImageResponse(images=b64images, image_ids=result_ids, parameters=vars(txt2imgreq), info=processed.js())
 
     def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
@@ -577,8 +659,11 @@ class Api:
         args.pop('save_images', None)
 
         add_task_to_queue(task_id)
+        queued = time.perf_counter()
 
         with self.queue_lock:
+            metrics.queue_wait_seconds.observe(time.perf_counter() - queued, source='api')
+            trace = tracing.begin(task_id, "img2img", synchronize=opts.forge_tracing_sync, queued=queued) if opts.forge_tracing else None
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
                 p.init_images = [decode_base64_to_image(x) for x in init_images]
                 p.is_api = True
@@ -597,17 +682,24 @@ class Api:
                         processed = process_images(p)
                     process_extra_images(processed)
                     finish_task(task_id)
+                except Exception:
+                    tracing.end(trace)
+                    raise
                 finally:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images + processed.extra_images)) if send_images else []
+        try:
+            with tracing.span_of(trace, 'encode results'):
+                b64images, result_ids = encode_results(processed.images + processed.extra_images, send_images, "img2img")
+        finally:
+            tracing.end(trace)
 
         if not img2imgreq.include_init_images:
             img2imgreq.init_images = None
             img2imgreq.mask = None
 
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+        return models.ImageToImageResponse(images=b64images, image_ids=result_ids, parameters=vars(img2imgreq), info=processed.js())
 
     def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
         reqDict = setUpscalers(req)
@@ -630,6 +722,54 @@ class Api:
 
         return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
 
+    @staticmethod
+    def result_file_response(request: Request, result_id, path, media_type):
+        if path is None:
+            raise HTTPException(status_code=404, detail="Result not found")
+
+        # a result ID names its content, so the files never change and clients may cache them forever
+        headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{result_id}"'}
+        if request.headers.get("if-none-match", "").strip('W/ "') == result_id:
+            return Response(status_code=304, headers=headers)
+
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    def get_result_image(self, result_id: str, request: Request):
+        path, metadata = result_store.result_store.image_path(result_id)
+        media_type = result_store.media_types.get(metadata["format"]) if metadata is not None else None
+        return self.result_file_response(request, result_store.normalize_id(result_id), path, media_type)
+
+    def get_result_thumbnail(self, result_id: str, request: Request):
+        path = result_store.result_store.thumbnail_path(result_id)
+        return self.result_file_response(request, f"{result_store.normalize_id(result_id)}.thumb", path, "image/webp")
+
+    def get_result_info(self, result_id: str):
+        metadata = result_store.result_store.metadata(result_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="Result not found")
+
+        return models.ResultInfoResponse(**metadata)
+
+    def get_history(self, req: models.HistoryRequest = Depends()):
+        total, rows = history_index.history_index.search(
+            query=req.q,
+            model_hash=req.model_hash,
+            sampler=req.sampler,
+            width=req.width,
+            height=req.height,
+            seed=req.seed,
+            page=req.page,
+            page_size=req.page_size,
+        )
+
+        return models.HistoryResponse(total=total, page=req.page, page_size=req.page_size, items=[models.HistoryItem(**row) for row in rows])
+
+    def get_history_backfill(self):
+        return models.HistoryBackfillResponse(**history_index.history_index.backfill_status)
+
+    def start_history_backfill(self):
+        return models.HistoryBackfillResponse(**history_index.history_index.start_backfill())
+
     def pnginfoapi(self, req: models.PNGInfoRequest):
         image = decode_base64_to_image(req.image.strip())
         if image is None:
@@ -664,14 +804,29 @@ class Api:
 
         progress = min(progress, 1)
 
-        shared.state.set_current_image()
-
         current_image = None
-        if shared.state.current_image and not req.skip_current_image:
-            current_image = encode_pil_to_base64(shared.state.current_image)
+        if not req.skip_current_image:
+            current_image = self.encode_progress_image()
 
         return models.ProgressResponse(progress=progress, eta_relative=eta_relative, state=shared.state.dict(), current_image=current_image, textinfo=shared.state.textinfo, current_task=current_task)
 
+    def encode_progress_image(self):
+        """The current live preview encoded with samples_format, as /sdapi/v1/progress has always returned it; encoded once
+        per published preview rather than on every poll."""
+
+        _, image = shared.state.get_current_image()
+        if image is None:
+            return None
+
+        # every published preview is a new image object; the cache holds a reference to it, so identity is reliable
+        cached_image, cached_format, encoded = self.progress_image
+        if cached_image is image and cached_format == opts.samples_format:
+            return encoded
+
+        encoded = encode_pil_to_base64(image)
+        self.progress_image = (image, opts.samples_format, encoded)
+        return encoded
+
     def interrogateapi(self, interrogatereq: models.InterrogateRequest):
         image_b64 = interrogatereq.image
         if image_b64 is None:
@@ -801,6 +956,35 @@ class Api:
         with self.queue_lock:
             self.embedding_db.load_textual_inversion_embeddings(force_reload=True, sync_with_sd_model=False)
 
+    def token_count(self, req: models.TokenCountRequest):
+        # only the loaded model's tokenizers and embedding index are used, so this does not wait for queue_lock
+        sd_model = sd_models.model_data.sd_model
+        get_prompt_lengths_on_ui = getattr(sd_model, 'get_prompt_lengths_on_ui', None)
+        if get_prompt_lengths_on_ui is None:
+            # no model while a checkpoint is being reloaded; fall back to the word estimate used before the first load
+            sd_model = sd_models.FakeInitialModel()
+            get_prompt_lengths_on_ui = sd_model.get_prompt_lengths_on_ui
+
+        counts = []
+        for text in req.prompts:
+            try:
+                text, _ = extra_networks.parse_prompt(text)
+
+                if req.negative:
+                    prompt_flat_list = [text]
+                else:
+                    _, prompt_flat_list, _ = prompt_parser.get_multicond_prompt_list([text])
+
+                prompt_schedules = prompt_parser.get_learned_conditioning_prompt_schedules(prompt_flat_list, req.steps)
+            except Exception:
+                prompt_schedules = [[[req.steps, text]]]
+
+            prompts = [prompt_text for schedule in prompt_schedules for _, prompt_text in schedule]
+            token_count, max_length = max([get_prompt_lengths_on_ui(prompt) for prompt in prompts], key=lambda x: x[0])
+            counts.append(models.TokenCountItem(token_count=token_count, max_length=max_length))
+
+        return models.TokenCountResponse(model_loaded=not isinstance(sd_model, sd_models.FakeInitialModel), counts=counts)
+
     def refresh_checkpoints(self):
         with self.queue_lock:
             shared.refresh_checkpoints()
@@ -830,6 +1014,28 @@ class Api:
         finally:
             shared.state.end()
 
+    def get_resolution_buckets(self):
+        from modules_forge.resolution_buckets import bucket_stats
+        return models.ResolutionBucketsResponse(**bucket_stats.report())
+
+    def get_metrics(self):
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def get_traces(self):
+        return [models.TraceSummary(**x) for x in tracing.list_traces()]
+
+    def find_trace(self, trace_id):
+        trace = tracing.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail=f"Trace not found: {trace_id}")
+        return trace
+
+    def get_trace(self, trace_id: str):
+        return self.find_trace(trace_id).to_dict()
+
+    def get_trace_chrome(self, trace_id: str):
+        return JSONResponse(self.find_trace(trace_id).to_chrome(), headers={"Content-Disposition": f'attachment; filename="trace-{trace_id}.json"'})
+
     def get_memory(self):
         try:
             import os
@@ -896,15 +1102,7 @@ class Api:
 
     def launch(self, server_name, port, root_path):
         self.app.include_router(self.router)
-        uvicorn.run(
-            self.app,
-            host=server_name,
-            port=port,
-            timeout_keep_alive=shared.cmd_opts.timeout_keep_alive,
-            root_path=root_path,
-            ssl_keyfile=shared.cmd_opts.tls_keyfile,
-            ssl_certfile=shared.cmd_opts.tls_certfile
-        )
+        startup.serve(self.app, server_name, port, root_path)
 
     def kill_webui(self):
         restart.stop_program()
@@ -131,14 +131,26 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
 
 class TextToImageResponse(BaseModel):
     images: list[str] | None = Field(default=None, title="Image", description="The generated image in base64 format.")
+    image_ids: list[str | None] | None = Field(default=None, title="Image IDs", description="Result store IDs of the generated images, in the same order; usable as init_images/mask and with /sdapi/v1/results/{id}.")
     parameters: dict
     info: str
 
 class ImageToImageResponse(BaseModel):
     images: list[str] | None = Field(default=None, title="Image", description="The generated image in base64 format.")
+    image_ids: list[str | None] | None = Field(default=None, title="Image IDs", description="Result store IDs of the generated images, in the same order; usable as init_images/mask and with /sdapi/v1/results/{id}.")
     parameters: dict
     info: str
 
+class ResultInfoResponse(BaseModel):
+    id: str = Field(title="ID", description="Hex sha256 of the stored image file")
+    format: str = Field(title="Format", description="File format of the stored image")
+    width: int = Field(title="Width")
+    height: int = Field(title="Height")
+    size: int = Field(title="Size", description="Size of the stored image file in bytes")
+    created: float = Field(title="Created", description="Unix time the result was stored")
+    job: str | None = Field(default=None, title="Job", description="txt2img or img2img")
+    infotext: str | None = Field(default=None, title="Infotext", description="Generation parameters of the image")
+
 class ExtrasBaseRequest(BaseModel):
     resize_mode: Literal[0, 1] = Field(default=0, title="Resize Mode", description="Sets the resize mode: 0 to upscale by upscaling_resize amount, 1 to upscale up to upscaling_resize_h x upscaling_resize_w.")
     show_extras_results: bool = Field(default=True, title="Show results", description="Should the backend return the generated image?")
@@ -181,6 +193,45 @@ class PNGInfoResponse(BaseModel):
     items: dict = Field(title="Items", description="A dictionary containing all the other fields the image had")
     parameters: dict = Field(title="Parameters", description="A dictionary with parsed generation info fields")
 
+class HistoryRequest(BaseModel):
+    q: str | None = Field(default=None, title="Query", description="Words that must all appear in the prompt, negative prompt or LoRA names")
+    model_hash: str | None = Field(default=None, title="Model hash")
+    sampler: str | None = Field(default=None, title="Sampler")
+    width: int | None = Field(default=None, title="Width")
+    height: int | None = Field(default=None, title="Height")
+    seed: int | None = Field(default=None, title="Seed")
+    page: int = Field(default=1, ge=1, title="Page", description="1-based page number")
+    page_size: int = Field(default=50, ge=1, le=500, title="Page size")
+
+class HistoryItem(BaseModel):
+    id: int = Field(title="ID")
+    path: str = Field(title="Path", description="Full path of the saved image")
+    mtime: float = Field(title="Modification time", description="Unix time the file was last written")
+    width: int | None = Field(default=None, title="Width")
+    height: int | None = Field(default=None, title="Height")
+    prompt: str | None = Field(default=None, title="Prompt")
+    negative_prompt: str | None = Field(default=None, title="Negative prompt")
+    seed: int | None = Field(default=None, title="Seed")
+    sampler: str | None = Field(default=None, title="Sampler")
+    scheduler: str | None = Field(default=None, title="Schedule type")
+    steps: int | None = Field(default=None, title="Steps")
+    cfg_scale: float | None = Field(default=None, title="CFG scale")
+    model: str | None = Field(default=None, title="Model")
+    model_hash: str | None = Field(default=None, title="Model hash")
+    loras: str | None = Field(default=None, title="LoRAs", description="Space-separated names of LoRAs used in the prompt")
+    infotext: str | None = Field(default=None, title="Infotext")
+
+class HistoryResponse(BaseModel):
+    total: int = Field(title="Total", description="Number of images matching the filters")
+    page: int = Field(title="Page")
+    page_size: int = Field(title="Page size")
+    items: list[HistoryItem] = Field(title="Items", description="Matching images, newest first")
+
+class HistoryBackfillResponse(BaseModel):
+    running: bool = Field(title="Running")
+    scanned: int = Field(title="Scanned", description="Image files found in the output directories")
+    indexed: int = Field(title="Indexed", description="Images added or updated in the history index")
+
 class ProgressRequest(BaseModel):
     skip_current_image: bool = Field(default=False, title="Skip current image", description="Skip current image serialization")
 
@@ -301,6 +352,34 @@ class EmbeddingsResponse(BaseModel):
     loaded: dict[str, EmbeddingItem] = Field(title="Loaded", description="Embeddings loaded for the current model")
     skipped: dict[str, EmbeddingItem] = Field(title="Skipped", description="Embeddings skipped for the current model (likely due to architecture incompatibility)")
 
+class TokenCountRequest(BaseModel):
+    prompts: list[str] = Field(title="Prompts", description="Prompts to count tokens for")
+    steps: int = Field(default=20, title="Steps", description="Sampling steps, used to resolve prompt editing [from:to:when]")
+    negative: bool = Field(default=False, title="Negative", description="The prompts are negative prompts; AND is not treated as composable diffusion")
+
+class TokenCountItem(BaseModel):
+    token_count: int = Field(title="Token count", description="Tokens in the longest prompt variant, as shown by the UI token counter")
+    max_length: int = Field(title="Max length", description="Token count rounded up to whole chunks")
+
+class TokenCountResponse(BaseModel):
+    model_loaded: bool = Field(title="Model loaded", description="False if no model is loaded; counts are then a rough word-based estimate")
+    counts: list[TokenCountItem] = Field(title="Counts", description="One entry per prompt, in request order")
+
+class ResolutionBucketsResponse(BaseModel):
+    hits: int = Field(title="Hits", description="Images generated at a bucket resolution since startup")
+    misses: int = Field(title="Misses", description="Images generated with bucketing enabled that no bucket contained")
+    hit_rate: float = Field(title="Hit rate", description="hits / (hits + misses)")
+    padding_overhead: float = Field(title="Padding overhead", description="Extra generated area of bucketed images relative to the requested area")
+    buckets: dict[str, int] = Field(title="Buckets", description="Images per bucket, most used first")
+
+class TraceSummary(BaseModel):
+    id: str = Field(title="ID", description="Task ID of the job")
+    name: str = Field(title="Name", description="Kind of job")
+    start: float = Field(title="Start", description="Unix time at which the job was queued")
+    duration: float = Field(title="Duration", description="Seconds from queueing to the end of the job, so far if it is still running")
+    spans: int = Field(title="Spans", description="Number of recorded spans")
+    attrs: dict = Field(title="Attributes", description="Job attributes")
+
 class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
@@ -334,3 +413,20 @@ class ExtensionItem(BaseModel):
     version: str = Field(title="Version", description="Extension Version")
     commit_date: int = Field(title="Commit Date", description="Extension Repository Commit Date")
     enabled: bool = Field(title="Enabled", description="Flag specifying whether this extension is enabled")
+
+class StartupHealthResponse(BaseModel):
+    status: str = Field(title="Status", description="Always \"ok\" while the server is answering requests")
+    phase: str = Field(title="Phase", description="Startup phase, one of starting, loading, warm, ready; see /sdapi/v1/ready")
+    uptime: float = Field(title="Uptime", description="Seconds since the server process started")
+
+class StartupTimingsResponse(BaseModel):
+    phase: str = Field(title="Phase", description="Startup phase, same as in /sdapi/v1/health")
+    total: float = Field(title="Total", description="Wall time of recorded startup stages, in seconds")
+    records: dict[str, float] = Field(title="Records", description="Time spent in each startup stage, in seconds; stages that ran in parallel overlap")
+
+class ReadyResponse(BaseModel):
+    phase: str = Field(title="Phase", description="starting: API routes are not available yet; loading: the checkpoint is being loaded; warm: warm-up generation is running; ready: requests are served at full speed")
+    ready: bool = Field(title="Ready", description="True once phase is \"ready\"")
+    checkpoint: Optional[str] = Field(default=None, title="Checkpoint", description="Title of the loaded checkpoint, if any")
+    phase_times: dict[str, float] = Field(title="Phase Times", description="Seconds since startup at which each phase was entered")
+    error: Optional[str] = Field(default=None, title="Error", description="Error raised while loading the checkpoint or warming up; the API stays usable")
@@ -0,0 +1,155 @@
+"""Startup state of the API-only server (--nowebui).
+
+With --api-fast-startup the server starts listening as soon as the FastAPI app and its middleware exist, before
+models, scripts and extensions are discovered. Until modules.api.api.Api has added its routes, only the health,
+readiness and startup timing endpoints below answer.
+
+After the API is mounted, the selected checkpoint is loaded and a one-step generation is run in the background
+(unless --skip-load-model-at-start is used), so that the first real request does not pay for model loading, kernel
+selection and allocator growth. Phases reported by /sdapi/v1/ready:
+
+ - starting: discovering models, scripts and extensions; most API routes are not available yet
+ - loading: API is available, the checkpoint is being loaded
+ - warm: the checkpoint is loaded, warm-up generation is running
+ - ready: requests are served at full speed
+"""
+
+import threading
+import time
+
+import uvicorn
+
+from modules import timer
+from modules.shared_cmd_options import cmd_opts
+
+process_start_time = time.time()
+
+phase = "starting"
+phase_times = {"starting": 0.0}
+warm_up_error = None
+
+
+def set_phase(name):
+    global phase
+
+    phase = name
+    phase_times[name] = time.time() - process_start_time
+
+
+def health():
+    from modules.api import models
+
+    return models.StartupHealthResponse(status="ok", phase=phase, uptime=time.time() - process_start_time)
+
+
+def startup_timings():
+    from modules.api import models
+
+    record = timer.startup_record or timer.startup_timer.dump()
+    return models.StartupTimingsResponse(phase=phase, total=record["total"], records=record["records"])
+
+
+def ready():
+    from modules import sd_models
+    from modules.api import models
+
+    sd_model = sd_models.model_data.sd_model
+    checkpoint_info = getattr(sd_model, "sd_checkpoint_info", None)
+
+    return models.ReadyResponse(
+        phase=phase,
+        ready=phase == "ready",
+        checkpoint=checkpoint_info.title if checkpoint_info is not None else None,
+        phase_times=phase_times,
+        error=warm_up_error,
+    )
+
+
+def setup_startup_api(app):
+    app.add_api_route("/sdapi/v1/health", health, methods=["GET"])
+    app.add_api_route("/sdapi/v1/ready", ready, methods=["GET"])
+    app.add_api_route("/sdapi/v1/startup-timings", startup_timings, methods=["GET"])
+
+
+def warm_up(queue_lock):
+    """
+    Loads the selected checkpoint and runs a one-step txt2img with both conditionings, so that the text encoder, the
+    sampler and the VAE decoder have all run once. Holds queue_lock, so generation requests wait for it to finish.
+    """
+
+    global warm_up_error
+
+    from contextlib import closing
+    from modules import processing, sd_models, shared, errors
+    from modules_forge import main_entry
+
+    warm_up_timer = timer.Timer()
+
+    try:
+        with queue_lock:
+            set_phase("loading")
+
+            if not sd_models.model_data.forge_loading_parameters:
+                main_entry.refresh_model_loading_parameters()
+
+            sd_models.forge_model_reload()
+            warm_up_timer.record("load checkpoint")
+
+            if shared.opts.api_warm_up_generation:
+                set_phase("warm")
+
+                p = processing.StableDiffusionProcessingTxt2Img(
+                    sd_model=shared.sd_model,
+                    prompt="",
+                    negative_prompt="",
+                    width=64,
+                    height=64,
+                    steps=1,
+                    sampler_name="Euler",
+                    do_not_save_samples=True,
+                    do_not_save_grid=True,
+                )
+
+                with closing(p):
+                    try:
+                        shared.state.begin(job="warm-up")
+                        processing.process_images(p)
+                    finally:
+                        shared.state.end()
+
+                warm_up_timer.record("warm-up generation")
+    except Exception as e:
+        warm_up_error = f"{type(e).__name__}: {e}"
+        errors.report("Error during API warm-up", exc_info=True)
+
+    set_phase("ready")
+    print(f"API warm-up done in {warm_up_timer.summary()}.")
+
+
+def start_warm_up(queue_lock):
+    if cmd_opts.skip_load_model_at_start:
+        set_phase("ready")
+        return
+
+    threading.Thread(target=warm_up, args=(queue_lock,), name="api-warm-up", daemon=True).start()
+
+
+def serve(app, server_name, port, root_path):
+    uvicorn.run(
+        app,
+        host=server_name,
+        port=port,
+        timeout_keep_alive=cmd_opts.timeout_keep_alive,
+        root_path=root_path,
+        ssl_keyfile=cmd_opts.tls_keyfile,
+        ssl_certfile=cmd_opts.tls_certfile
+    )
+
+
+def start_server(app, server_name, port, root_path):
+    """Runs uvicorn on a background thread and returns the thread; routes added to app later are served as well."""
+
+    thread = threading.Thread(target=serve, args=(app, server_name, port, root_path), name="api-server", daemon=True)
+    thread.start()
+    timer.startup_timer.record("start API server")
+    return thread
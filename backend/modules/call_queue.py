@@ -6,6 +6,7 @@ import traceback
 
 from modules_forge import main_thread
 from modules import shared, progress, errors, devices, fifo_lock, profiling
+from backend import metrics, tracing
 
 queue_lock = fifo_lock.FIFOLock()
 
@@ -31,14 +32,19 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
+        queued = time.perf_counter()
+
         with queue_lock:
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
+            metrics.queue_wait_seconds.observe(time.perf_counter() - queued, source='ui')
+            trace = tracing.begin(id_task, func.__name__, synchronize=shared.opts.forge_tracing_sync, queued=queued) if id_task is not None and shared.opts.forge_tracing else None
 
             try:
                 res = func(*args, **kwargs)
                 progress.record_results(id_task, res)
             finally:
+                tracing.end(trace)
                 progress.finish_task(id_task)
 
             shared.state.end()
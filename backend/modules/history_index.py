@@ -0,0 +1,249 @@
+"""SQLite index of generated images and their generation parameters.
+
+images.save_image adds every saved sample to the index (from the image save queue when saving in background), and
+backfill() adds images that already exist in the output directories, reading their infotext on a thread pool.
+Prompts, negative prompts and LoRA names are searchable with FTS5 when the sqlite3 build supports it, with a LIKE
+fallback otherwise; model hash, sampler, size and seed are plain indexed columns.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from modules import errors
+from modules.paths_internal import data_path
+from modules.shared import opts
+
+image_extensions = (".png", ".jpg", ".jpeg", ".webp", ".avif")
+re_lora = re.compile(r"<(?:lora|lyco):([^:>]+)")
+
+columns = ["path", "mtime", "width", "height", "prompt", "negative_prompt", "seed", "sampler", "scheduler", "steps", "cfg_scale", "model", "model_hash", "loras", "infotext"]
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def fts_query(text):
+    """Turns user input into an FTS5 query matching all words, without exposing FTS5 query syntax."""
+
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def make_row(path, infotext, width=None, height=None, mtime=None):
+    """Parses infotext into a row of the images table; returns None if the text holds no generation parameters."""
+
+    from modules import infotext_utils
+
+    if not infotext:
+        return None
+
+    params = infotext_utils.parse_generation_parameters(infotext, skip_fields=[])
+    if "Steps" not in params and "Seed" not in params:
+        return None
+
+    prompt = params.get("Prompt", "")
+
+    return dict(
+        path=os.path.abspath(path),
+        mtime=mtime if mtime is not None else os.path.getmtime(path),
+        width=to_int(params.get("Size-1")) or width,
+        height=to_int(params.get("Size-2")) or height,
+        prompt=prompt,
+        negative_prompt=params.get("Negative prompt", ""),
+        seed=to_int(params.get("Seed")),
+        sampler=params.get("Sampler"),
+        scheduler=params.get("Schedule type"),
+        steps=to_int(params.get("Steps")),
+        cfg_scale=to_float(params.get("CFG scale")),
+        model=params.get("Model"),
+        model_hash=params.get("Model hash"),
+        loras=" ".join(sorted(set(re_lora.findall(prompt)))),
+        infotext=infotext,
+    )
+
+
+def read_row(path):
+    from modules import images
+
+    try:
+        mtime = os.path.getmtime(path)
+
+        # only the header is needed, so the image is opened directly instead of through images.read, which decodes it
+        with Image.open(path) as image:
+            infotext, _ = images.read_info_from_image(image)
+            return make_row(path, infotext, image.width, image.height, mtime)
+    except Exception:
+        return None
+
+
+class HistoryIndex:
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.connection = None
+        self.fts = False
+        self.backfill_thread = None
+        self.backfill_status = dict(running=False, scanned=0, indexed=0)
+
+    def connect(self):
+        if self.connection is not None:
+            return self.connection
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, mtime REAL, width INTEGER, height INTEGER,
+                prompt TEXT, negative_prompt TEXT, seed INTEGER, sampler TEXT, scheduler TEXT, steps INTEGER,
+                cfg_scale REAL, model TEXT, model_hash TEXT, loras TEXT, infotext TEXT
+            )""")
+        for column in ("mtime", "seed", "model_hash", "sampler", "width, height"):
+            connection.execute(f"CREATE INDEX IF NOT EXISTS images_{column.replace(', ', '_')} ON images ({column})")
+
+        try:
+            connection.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(prompt, negative_prompt, loras, content='images', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS images_ai AFTER INSERT ON images BEGIN
+                    INSERT INTO images_fts(rowid, prompt, negative_prompt, loras) VALUES (new.id, new.prompt, new.negative_prompt, new.loras);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_ad AFTER DELETE ON images BEGIN
+                    INSERT INTO images_fts(images_fts, rowid, prompt, negative_prompt, loras) VALUES ('delete', old.id, old.prompt, old.negative_prompt, old.loras);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_au AFTER UPDATE ON images BEGIN
+                    INSERT INTO images_fts(images_fts, rowid, prompt, negative_prompt, loras) VALUES ('delete', old.id, old.prompt, old.negative_prompt, old.loras);
+                    INSERT INTO images_fts(rowid, prompt, negative_prompt, loras) VALUES (new.id, new.prompt, new.negative_prompt, new.loras);
+                END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError:
+            print("History index: sqlite3 has no FTS5 support, prompt search will use LIKE")
+
+        connection.commit()
+        self.connection = connection
+        return connection
+
+    def add_rows(self, rows):
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return 0
+
+        names = ", ".join(columns)
+        placeholders = ", ".join(f":{x}" for x in columns)
+        updates = ", ".join(f"{x}=excluded.{x}" for x in columns if x != "path")
+
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(f"INSERT INTO images ({names}) VALUES ({placeholders}) ON CONFLICT(path) DO UPDATE SET {updates}", rows)
+            connection.commit()
+
+        return len(rows)
+
+    def add(self, path, infotext, image=None):
+        """Indexes an image that has just been saved to path; errors are reported, never raised."""
+
+        if not opts.history_index_enable:
+            return
+
+        try:
+            self.add_rows([make_row(path, infotext, getattr(image, "width", None), getattr(image, "height", None))])
+        except Exception:
+            errors.report(f"Error adding {path} to history index", exc_info=True)
+
+    def indexed_mtimes(self):
+        with self.lock:
+            return {row["path"]: row["mtime"] for row in self.connect().execute("SELECT path, mtime FROM images")}
+
+    def backfill(self, directories, threads=8, batch_size=256):
+        """Indexes images in directories (recursively) that are not in the index yet or changed since indexed."""
+
+        status = self.backfill_status
+        status.update(running=True, scanned=0, indexed=0)
+
+        try:
+            known = self.indexed_mtimes()
+            paths = []
+            for directory in directories:
+                for root, _, files in os.walk(directory):
+                    for file in files:
+                        if not file.lower().endswith(image_extensions):
+                            continue
+
+                        path = os.path.abspath(os.path.join(root, file))
+                        status["scanned"] += 1
+                        if known.get(path) != os.path.getmtime(path):
+                            paths.append(path)
+
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="history-backfill") as executor:
+                for start in range(0, len(paths), batch_size):
+                    rows = list(executor.map(read_row, paths[start:start + batch_size]))
+                    status["indexed"] += self.add_rows(rows)
+        except Exception:
+            errors.report("Error while backfilling history index", exc_info=True)
+        finally:
+            status["running"] = False
+
+        return status
+
+    def output_directories(self):
+        directories = [opts.outdir_samples] if opts.outdir_samples else [opts.outdir_txt2img_samples, opts.outdir_img2img_samples]
+        return [x for x in directories if x and os.path.isdir(x)]
+
+    def start_backfill(self):
+        with self.lock:
+            if self.backfill_thread is None or not self.backfill_thread.is_alive():
+                self.backfill_status["running"] = True
+                self.backfill_thread = threading.Thread(target=self.backfill, args=(self.output_directories(),), name="history-backfill", daemon=True)
+                self.backfill_thread.start()
+
+        return self.backfill_status
+
+    def search(self, query=None, model_hash=None, sampler=None, width=None, height=None, seed=None, page=1, page_size=50):
+        """Returns (total number of matches, rows of the requested page), newest first."""
+
+        conditions = []
+        args = []
+        page = max(1, page)
+
+        with self.lock:
+            connection = self.connect()
+
+            if query and query.strip():
+                if self.fts:
+                    conditions.append("id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+                    args.append(fts_query(query))
+                else:
+                    conditions.append("(prompt LIKE ? OR negative_prompt LIKE ? OR loras LIKE ?)")
+                    args += [f"%{query.strip()}%"] * 3
+
+            for column, value in (("model_hash", model_hash), ("sampler", sampler), ("width", width), ("height", height), ("seed", seed)):
+                if value is not None:
+                    conditions.append(f"{column} = ?")
+                    args.append(value)
+
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            total = connection.execute(f"SELECT COUNT(*) FROM images {where}", args).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM images {where} ORDER BY mtime DESC LIMIT ? OFFSET ?", args + [page_size, (page - 1) * page_size]).fetchall()
+
+        return total, [dict(row) for row in rows]
+
+
+history_index = HistoryIndex(os.path.join(data_path, "history.db"))
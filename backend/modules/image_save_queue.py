@@ -0,0 +1,93 @@
+"""Background writer for images saved during generation.
+
+images.save_image picks the final filename on the calling thread, reserves it here and hands encoding and writing to a
+small thread pool, so the next batch can be sampled while the previous one is written to disk. Reserved filenames are
+treated as existing when later filenames are chosen, which keeps numbering in submission order.
+
+The queue is bounded by save_images_queue_size: submitting to a full queue blocks until a write finishes.
+processing.process_images waits for the queue before it restores overridden settings.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import errors
+
+
+class ImageSaveQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.executor = None
+        self.slots = None
+        self.reserved = set()
+        self.pending = 0
+        self.saved = 0
+        self.failed = 0
+
+    def start(self):
+        from modules.shared import opts
+
+        with self.lock:
+            if self.executor is None:
+                self.slots = threading.BoundedSemaphore(max(1, opts.save_images_queue_size))
+                self.executor = ThreadPoolExecutor(max_workers=max(1, opts.save_images_threads), thread_name_prefix="image-save")
+
+    def is_reserved(self, filename):
+        with self.lock:
+            return filename in self.reserved
+
+    def depth(self):
+        """Number of images submitted and not yet written."""
+
+        with self.lock:
+            return self.pending
+
+    def submit(self, func, filename):
+        """Reserves filename and runs func() on a worker; blocks while the queue is full."""
+
+        self.start()
+        self.slots.acquire()
+
+        with self.lock:
+            self.reserved.add(filename)
+            self.pending += 1
+
+        try:
+            self.executor.submit(self.run, func, filename)
+        except Exception:
+            self.finish(filename, ok=False)
+            raise
+
+    def run(self, func, filename):
+        ok = False
+        try:
+            func()
+            ok = True
+        except Exception as e:
+            errors.display(e, f"saving image {filename}")
+        finally:
+            self.finish(filename, ok)
+
+    def finish(self, filename, ok):
+        with self.lock:
+            self.reserved.discard(filename)
+            self.pending -= 1
+            if ok:
+                self.saved += 1
+            else:
+                self.failed += 1
+            if self.pending == 0:
+                self.idle.notify_all()
+
+        self.slots.release()
+
+    def wait(self):
+        """Blocks until every submitted image has been written."""
+
+        with self.lock:
+            while self.pending > 0:
+                self.idle.wait()
+
+
+save_queue = ImageSaveQueue()
@@ -20,8 +20,11 @@ import json
 import hashlib
 
 from modules import sd_samplers, shared, script_callbacks, errors
+from modules.image_save_queue import save_queue
+from modules.history_index import history_index
 from modules.paths_internal import roboto_ttf_file
 from modules.shared import opts
+from backend import tracing
 
 LANCZOS = (Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
 
@@ -562,11 +565,23 @@ def get_next_sequence_number(path, basename):
     return result + 1
 
 
+def write_image_file(image, filename, **kwargs):
+    """Saves image to filename with PIL's image.save; calls fsync afterwards if opts.save_images_fsync is set."""
+
+    with open(filename, "wb") as file:
+        image.save(file, **kwargs)
+
+        if opts.save_images_fsync:
+            file.flush()
+            os.fsync(file.fileno())
+
+
 def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_pnginfo=None, pnginfo_section_name='parameters'):
     """
     Saves image to filename, including geninfo as text information for generation info.
     For PNG images, geninfo is added to existing pnginfo dictionary using the pnginfo_section_name argument as key.
     For JPG images, there's no dictionary and geninfo just replaces the EXIF description.
+    The file is written once, with metadata embedded by the encoder.
     """
 
     if extension is None:
@@ -586,7 +601,7 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         else:
             pnginfo_data = None
 
-        image.save(filename, format=image_format, quality=opts.jpeg_quality, pnginfo=pnginfo_data)
+        write_image_file(image, filename, format=image_format, quality=opts.jpeg_quality, pnginfo=pnginfo_data)
 
     elif extension.lower() in (".jpg", ".jpeg", ".webp"):
         if image.mode == 'RGBA':
@@ -594,8 +609,7 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         elif image.mode == 'I;16':
             image = image.point(lambda p: p * 0.0038910505836576).convert("RGB" if extension.lower() == ".webp" else "L")
 
-        image.save(filename, format=image_format, quality=opts.jpeg_quality, lossless=opts.webp_lossless)
-
+        exif_args = {}
         if opts.enable_pnginfo and geninfo is not None:
             exif_bytes = piexif.dump({
                 "Exif": {
@@ -603,7 +617,10 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
                 },
             })
 
-            piexif.insert(exif_bytes, filename)
+            # WebP stores the TIFF structure without the "Exif\0\0" APP1 header, same as piexif.insert does
+            exif_args["exif"] = exif_bytes[6:] if extension.lower() == ".webp" and exif_bytes.startswith(b"Exif\x00\x00") else exif_bytes
+
+        write_image_file(image, filename, format=image_format, quality=opts.jpeg_quality, lossless=opts.webp_lossless, **exif_args)
     elif extension.lower() == '.avif':
         if opts.enable_pnginfo and geninfo is not None:
             exif_bytes = piexif.dump({
@@ -614,14 +631,15 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         else:
             exif_bytes = None
 
-        image.save(filename,format=image_format, quality=opts.jpeg_quality, exif=exif_bytes)
+        write_image_file(image, filename, format=image_format, quality=opts.jpeg_quality, exif=exif_bytes)
     elif extension.lower() == ".gif":
-        image.save(filename, format=image_format, comment=geninfo)
+        write_image_file(image, filename, format=image_format, comment=geninfo)
     else:
-        image.save(filename, format=image_format, quality=opts.jpeg_quality)
+        write_image_file(image, filename, format=image_format, quality=opts.jpeg_quality)
 
 
-def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None):
+@tracing.traced('save image')
+def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None, background=False):
     """Save an image.
 
     Args:
@@ -647,6 +665,9 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If specified, `basename` and filename pattern will be ignored.
         save_to_dirs (bool):
             If true, the image will be saved into a subdirectory of `path`.
+        background (bool):
+            If true and `opts.save_images_in_background` is set, the filename is chosen immediately, but the file
+            is written by modules.image_save_queue; `image_saved_callback` is called from the writer thread.
 
     Returns: (fullfn, txt_fullfn)
         fullfn (`str`):
@@ -694,7 +715,7 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             for i in range(500):
                 fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
                 fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
-                if not os.path.exists(fullfn):
+                if not os.path.exists(fullfn) and not save_queue.is_reserved(fullfn):
                     break
         else:
             fullfn = os.path.join(path, f"{file_decoration}.{extension}")
@@ -712,6 +733,17 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
     fullfn = params.filename
     info = params.pnginfo.get(pnginfo_section_name, None)
 
+    def _unique_filename_without_extension(filename_without_extension, extension):
+        without_extension = filename_without_extension
+        if shared.opts.save_images_replace_action != "Replace":
+            n = 0
+            filename = without_extension + extension
+            while os.path.exists(filename) or save_queue.is_reserved(filename):
+                n += 1
+                without_extension = f"{filename_without_extension}-{n}"
+                filename = without_extension + extension
+        return without_extension
+
     def _atomically_save_image(image_to_save, filename_without_extension, extension):
         """
         save image with .tmp extension to avoid race condition when another process detects new image in the directory
@@ -720,16 +752,7 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
 
         save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
 
-        filename = filename_without_extension + extension
-        without_extension = filename_without_extension
-        if shared.opts.save_images_replace_action != "Replace":
-            n = 0
-            while os.path.exists(filename):
-                n += 1
-                without_extension = f"{filename_without_extension}-{n}"
-                filename = without_extension + extension
-        os.replace(temp_file_path, filename)
-        return without_extension
+        os.replace(temp_file_path, filename_without_extension + extension)
 
     fullfn_without_extension, extension = os.path.splitext(params.filename)
     if hasattr(os, 'statvfs'):
@@ -738,38 +761,48 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
         params.filename = fullfn_without_extension + extension
         fullfn = params.filename
 
-    fullfn_without_extension = _atomically_save_image(image, fullfn_without_extension, extension)
+    fullfn_without_extension = _unique_filename_without_extension(fullfn_without_extension, extension)
     fullfn = fullfn_without_extension + extension
     image.already_saved_as = fullfn
+    txt_fullfn = f"{fullfn_without_extension}.txt" if opts.save_txt and info is not None else None
+
+    def _write():
+        _atomically_save_image(image, fullfn_without_extension, extension)
+
+        oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
+        if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
+            ratio = image.width / image.height
+            resize_to = None
+            if oversize and ratio > 1:
+                resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
+            elif oversize:
+                resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+
+            downscaled = image
+            if resize_to is not None:
+                try:
+                    # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
+                    downscaled = image.resize(resize_to, LANCZOS)
+                except Exception:
+                    downscaled = image.resize(resize_to)
+            try:
+                _atomically_save_image(downscaled, _unique_filename_without_extension(fullfn_without_extension, ".jpg"), ".jpg")
+            except Exception as e:
+                errors.display(e, "saving image as downscaled JPG")
 
-    oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
-    if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
-        ratio = image.width / image.height
-        resize_to = None
-        if oversize and ratio > 1:
-            resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
-        elif oversize:
-            resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+        if txt_fullfn is not None:
+            with open(txt_fullfn, "w", encoding="utf8") as file:
+                file.write(f"{info}\n")
 
-        if resize_to is not None:
-            try:
-                # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
-                image = image.resize(resize_to, LANCZOS)
-            except Exception:
-                image = image.resize(resize_to)
-        try:
-            _ = _atomically_save_image(image, fullfn_without_extension, ".jpg")
-        except Exception as e:
-            errors.display(e, "saving image as downscaled JPG")
-
-    if opts.save_txt and info is not None:
-        txt_fullfn = f"{fullfn_without_extension}.txt"
-        with open(txt_fullfn, "w", encoding="utf8") as file:
-            file.write(f"{info}\n")
-    else:
-        txt_fullfn = None
+        if not grid and info is not None and pnginfo_section_name == 'parameters':
+            history_index.add(fullfn, info, image)
+
+        script_callbacks.image_saved_callback(params)
 
-    script_callbacks.image_saved_callback(params)
+    if background and opts.save_images_in_background:
+        save_queue.submit(_write, fullfn)
+    else:
+        _write()
 
     return fullfn, txt_fullfn
 
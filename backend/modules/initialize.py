@@ -1,13 +1,17 @@
 import importlib
 import logging
 import sys
+import threading
+import time
 import warnings
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from modules.timer import startup_timer
 
 
-def imports():
+def imports(ui=True):
     logging.getLogger("torch.distributed.nn").setLevel(logging.ERROR)  # sshh...
     logging.getLogger("xformers").addFilter(lambda record: 'A matching Triton is not available' not in record.getMessage())
 
@@ -29,7 +33,9 @@ def imports():
     shared_init.initialize()
     startup_timer.record("initialize shared")
 
-    from modules import processing, gradio_extensions, ui  # noqa: F401
+    from modules import processing, gradio_extensions  # noqa: F401
+    if ui:
+        from modules import ui  # noqa: F401
     startup_timer.record("other imports")
 
 
@@ -41,13 +47,16 @@ def check_versions():
         errors.check_versions()
 
 
-def initialize():
+def initialize(*, parallel=False):
     from modules import initialize_util
     initialize_util.fix_torch_version()
     initialize_util.fix_pytorch_lightning()
     initialize_util.fix_asyncio_event_loop_policy()
     initialize_util.validate_tls_options()
-    initialize_util.configure_sigint_handler()
+    if threading.current_thread() is threading.main_thread():
+        # signal handlers can only be installed from the main thread; --api-fast-startup installs it before
+        # running the rest of initialization on the API thread
+        initialize_util.configure_sigint_handler()
     initialize_util.configure_opts_onchange()
 
     from modules import sd_models
@@ -65,12 +74,42 @@ def initialize():
     gfpgan_model.setup_model(cmd_opts.gfpgan_models_path)
     startup_timer.record("setup gfpgan")
 
-    initialize_rest(reload_script_modules=False)
+    initialize_rest(reload_script_modules=False, parallel=parallel)
+
+
+def start_parallel_stages(stages):
+    """
+    Starts independent startup stages on a thread pool and returns a function that waits for all of them.
+    startup_timer is shared with the thread that keeps running serial stages, so each stage records its own duration
+    instead of using startup_timer.record().
+    """
+
+    def run(name, func):
+        start = time.time()
+        func()
+        startup_timer.add_time_to_record(name, time.time() - start)
+
+    executor = ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="startup")
+    futures = [executor.submit(run, name, func) for name, func in stages]
 
+    def wait():
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown(wait=False)
 
-def initialize_rest(*, reload_script_modules=False):
+        startup_timer.record("wait for parallel stages")
+
+    return wait
+
+
+def initialize_rest(*, reload_script_modules=False, parallel=False):
     """
     Called both from initialize() and when reloading the webui.
+
+    With parallel=True, model, localization, VAE and hypernetwork discovery run on a thread pool while scripts load;
+    they only read the filesystem and the extensions list, which is built before they start.
     """
     from modules.shared_cmd_options import cmd_opts
 
@@ -92,17 +131,29 @@ def initialize_rest(*, reload_script_modules=False):
         scripts.load_scripts()
         return
 
-    from modules import sd_models
-    sd_models.list_models()
-    startup_timer.record("list SD models")
+    from modules import sd_models, localization, sd_vae, shared_items
+
+    wait_for_parallel_stages = None
+    if parallel:
+        wait_for_parallel_stages = start_parallel_stages([
+            ("list SD models", sd_models.list_models),
+            ("list localizations", lambda: localization.list_localizations(cmd_opts.localizations_dir)),
+            ("refresh VAE", sd_vae.refresh_vae_list),
+            ("reload hypernetworks", shared_items.reload_hypernetworks),
+        ])
+    else:
+        sd_models.list_models()
+        startup_timer.record("list SD models")
 
-    from modules import localization
-    localization.list_localizations(cmd_opts.localizations_dir)
-    startup_timer.record("list localizations")
+        localization.list_localizations(cmd_opts.localizations_dir)
+        startup_timer.record("list localizations")
 
     with startup_timer.subcategory("load scripts"):
         scripts.load_scripts()
 
+    if wait_for_parallel_stages is not None:
+        wait_for_parallel_stages()
+
     if reload_script_modules and shared.opts.enable_reloading_ui_scripts:
         for module in [module for name, module in sys.modules.items() if name.startswith("modules.ui")]:
             importlib.reload(module)
@@ -112,17 +163,17 @@ def initialize_rest(*, reload_script_modules=False):
     modelloader.load_upscalers()
     startup_timer.record("load upscalers")
 
-    from modules import sd_vae
-    sd_vae.refresh_vae_list()
-    startup_timer.record("refresh VAE")
+    if not parallel:
+        sd_vae.refresh_vae_list()
+        startup_timer.record("refresh VAE")
 
     from modules import sd_unet
     sd_unet.list_unets()
     startup_timer.record("scripts list_unets")
 
-    from modules import shared_items
-    shared_items.reload_hypernetworks()
-    startup_timer.record("reload hypernetworks")
+    if not parallel:
+        shared_items.reload_hypernetworks()
+        startup_timer.record("reload hypernetworks")
 
     from modules import ui_extra_networks
     ui_extra_networks.initialize()
@@ -0,0 +1,89 @@
+"""Background worker that turns sampler latents into live preview images.
+
+The sampler callback hands latents to the worker at the cadence set by show_progress_every_n_steps. A single
+thread decodes the newest one (older pending latents are dropped), encodes it once in the live preview format
+and publishes the bytes in shared.state. Progress endpoints only read those bytes, so polling never decodes
+anything on the request thread.
+"""
+
+import threading
+import time
+
+import torch
+
+from modules import errors, shared
+
+
+class LivePreviewWorker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.has_work = threading.Event()
+        self.thread = None
+        self.pending = None
+        self.last_decode_time = 0.0
+        self.decoded = 0
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(target=self.loop, name="live-preview", daemon=True)
+            self.thread.start()
+
+    def submit(self, latent, sampling_step):
+        """Queue latent for decoding; replaces any latent that has not been decoded yet."""
+
+        latent = latent.detach().clone()
+
+        with self.lock:
+            if self.pending is not None:
+                self.dropped += 1
+
+            self.pending = (latent, sampling_step)
+
+        self.start()
+        self.has_work.set()
+
+    def clear(self):
+        with self.lock:
+            self.pending = None
+
+    def loop(self):
+        while True:
+            self.has_work.wait()
+
+            min_interval = (shared.opts.live_preview_min_decode_interval or 0) / 1000
+            delay = self.last_decode_time + min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            with self.lock:
+                item, self.pending = self.pending, None
+                self.has_work.clear()
+
+            if item is None:
+                continue
+
+            self.last_decode_time = time.time()
+            self.process(*item)
+
+    @torch.inference_mode()
+    def process(self, latent, sampling_step):
+        import modules.sd_samplers
+
+        try:
+            if shared.opts.show_progress_grid:
+                image = modules.sd_samplers.samples_to_image_grid(latent)
+            else:
+                image = modules.sd_samplers.sample_to_image(latent)
+
+            shared.state.assign_current_image(image, sampling_step=sampling_step)
+            self.decoded += 1
+        except Exception:
+            # when switching models during genration, VAE would be on CPU, so creating an image will fail.
+            errors.record_exception()
+
+
+worker = LivePreviewWorker()
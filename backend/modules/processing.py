@@ -5,6 +5,7 @@ import math
 import os
 import sys
 import hashlib
+import time
 from dataclasses import dataclass, field
 
 import torch
@@ -33,9 +34,11 @@ from einops import repeat, rearrange
 from blendmodes.blend import blendLayers, BlendType
 from modules.sd_models import apply_token_merging, forge_model_reload
 from modules_forge.utils import apply_circular_forge
-from modules_forge import main_entry
-from backend import memory_management
+from modules_forge import main_entry, resolution_buckets
+from modules_forge.init_latent_cache import init_latent_cache
+from backend import memory_management, metrics, tracing
 from backend.modules.k_prediction import rescale_zero_terminal_snr_sigmas
+from backend.patcher.vae import VAEDecodeNaNException
 
 
 # some of those options should not be changed at all because they would break the model, so I removed them from options.
@@ -181,6 +184,7 @@ class StableDiffusionProcessing:
     paste_to: tuple | None = field(default=None, init=False)
 
     is_hr_pass: bool = field(default=False, init=False)
+    began_residency_job: bool = field(default=False, init=False)
 
     c: tuple = field(default=None, init=False)
     uc: tuple = field(default=None, init=False)
@@ -378,6 +382,10 @@ class StableDiffusionProcessing:
     def init(self, all_prompts, all_seeds, all_subseeds):
         pass
 
+    def residency_stages(self):
+        """the order in which one job uses its models, for the residency planner in backend.memory_management"""
+        return [['text_encoder'], ['unet'], ['vae']] * self.n_iter
+
     def sample(self, conditioning, unconditional_conditioning, seeds, subseeds, subseed_strength, prompts):
         raise NotImplementedError()
 
@@ -464,8 +472,10 @@ class StableDiffusionProcessing:
             if cache[0] is not None and cached_params == cache[0]:
                 if len(cache) > 2:
                     shared.sd_model.extra_generation_params.update(cache[2])
+                metrics.cache_hit('conds')
                 return cache[1]
 
+        metrics.cache_miss('conds')
         cache = caches[0]
 
         with devices.autocast():
@@ -635,6 +645,37 @@ def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
     return samples
 
 
+def decode_latent_batch_uint8(model, batch):
+    """Streaming decode to uint8. NaNs would be lost in the uint8 conversion, so when the VAE produces them, the VAE is
+    converted the way the auto_vae_precision options describe and the batch is decoded again."""
+
+    vae = model.forge_objects.vae
+
+    if opts.auto_vae_precision_bfloat16:
+        retry_dtype = torch.bfloat16
+    elif opts.auto_vae_precision:
+        retry_dtype = torch.float32
+    else:
+        retry_dtype = None
+
+    if retry_dtype is None or vae.vae_dtype == retry_dtype:
+        return model.decode_first_stage_uint8(batch)
+
+    try:
+        return model.decode_first_stage_uint8(batch, check_for_nans=True)
+    except VAEDecodeNaNException:
+        if retry_dtype == torch.bfloat16:
+            print("A tensor with NaNs was produced in VAE. Web UI will now convert VAE into bfloat16 and retry. To disable this behavior, disable the 'Automatically convert VAE to bfloat16' setting.")
+        else:
+            print("A tensor with NaNs was produced in VAE. Web UI will now convert VAE into 32-bit float and retry. To disable this behavior, disable the 'Automatically revert VAE to 32-bit floats' setting.")
+
+        vae.vae_dtype = retry_dtype
+        vae.first_stage_model.to(retry_dtype)
+        devices.dtype_vae = retry_dtype
+
+        return model.decode_first_stage_uint8(batch)
+
+
 def get_fixed_seed(seed):
     if seed == '' or seed is None:
         seed = -1
@@ -812,6 +853,11 @@ def manage_model_and_prompt_cache(p: StableDiffusionProcessing):
     need_global_unload = False
 
 
+def residency_components(sd_model):
+    forge_objects = sd_model.forge_objects
+    return dict(text_encoder=forge_objects.clip.patcher, unet=forge_objects.unet, vae=forge_objects.vae.patcher)
+
+
 def process_images(p: StableDiffusionProcessing) -> Processed:
     """applies settings overrides (if any) before processing images, then restores settings as applicable."""
     if p.scripts is not None:
@@ -819,6 +865,10 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
         
     stored_opts = {k: opts.data[k] if k in opts.data else opts.get_default(k) for k in p.override_settings.keys() if k in opts.data}
 
+    kind = 'img2img' if isinstance(p, StableDiffusionProcessingImg2Img) else 'txt2img'
+    started = time.perf_counter()
+    status = 'failed'
+
     try:
         # if no checkpoint override or the override checkpoint can't be found, remove override entry and load opts checkpoint
         # and if after running refiner, the refiner model is not unloaded - webui swaps back to main model here, if model over is present it will be reloaded afterwards
@@ -841,7 +891,19 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
         with profiling.Profiler():
             res = process_images_inner(p)
 
+        status = 'interrupted' if state.interrupted else 'completed'
+        metrics.images.inc(len(res.images) - res.index_of_first_image, kind=kind)
+
     finally:
+        metrics.jobs.inc(kind=kind, status=status)
+        metrics.job_seconds.observe(time.perf_counter() - started, kind=kind)
+        if p.began_residency_job:
+            p.began_residency_job = False
+            memory_management.end_residency_job()
+
+        # files are written with the settings of this job, so they must be on disk before the overrides are restored
+        images.save_queue.wait()
+
         # restore original options
         if p.override_settings_restore_afterwards:
             set_config(stored_opts, save_config=False)
@@ -918,6 +980,10 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
             sd_unet.apply_unet()
 
+        if opts.forge_residency_planner:
+            memory_management.begin_residency_job(p.residency_stages(), lambda: residency_components(p.sd_model), prefetch=opts.forge_residency_prefetch)
+            p.began_residency_job = True
+
         if state.job_count == -1:
             state.job_count = p.n_iter
 
@@ -941,7 +1007,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             p.subseeds = p.all_subseeds[n * p.batch_size:(n + 1) * p.batch_size]
 
             latent_channels = shared.sd_model.forge_objects.vae.latent_channels
-            p.rng = rng.ImageRNG((latent_channels, p.height // opt_f, p.width // opt_f), p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, seed_resize_from_h=p.seed_resize_from_h, seed_resize_from_w=p.seed_resize_from_w)
+            latent_width, latent_height = getattr(p, 'bucket', None) or (p.width, p.height)
+            p.rng = rng.ImageRNG((latent_channels, latent_height // opt_f, latent_width // opt_f), p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, seed_resize_from_h=p.seed_resize_from_h, seed_resize_from_w=p.seed_resize_from_w)
 
             if p.scripts is not None:
                 p.scripts.before_process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
@@ -952,14 +1019,16 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             p.parse_extra_network_prompts()
 
             if not p.disable_extra_networks:
-                extra_networks.activate(p, p.extra_network_data)
+                with tracing.span('extra networks', batch=n):
+                    extra_networks.activate(p, p.extra_network_data)
 
             p.sd_model.forge_objects = p.sd_model.forge_objects_after_applying_lora.shallow_copy()
 
             if p.scripts is not None:
                 p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
 
-            p.setup_conds()
+            with tracing.span('text encoding', batch=n):
+                p.setup_conds()
 
             p.extra_generation_params.update(p.sd_model.extra_generation_params)
 
@@ -987,7 +1056,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 sigmas_backup = p.sd_model.forge_objects.unet.model.predictor.sigmas
                 p.sd_model.forge_objects.unet.model.predictor.set_sigmas(rescale_zero_terminal_snr_sigmas(p.sd_model.forge_objects.unet.model.predictor.sigmas))
 
-            samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
+            with tracing.span('sampling', batch=n, steps=p.steps):
+                samples_ddim = p.sample(conditioning=p.c, unconditional_conditioning=p.uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
 
             for x_sample in samples_ddim:
                 p.latents_after_sampling.append(x_sample)
@@ -1000,6 +1070,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 p.scripts.post_sample(p, ps)
                 samples_ddim = ps.samples
 
+            streamed = False
             if getattr(samples_ddim, 'already_decoded', False):
                 x_samples_ddim = samples_ddim
             else:
@@ -1007,10 +1078,23 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
                 if opts.sd_vae_decode_method != 'Full':
                     p.extra_generation_params['VAE Decoder'] = opts.sd_vae_decode_method
-                x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
 
-            x_samples_ddim = torch.stack(x_samples_ddim).float()
-            x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
+                if opts.sd_vae_decode_method == 'Streaming':
+                    x_samples_ddim = decode_latent_batch_uint8(p.sd_model, samples_ddim)
+                    streamed = True
+                else:
+                    x_samples_ddim = decode_latent_batch(p.sd_model, samples_ddim, target_device=devices.cpu, check_for_nans=True)
+
+            if streamed and p.scripts is not None and p.scripts.needs_postprocess_batch(p):
+                # scripts expect float images in [0, 1]; use pixel centers so that the uint8 conversion below is lossless
+                x_samples_ddim = (torch.from_numpy(x_samples_ddim).movedim(-1, 1).float() + 0.5) / 255.
+                streamed = False
+            elif not streamed:
+                x_samples_ddim = torch.stack(x_samples_ddim).float()
+                x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
+
+            if getattr(p, 'bucket', None) is not None:
+                x_samples_ddim = resolution_buckets.crop_decoded(x_samples_ddim, resolution_buckets.crop_box(p.width, p.height, p.bucket), channels_last=streamed)
 
             del samples_ddim
 
@@ -1019,14 +1103,15 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             state.nextjob()
 
             if p.scripts is not None:
-                p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
+                with tracing.span('postprocess scripts', batch=n):
+                    p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
 
-                p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
-                p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+                    p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+                    p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
 
-                batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
-                p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
-                x_samples_ddim = batch_params.images
+                    batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
+                    p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
+                    x_samples_ddim = batch_params.images
 
             def infotext(index=0, use_main_prompt=False):
                 return create_infotext(p, p.prompts, p.seeds, p.subseeds, use_main_prompt=use_main_prompt, index=index, all_negative_prompts=p.negative_prompts)
@@ -1036,12 +1121,13 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             for i, x_sample in enumerate(x_samples_ddim):
                 p.batch_index = i
 
-                x_sample = 255. * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
-                x_sample = x_sample.astype(np.uint8)
+                if not streamed:
+                    x_sample = 255. * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
+                    x_sample = x_sample.astype(np.uint8)
 
                 if p.restore_faces:
                     if save_samples and opts.save_images_before_face_restoration:
-                        images.save_image(Image.fromarray(x_sample), p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-face-restoration")
+                        images.save_image(Image.fromarray(x_sample), p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-face-restoration", background=True)
 
                     devices.torch_gc()
 
@@ -1072,7 +1158,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 if p.color_corrections is not None and i < len(p.color_corrections):
                     if save_samples and opts.save_images_before_color_correction:
                         image_without_cc, _ = apply_overlay(image, p.paste_to, overlay_image)
-                        images.save_image(image_without_cc, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-color-correction")
+                        images.save_image(image_without_cc, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-color-correction", background=True)
                     image = apply_color_correction(p.color_corrections[i], image)
 
                 # If the intention is to show the output from the model
@@ -1089,7 +1175,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image = pp.image
 
                 if save_samples:
-                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p)
+                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, background=True)
 
                 text = infotext(i)
                 infotexts.append(text)
@@ -1101,14 +1187,14 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     if opts.return_mask or opts.save_mask:
                         image_mask = mask_for_overlay.convert('RGB')
                         if save_samples and opts.save_mask:
-                            images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask")
+                            images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask", background=True)
                         if opts.return_mask:
                             output_images.append(image_mask)
 
                     if opts.return_mask_composite or opts.save_mask_composite:
                         image_mask_composite = Image.composite(original_denoised_image.convert('RGBA').convert('RGBa'), Image.new('RGBa', image.size), images.resize_image(2, mask_for_overlay, image.width, image.height).convert('L')).convert('RGBA')
                         if save_samples and opts.save_mask_composite:
-                            images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask-composite")
+                            images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask-composite", background=True)
                         if opts.return_mask_composite:
                             output_images.append(image_mask_composite)
 
@@ -1134,7 +1220,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                 output_images.insert(0, grid)
                 index_of_first_image = 1
             if opts.grid_save:
-                images.save_image(grid, p.outpath_grids, "grid", p.all_seeds[0], p.all_prompts[0], opts.grid_format, info=infotext(use_main_prompt=True), short_filename=not opts.grid_extended_filename, p=p, grid=True)
+                images.save_image(grid, p.outpath_grids, "grid", p.all_seeds[0], p.all_prompts[0], opts.grid_format, info=infotext(use_main_prompt=True), short_filename=not opts.grid_extended_filename, p=p, grid=True, background=True)
 
     if not p.disable_extra_networks and p.extra_network_data:
         extra_networks.deactivate(p, p.extra_network_data)
@@ -1220,6 +1306,7 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
     hr_prompts: list = field(default=None, init=False)
     hr_negative_prompts: list = field(default=None, init=False)
     hr_extra_network_data: list = field(default=None, init=False)
+    bucket: tuple = field(default=None, init=False)
 
     def __post_init__(self):
         super().__post_init__()
@@ -1273,6 +1360,13 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
                 self.truncate_y = (self.hr_upscale_to_y - target_h) // opt_f
 
     def init(self, all_prompts, all_seeds, all_subseeds):
+        if opts.forge_resolution_bucketing and not self.enable_hr and self.firstpass_image is None:
+            self.bucket = resolution_buckets.choose_bucket(self.width, self.height, resolution_buckets.parse_buckets(opts.forge_resolution_buckets))
+            resolution_buckets.bucket_stats.record(self.width, self.height, self.bucket, self.n_iter * self.batch_size)
+            if self.bucket is not None:
+                self.extra_generation_params["Resolution bucket"] = f"{self.bucket[0]}x{self.bucket[1]}"
+            print(f"[Resolution Buckets] {self.width}x{self.height} -> {'%dx%d' % self.bucket if self.bucket else 'no bucket'}, {resolution_buckets.bucket_stats.summary()}")
+
         if self.enable_hr:
             self.extra_generation_params["Denoising strength"] = self.denoising_strength
 
@@ -1339,6 +1433,17 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
             if self.hr_upscaler is not None:
                 self.extra_generation_params["Hires upscaler"] = self.hr_upscaler
 
+    def residency_stages(self):
+        if not self.enable_hr:
+            return super().residency_stages()
+
+        stages = [] if getattr(self, 'txt2img_upscale', False) else [['text_encoder'], ['unet']]
+        if self.latent_scale_mode is None:
+            stages += [['vae'], ['upscaler'], ['vae']]
+        stages += [['unet'], ['vae']]
+
+        return stages * self.n_iter
+
     def sample(self, conditioning, unconditional_conditioning, seeds, subseeds, subseed_strength, prompts):
         self.sampler = sd_samplers.create_sampler(self.sampler_name, self.sd_model)
 
@@ -1384,7 +1489,13 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
                 x = self.modified_noise
                 self.modified_noise = None
 
-            samples = self.sampler.sample(self, x, conditioning, unconditional_conditioning, image_conditioning=self.txt2img_image_conditioning(x))
+            if self.bucket is not None:
+                self.sd_model.forge_objects.unet = resolution_buckets.reserve_during_sampling(self.sd_model.forge_objects.unet)
+                image_conditioning = self.txt2img_image_conditioning(x, *self.bucket)
+            else:
+                image_conditioning = self.txt2img_image_conditioning(x)
+
+            samples = self.sampler.sample(self, x, conditioning, unconditional_conditioning, image_conditioning=image_conditioning)
             del x
 
             if not self.enable_hr:
@@ -1445,7 +1556,7 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
                 image = sd_samplers.sample_to_image(image, index, approximation=0)
 
             info = create_infotext(self, self.all_prompts, self.all_seeds, self.all_subseeds, [], iteration=self.iteration, position_in_batch=index)
-            images.save_image(image, self.outpath_samples, "", seeds[index], prompts[index], opts.samples_format, info=info, p=self, suffix="-before-highres-fix")
+            images.save_image(image, self.outpath_samples, "", seeds[index], prompts[index], opts.samples_format, info=info, p=self, suffix="-before-highres-fix", background=True)
 
         img2img_sampler_name = self.hr_sampler_name or self.sampler_name
 
@@ -1812,7 +1923,7 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
         if opts.sd_vae_encode_method != 'Full':
             self.extra_generation_params['VAE Encoder'] = opts.sd_vae_encode_method
 
-        self.init_latent = images_tensor_to_samples(image, approximation_indexes.get(opts.sd_vae_encode_method), self.sd_model)
+        self.init_latent = self.encode_init_images(imgs, batch_images.shape[0])
         devices.torch_gc()
 
         if self.resize_mode == 3:
@@ -1841,6 +1952,34 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
 
         self.image_conditioning = self.img2img_image_conditioning(image * 2 - 1, self.init_latent, image_mask, self.mask_round)
 
+    def encode_init_images(self, imgs, batch_size):
+        """Encodes every distinct init image once, or takes its latent from the init latent cache, and repeats the
+        latents to the batch; a single init image is shared by every row of the batch."""
+
+        use_cache = init_latent_cache.budget() > 0
+
+        if use_cache or len(imgs) > 1:
+            keys = [init_latent_cache.make_key(img, self.resize_mode, self.width, self.height, self.sd_model, opts.sd_vae_encode_method) for img in imgs]
+        else:
+            keys = [None]
+
+        latents = {}
+        for key, img in zip(keys, imgs):
+            if key in latents:
+                continue
+
+            latent = init_latent_cache.get(key, device=shared.device) if use_cache else None
+            if latent is None:
+                image = torch.from_numpy(img[None]).to(shared.device, dtype=torch.float32)
+                latent = images_tensor_to_samples(image, approximation_indexes.get(opts.sd_vae_encode_method), self.sd_model)
+                if use_cache:
+                    init_latent_cache.put(key, latent)
+
+            latents[key] = latent
+
+        rows = keys * batch_size if len(keys) == 1 else keys
+        return torch.cat([latents[key] for key in rows])
+
     def sample(self, conditioning, unconditional_conditioning, seeds, subseeds, subseed_strength, prompts):
         x = self.rng.next()
 
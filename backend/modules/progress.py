@@ -1,6 +1,5 @@
 from __future__ import annotations
 import base64
-import io
 import time
 
 import gradio as gr
@@ -14,12 +13,16 @@ import string
 import random
 from typing import List
 
+from backend import metrics
+
 current_task = None
 pending_tasks = OrderedDict()
 finished_tasks = []
 recorded_results = []
 recorded_results_limit = 2
 
+metrics.queue_depth.add_source(lambda: len(pending_tasks))
+
 
 def start_task(id_task):
     global current_task
@@ -118,26 +121,11 @@ def progressapi(req: ProgressRequest):
     id_live_preview = req.id_live_preview
 
     if opts.live_previews_enable and req.live_preview:
-        shared.state.set_current_image()
-        if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
-
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
-
-                else:
-                    save_kwargs = {}
-
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
-                id_live_preview = shared.state.id_live_preview
+        preview_id, preview_format, preview_bytes = shared.state.get_current_image_bytes()
+        if preview_id != req.id_live_preview and preview_bytes is not None:
+            base64_image = base64.b64encode(preview_bytes).decode('ascii')
+            live_preview = f"data:image/{preview_format};base64,{base64_image}"
+            id_live_preview = preview_id
 
     return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
 
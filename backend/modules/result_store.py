@@ -0,0 +1,233 @@
+"""Content-addressed store for images produced by the API.
+
+Every image returned by txt2img/img2img is encoded once, and the encoded bytes are stored under the hex sha256 of those
+bytes together with a small JSON metadata file and a precomputed WEBP thumbnail:
+
+    <store>/<id[:2]>/<id>.<ext>
+    <store>/<id[:2]>/<id>.json
+    <store>/<id[:2]>/<id>.thumb.webp
+
+Because an ID names the content, files never change once written, so they can be served with immutable caching
+headers, and clients can pass an ID instead of base64 pixels as an img2img input (see is_reference).
+The total size of the store is kept under the api_result_store_size budget by deleting the oldest results.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from modules import errors
+from modules.paths_internal import data_path
+from modules.shared import opts
+
+reference_prefix = "result:"
+re_result_id = re.compile(r"^[0-9a-f]{64}$")
+
+media_types = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+def normalize_id(value):
+    """Returns the result ID in value (a bare ID or result:<ID>), or None if value is not a well-formed ID."""
+
+    if not isinstance(value, str):
+        return None
+
+    if value.startswith(reference_prefix):
+        value = value[len(reference_prefix):]
+
+    value = value.strip().lower()
+    return value if re_result_id.match(value) else None
+
+
+class ResultStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_size = None
+
+    @staticmethod
+    def directory():
+        return opts.api_result_store_dir or os.path.join(data_path, "results")
+
+    def paths(self, result_id):
+        folder = os.path.join(self.directory(), result_id[:2])
+        return folder, os.path.join(folder, f"{result_id}.json"), os.path.join(folder, f"{result_id}.thumb.webp")
+
+    def metadata(self, result_id):
+        result_id = normalize_id(result_id)
+        if result_id is None:
+            return None
+
+        _, metadata_path, _ = self.paths(result_id)
+        try:
+            with open(metadata_path, "r", encoding="utf8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def image_path(self, result_id):
+        metadata = self.metadata(result_id)
+        if metadata is None:
+            return None, None
+
+        folder, _, _ = self.paths(metadata["id"])
+        path = os.path.join(folder, f"{metadata['id']}.{metadata['format']}")
+        return (path, metadata) if os.path.isfile(path) else (None, None)
+
+    def thumbnail_path(self, result_id):
+        result_id = normalize_id(result_id)
+        if result_id is None:
+            return None
+
+        _, _, thumbnail_path = self.paths(result_id)
+        return thumbnail_path if os.path.isfile(thumbnail_path) else None
+
+    def exists(self, result_id):
+        return self.metadata(result_id) is not None
+
+    def load_image(self, result_id):
+        path, _ = self.image_path(result_id)
+        if path is None:
+            return None
+
+        from modules import images
+        return images.read(path)
+
+    def put(self, image, data, file_format, job=None):
+        """Stores an image that was already encoded to data in file_format and returns its ID."""
+
+        result_id = hashlib.sha256(data).hexdigest()
+        folder, metadata_path, thumbnail_path = self.paths(result_id)
+        if os.path.isfile(metadata_path):
+            return result_id
+
+        file_format = file_format.lower()
+        os.makedirs(folder, exist_ok=True)
+
+        thumbnail = image.convert("RGB") if image.mode not in ("RGB", "RGBA") else image.copy()
+        thumbnail.thumbnail((opts.api_result_store_thumbnail_size, opts.api_result_store_thumbnail_size), Image.Resampling.LANCZOS)
+        with io.BytesIO() as thumbnail_bytes:
+            thumbnail.save(thumbnail_bytes, format="WEBP", quality=80)
+            thumbnail_data = thumbnail_bytes.getvalue()
+
+        metadata = {
+            "id": result_id,
+            "format": file_format,
+            "width": image.width,
+            "height": image.height,
+            "size": len(data),
+            "created": time.time(),
+            "job": job,
+            "infotext": image.info.get("parameters") if isinstance(image.info.get("parameters"), str) else None,
+        }
+
+        # metadata goes last because its presence marks a complete entry
+        self.write_file(os.path.join(folder, f"{result_id}.{file_format}"), data)
+        self.write_file(thumbnail_path, thumbnail_data)
+        self.write_file(metadata_path, json.dumps(metadata).encode("utf8"))
+
+        with self.lock:
+            if self.total_size is not None:
+                self.total_size += len(data) + len(thumbnail_data)
+
+        self.prune()
+
+        return result_id
+
+    @staticmethod
+    def write_file(path, data):
+        # a unique temporary file, since concurrent requests returning the same image write the same entry
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def list_entries(self):
+        """Returns (created, id, size of all files) for every complete entry in the store."""
+
+        entries = []
+        directory = self.directory()
+        if not os.path.isdir(directory):
+            return entries
+
+        for folder in os.scandir(directory):
+            if not folder.is_dir():
+                continue
+
+            sizes = {}
+            for file in os.scandir(folder.path):
+                result_id = file.name.split(".", 1)[0]
+                sizes[result_id] = sizes.get(result_id, 0) + file.stat().st_size
+
+            for result_id, size in sizes.items():
+                metadata = self.metadata(result_id)
+                if metadata is not None:
+                    entries.append((metadata.get("created", 0), result_id, size))
+
+        return entries
+
+    def remove(self, result_id):
+        result_id = normalize_id(result_id)
+        if result_id is None:
+            return 0
+
+        folder, _, _ = self.paths(result_id)
+        removed = 0
+        for file in os.scandir(folder) if os.path.isdir(folder) else []:
+            if file.name.startswith(result_id):
+                removed += file.stat().st_size
+                os.remove(file.path)
+
+        return removed
+
+    def prune(self):
+        budget = opts.api_result_store_size * 1024 * 1024
+        if budget <= 0:
+            return
+
+        with self.lock:
+            if self.total_size is not None and self.total_size <= budget:
+                return
+
+            try:
+                entries = sorted(self.list_entries())
+                self.total_size = sum(size for _, _, size in entries)
+
+                for _, result_id, _ in entries:
+                    if self.total_size <= budget:
+                        break
+
+                    self.total_size -= self.remove(result_id)
+            except OSError:
+                errors.report("Error pruning result store", exc_info=True)
+
+
+result_store = ResultStore()
+
+
+def is_reference(value):
+    """True if value is result:<ID>, or a bare ID of an image in the store."""
+
+    if not isinstance(value, str):
+        return False
+
+    if value.startswith(reference_prefix):
+        return True
+
+    return normalize_id(value) is not None and result_store.exists(value)
@@ -42,7 +42,7 @@ def randn_local(seed, shape):
         rng = rng_philox.Generator(seed)
         return torch.asarray(rng.randn(shape), device=devices.device)
 
-    local_device = devices.cpu if get_noise_source_type() == "CPU" or devices.device.type == 'mps' else devices.device
+    local_device = get_noise_device()
     local_generator = torch.Generator(local_device).manual_seed(int(seed))
     return torch.randn(shape, device=local_device, generator=local_generator).to(devices.device)
 
@@ -90,11 +90,37 @@ def create_generator(seed):
     if get_noise_source_type() == "NV":
         return rng_philox.Generator(seed)
 
-    device = devices.cpu if get_noise_source_type() == "CPU" or devices.device.type == 'mps' else devices.device
-    generator = torch.Generator(device).manual_seed(int(seed))
+    generator = torch.Generator(get_noise_device()).manual_seed(int(seed))
     return generator
 
 
+def get_noise_device():
+    """Device that torch generators for the current noise source live on."""
+
+    if get_noise_source_type() == "CPU" or devices.device.type == 'mps':
+        return devices.cpu
+
+    return devices.device
+
+
+def randn_batch(shape, generators):
+    """Generate a (len(generators), *shape) tensor where row i is drawn from generators[i].
+
+    Produces the same numbers as stacking randn_without_seed(shape, generator=g) for every generator, but
+    writes each row into one preallocated tensor and moves the whole batch to the device at once."""
+
+    shape = tuple(shape)
+
+    if get_noise_source_type() == "NV":
+        return torch.asarray(rng_philox.randn_batch(generators, shape), device=devices.device)
+
+    x = torch.empty((len(generators), *shape), device=get_noise_device())
+    for i, generator in enumerate(generators):
+        torch.randn(shape, generator=generator, out=x[i])
+
+    return x.to(devices.device)
+
+
 # from https://discuss.pytorch.org/t/help-regarding-slerp-function-for-generative-model-sampling/32475/3
 def slerp(val, low, high):
     low_norm = low/torch.norm(low, dim=1, keepdim=True)
@@ -110,6 +136,25 @@ def slerp(val, low, high):
     return res
 
 
+def slerp_batch(val, low, high):
+    """Batched version of slerp: applies slerp(val, low[i], high[i]) to every image of the batch at once."""
+
+    low_norm = low/torch.norm(low, dim=2, keepdim=True)
+    high_norm = high/torch.norm(high, dim=2, keepdim=True)
+    dot = (low_norm*high_norm).sum(2)
+
+    omega = torch.acos(dot)
+    so = torch.sin(omega)
+    res = (torch.sin((1.0-val)*omega)/so).unsqueeze(2)*low + (torch.sin(val*omega)/so).unsqueeze(2) * high
+
+    # slerp falls back to linear interpolation per image when the two noises are nearly parallel
+    is_linear = dot.flatten(1).mean(1) > 0.9995
+    if is_linear.any():
+        res = torch.where(is_linear.view(-1, *([1] * (res.dim() - 1))), low * val + high * (1 - val), res)
+
+    return res
+
+
 class ImageRNG:
     def __init__(self, shape, seeds, subseeds=None, subseed_strength=0.0, seed_resize_from_h=0, seed_resize_from_w=0):
         self.shape = tuple(map(int, shape))
@@ -126,55 +171,47 @@ class ImageRNG:
     def first(self):
         noise_shape = self.shape if self.seed_resize_from_h <= 0 or self.seed_resize_from_w <= 0 else (self.shape[0], int(self.seed_resize_from_h) // 8, int(self.seed_resize_from_w // 8))
 
-        xs = []
-
-        for i, (seed, generator) in enumerate(zip(self.seeds, self.generators)):
-            subnoise = None
-            if self.subseeds is not None and self.subseed_strength != 0:
-                subseed = 0 if i >= len(self.subseeds) else self.subseeds[i]
-                subnoise = randn(subseed, noise_shape)
-
-            if noise_shape != self.shape:
-                noise = randn(seed, noise_shape)
-            else:
-                noise = randn(seed, self.shape, generator=generator)
-
-            if subnoise is not None:
-                noise = slerp(self.subseed_strength, noise, subnoise)
-
-            if noise_shape != self.shape:
-                x = randn(seed, self.shape, generator=generator)
-                dx = (self.shape[2] - noise_shape[2]) // 2
-                dy = (self.shape[1] - noise_shape[1]) // 2
-                w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
-                h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
-                tx = 0 if dx < 0 else dx
-                ty = 0 if dy < 0 else dy
-                dx = max(-dx, 0)
-                dy = max(-dy, 0)
-
-                x[:, ty:ty + h, tx:tx + w] = noise[:, dy:dy + h, dx:dx + w]
-                noise = x
-
-            xs.append(noise)
+        if noise_shape != self.shape:
+            noise = randn_batch(noise_shape, [create_generator(seed) for seed in self.seeds])
+        else:
+            noise = randn_batch(self.shape, self.generators)
+
+        if self.subseeds is not None and self.subseed_strength != 0:
+            subseeds = [0 if i >= len(self.subseeds) else self.subseeds[i] for i in range(len(self.seeds))]
+            subnoise = randn_batch(noise_shape, [create_generator(subseed) for subseed in subseeds])
+            noise = slerp_batch(self.subseed_strength, noise, subnoise)
+
+        if noise_shape != self.shape:
+            x = randn_batch(self.shape, self.generators)
+            dx = (self.shape[2] - noise_shape[2]) // 2
+            dy = (self.shape[1] - noise_shape[1]) // 2
+            w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
+            h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
+            tx = 0 if dx < 0 else dx
+            ty = 0 if dy < 0 else dy
+            dx = max(-dx, 0)
+            dy = max(-dy, 0)
+
+            x[:, :, ty:ty + h, tx:tx + w] = noise[:, :, dy:dy + h, dx:dx + w]
+            noise = x
+
+        # per-image generation used to reseed the global generator for every seed; keep its final state for
+        # samplers that draw from it (DDPM)
+        if self.seeds:
+            manual_seed((self.seeds[-1] + 100000) % 65536)
 
         eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
         if eta_noise_seed_delta:
             self.generators = [create_generator(seed + eta_noise_seed_delta) for seed in self.seeds]
 
-        return torch.stack(xs).to(shared.device)
+        return noise.to(shared.device)
 
     def next(self):
         if self.is_first:
             self.is_first = False
             return self.first()
 
-        xs = []
-        for generator in self.generators:
-            x = randn_without_seed(self.shape, generator=generator)
-            xs.append(x)
-
-        return torch.stack(xs).to(shared.device)
+        return randn_batch(self.shape, self.generators).to(shared.device)
 
 
 devices.randn = randn
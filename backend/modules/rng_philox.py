@@ -15,6 +15,10 @@ Expected output:
 ```
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 philox_m = [0xD2511F53, 0xCD9E8D57]
@@ -74,6 +78,154 @@ def box_muller(x, y):
     return r1.astype(np.float32)
 
 
+# The functions below compute the same numbers as philox4_32 + box_muller, bit for bit, but faster: the key and the
+# constant parts of the counter are scalars instead of arrays, work is done in chunks that fit in CPU cache with
+# preallocated scratch buffers and in-place ufuncs, and chunks can be spread over threads (numpy releases the GIL).
+
+chunk_size = 1 << 16
+parallel_threshold = 1 << 18
+max_threads = min(8, os.cpu_count() or 1)
+
+two_pow32_inv_f64 = float(two_pow32_inv[0])
+two_pow32_inv_half_f64 = float((two_pow32_inv / 2)[0])
+two_pow32_inv_2pi_f64 = float(two_pow32_inv_2pi[0])
+two_pow32_inv_2pi_half_f64 = float((two_pow32_inv_2pi / 2)[0])
+
+scratch_local = threading.local()
+executor = None
+executor_lock = threading.Lock()
+
+
+class Scratch:
+    def __init__(self, size):
+        self.c = np.empty((4, size), dtype=np.uint32)
+        self.t = np.empty((2, size), dtype=np.uint64)
+        self.f = np.empty((2, size), dtype=np.float64)
+        self.f32 = np.empty(size, dtype=np.float32)
+
+
+def get_scratch():
+    scratch = getattr(scratch_local, 'scratch', None)
+    if scratch is None:
+        scratch = scratch_local.scratch = Scratch(chunk_size)
+
+    return scratch
+
+
+def split_key(seed):
+    """Same key as filling a uint64 array with seed and viewing it as two uint32 words."""
+
+    seed = int(seed) & 0xFFFFFFFFFFFFFFFF
+    return seed & 0xFFFFFFFF, seed >> 32
+
+
+def philox_box_muller_chunk(offset, key, start, out):
+    """Fills out (float32 or float16, 1-D) with the normal numbers start, start + 1, ... of the stream (key, offset)."""
+
+    m = out.shape[0]
+    scratch = get_scratch()
+    c0, c1, c2, c3 = scratch.c[:, :m]
+    t0, t2 = scratch.t[:, :m]
+    lo0, hi0 = t0.view(np.uint32)[0::2], t0.view(np.uint32)[1::2]
+    lo2, hi2 = t2.view(np.uint32)[0::2], t2.view(np.uint32)[1::2]
+
+    k0, k1 = key
+    w0, w1 = philox_w
+    m0, m1 = np.uint64(philox_m[0]), np.uint64(philox_m[1])
+
+    # first round: counter is (offset, 0, start + i, 0), so only counter[2] varies
+    p0 = (offset & 0xFFFFFFFF) * philox_m[0]
+    np.copyto(c2, np.arange(start, start + m, dtype=np.uint32))
+    np.multiply(c2, m1, out=t2, dtype=np.uint64)
+    np.bitwise_xor(hi2, np.uint32(k0), out=c0)
+    np.copyto(c1, lo2)
+    c2.fill(((p0 >> 32) ^ k1) & 0xFFFFFFFF)
+    c3.fill(p0 & 0xFFFFFFFF)
+
+    for _ in range(9):
+        k0 = (k0 + w0) & 0xFFFFFFFF
+        k1 = (k1 + w1) & 0xFFFFFFFF
+
+        np.multiply(c0, m0, out=t0, dtype=np.uint64)
+        np.multiply(c2, m1, out=t2, dtype=np.uint64)
+
+        np.bitwise_xor(hi2, c1, out=c0)
+        c0 ^= np.uint32(k0)
+        np.copyto(c1, lo2)
+        np.bitwise_xor(hi0, c3, out=c2)
+        c2 ^= np.uint32(k1)
+        np.copyto(c3, lo0)
+
+    # Box-Muller on counter[0] and counter[1], in float64 like box_muller
+    u, v = scratch.f[:, :m]
+    np.multiply(c0, two_pow32_inv_f64, out=u, dtype=np.float64)
+    u += two_pow32_inv_half_f64
+    np.log(u, out=u)
+    u *= -2.0
+    np.sqrt(u, out=u)
+
+    np.multiply(c1, two_pow32_inv_2pi_f64, out=v, dtype=np.float64)
+    v += two_pow32_inv_2pi_half_f64
+    np.sin(v, out=v)
+    u *= v
+
+    if out.dtype == np.float32:
+        np.copyto(out, u, casting='same_kind')
+    else:
+        # round through float32, so that float16 output equals converting the float32 result
+        f32 = scratch.f32[:m]
+        np.copyto(f32, u, casting='same_kind')
+        np.copyto(out, f32, casting='same_kind')
+
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='philox')
+
+    return executor
+
+
+def randn_streams(streams, n, dtype=np.float32, threads=None):
+    """Generates n normal numbers for each (seed, offset) pair in streams; returns a (len(streams), n) array of dtype.
+
+    Row i equals Generator(seed).randn((n,)) for a generator at that offset."""
+
+    out = np.empty((len(streams), n), dtype=dtype)
+    tasks = [(split_key(seed), offset, row, start) for row, (seed, offset) in enumerate(streams) for start in range(0, n, chunk_size)]
+
+    def run(task):
+        key, offset, row, start = task
+        philox_box_muller_chunk(offset, key, start, out[row, start:start + chunk_size])
+
+    if threads is None:
+        threads = max_threads if out.size >= parallel_threshold else 1
+
+    if threads > 1 and len(tasks) > 1:
+        list(get_executor().map(run, tasks))
+    else:
+        for task in tasks:
+            run(task)
+
+    return out
+
+
+def randn_batch(generators, shape, dtype=np.float32, threads=None):
+    """Same as np.stack([g.randn(shape) for g in generators]), computed in one call."""
+
+    n = 1
+    for x in shape:
+        n *= x
+
+    out = randn_streams([(g.seed, g.offset) for g in generators], n, dtype=dtype, threads=threads)
+    for g in generators:
+        g.offset += 1
+
+    return out.reshape((len(generators), *shape))
+
+
 class Generator:
     """RNG that produces same outputs as torch.randn(..., device='cuda') on CPU"""
 
@@ -81,9 +233,22 @@ class Generator:
         self.seed = seed
         self.offset = 0
 
-    def randn(self, shape):
+    def randn(self, shape, dtype=np.float32, threads=None):
         """Generate a sequence of n standard normal random variables using the Philox 4x32 random number generator and the Box-Muller transform."""
 
+        n = 1
+        for x in shape:
+            n *= x
+
+        # up to 2^32 numbers can be generated - if you want more you'd need to spill into counter[3]
+        out = randn_streams([(self.seed, self.offset)], n, dtype=dtype, threads=threads)
+        self.offset += 1
+
+        return out.reshape(shape)
+
+    def randn_reference(self, shape):
+        """randn using philox4_32 and box_muller on whole arrays; the plain implementation randn is checked against."""
+
         n = 1
         for x in shape:
             n *= x
@@ -241,6 +241,15 @@ class Script:
 
         pass
 
+    def needs_postprocess_batch(self, p, *args):
+        """
+        Whether postprocess_batch() and postprocess_batch_list() of this script use the decoded images in this generation.
+        When no script does, the streaming VAE decode keeps the batch as uint8 instead of converting it to float tensors.
+        Scripts that implement those methods but only act on some generations can return False for the others.
+        """
+
+        return True
+
     def on_mask_blend(self, p, mba: MaskBlendArgs, *args):
         """
         Called in inpainting mode when the original content is blended with the inpainted content.
@@ -777,6 +786,31 @@ class ScriptRunner:
 
         return self.inputs
 
+    def setup_ui_headless(self):
+        """
+        Creates script controls in the same order as the txt2img/img2img tabs do, without building the rest of the UI,
+        so that args_from/args_to of every script are known. Used by the API when modules.ui is not loaded.
+        """
+
+        from modules import shared, shared_items
+
+        user_order = {x.strip(): i * 2 + 1 for i, x in enumerate(shared.opts.ui_reorder_list)}
+        categories = [category for _, category in sorted(enumerate(shared_items.ui_reorder_categories()), key=lambda x: user_order.get(x[1], x[0] * 2 + 0))]
+
+        global scripts_current
+        scripts_current = self
+
+        with gr.Blocks():
+            self.prepare_ui()
+
+            for category in categories:
+                if category == "scripts":
+                    self.setup_ui()
+
+                self.setup_ui_for_section(category)
+
+        return self.inputs
+
     def run(self, p, *args):
         script_index = args[0]
 
@@ -909,6 +943,18 @@ class ScriptRunner:
             except Exception:
                 errors.report(f"Error running postprocess_batch: {script.filename}", exc_info=True)
 
+    def needs_postprocess_batch(self, p):
+        for script in self.ordered_scripts('postprocess_batch') + self.ordered_scripts('postprocess_batch_list'):
+            try:
+                script_args = p.script_args[script.args_from:script.args_to]
+                if script.needs_postprocess_batch(p, *script_args):
+                    return True
+            except Exception:
+                errors.report(f"Error running needs_postprocess_batch: {script.filename}", exc_info=True)
+                return True
+
+        return False
+
     def postprocess_batch_list(self, p, pp: PostprocessBatchListArgs, **kwargs):
         for script in self.ordered_scripts('postprocess_batch_list'):
             try:
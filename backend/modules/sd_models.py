@@ -13,6 +13,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import gc
 import contextlib
+import time
 
 from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
 from modules.shared import opts, cmd_opts
@@ -21,7 +22,11 @@ import numpy as np
 from backend.loader import forge_loader
 from backend import memory_management
 from backend.args import dynamic_args
-from backend.utils import load_torch_file
+from backend.utils import load_torch_file, get_state_dict_after_quant
+from backend import quant_cache, compilation, metrics, tracing
+from modules_forge import forge_version
+from modules_forge.init_latent_cache import init_latent_cache
+from modules_forge import shared_options as forge_shared_options
 
 
 model_dir = "Stable-diffusion"
@@ -469,17 +474,30 @@ def apply_token_merging(sd_model, token_merging_ratio):
     return
 
 
+def get_unet_quant_cache(storage_dtype):
+    if not opts.forge_unet_quant_cache or not quant_cache.is_cacheable(storage_dtype):
+        return None
+
+    return quant_cache.QuantizedUNetCache(os.path.join(paths.models_path, 'quant-cache'), max_size=int(opts.forge_unet_quant_cache_size * 1024 ** 3))
+
+
 @torch.inference_mode()
 def forge_model_reload():
     current_hash = str(model_data.forge_loading_parameters)
 
     if model_data.forge_hash == current_hash:
+        metrics.cache_hit('checkpoint')
         return model_data.sd_model, False
 
+    metrics.cache_miss('checkpoint')
     print('Loading Model: ' + str(model_data.forge_loading_parameters))
 
+    started = time.perf_counter()
+    span = tracing.open_span('model load')
     timer = Timer()
 
+    init_latent_cache.clear()
+
     if model_data.sd_model:
         model_data.sd_model = None
         memory_management.unload_all_models()
@@ -498,12 +516,47 @@ def forge_model_reload():
 
     timer.record("cache state dict")
 
-    dynamic_args['forge_unet_storage_dtype'] = model_data.forge_loading_parameters.get('unet_storage_dtype', None)
+    unet_storage_dtype = model_data.forge_loading_parameters.get('unet_storage_dtype', None)
+    unet_quant_cache = get_unet_quant_cache(unet_storage_dtype)
+    unet_quant_cache_filename = None
+    unet_quant_cache_hit = False
+
+    if unet_quant_cache is not None:
+        checkpoint_info.calculate_shorthash()
+        timer.record("calculate hash")
+
+        if checkpoint_info.sha256 is None:
+            unet_quant_cache = None
+        else:
+            unet_quant_cache_filename = unet_quant_cache.filename(checkpoint_info.sha256, unet_storage_dtype, forge_version.version)
+            unet_quant_cache_hit = unet_quant_cache.has(unet_quant_cache_filename)
+
+    dynamic_args['forge_unet_storage_dtype'] = unet_storage_dtype
+    dynamic_args['forge_unet_quant_cache'] = unet_quant_cache_filename if unet_quant_cache_hit else None
     dynamic_args['embedding_dir'] = cmd_opts.embeddings_dir
     dynamic_args['emphasis_name'] = opts.emphasis
+    dynamic_args['forge_dequant_cache_size'] = opts.forge_dequant_cache_size
+    dynamic_args['forge_layer_prefetch_depth'] = opts.forge_layer_prefetch_depth
+    dynamic_args['forge_compile_mode'] = opts.forge_compile_mode
+    forge_shared_options.setup_compile_cache()
     sd_model = forge_loader(state_dict, additional_state_dicts=additional_state_dicts)
     timer.record("forge model load")
 
+    diffusion_model = sd_model.forge_objects.unet.model.diffusion_model
+    if unet_quant_cache is not None and not unet_quant_cache_hit and quant_cache.is_cacheable(unet_storage_dtype, getattr(diffusion_model, 'state_dict_dtype', None)):
+        try:
+            # written straight from the model's parameters; safetensors copies them to the file one tensor at a time
+            unet_state_dict = get_state_dict_after_quant(diffusion_model, clone=False)
+            unet_quant_cache.put(unet_quant_cache_filename, unet_state_dict, metadata=dict(checkpoint=checkpoint_info.title, sha256=checkpoint_info.sha256, storage_dtype=unet_storage_dtype, forge_version=forge_version.version))
+            del unet_state_dict
+        except Exception:
+            errors.report(f"Failed to store quantized UNet in {unet_quant_cache_filename}", exc_info=True)
+        timer.record("store quantized unet")
+
+    if compilation.compile_mode() != 'None':
+        compilation.warmup(sd_model)
+        timer.record("compile warm-up")
+
     sd_model.extra_generation_params = {}
     sd_model.comments = []
     sd_model.sd_checkpoint_info = checkpoint_info
@@ -522,5 +575,8 @@ def forge_model_reload():
     print(f"Model loaded in {timer.summary()}.")
 
     model_data.forge_hash = current_hash
+    tracing.close_span(span)
+    metrics.model_loads.inc()
+    metrics.model_load_seconds.observe(time.perf_counter() - started)
 
     return sd_model, True
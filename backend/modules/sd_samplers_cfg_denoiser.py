@@ -1,3 +1,4 @@
+import time
 import torch
 from modules import prompt_parser, sd_samplers_common
 
@@ -7,6 +8,7 @@ from modules.script_callbacks import CFGDenoiserParams, cfg_denoiser_callback
 from modules.script_callbacks import CFGDenoisedParams, cfg_denoised_callback
 from modules.script_callbacks import AfterCFGCallbackParams, cfg_after_cfg_callback
 from backend.sampling.sampling_function import sampling_function
+from backend import metrics, tracing
 
 
 def catenate_conds(conds):
@@ -196,7 +198,13 @@ class CFGDenoiser(torch.nn.Module):
             if shared.opts.s_min_uncond_all:
                 self.p.extra_generation_params["NGMS all steps"] = shared.opts.s_min_uncond_all
 
-        denoised, cond_pred, uncond_pred = sampling_function(self, denoiser_params=denoiser_params, cond_scale=cond_scale, cond_composition=cond_composition)
+        started = time.perf_counter()
+        with tracing.span('step', step=self.step):
+            denoised, cond_pred, uncond_pred = sampling_function(self, denoiser_params=denoiser_params, cond_scale=cond_scale, cond_composition=cond_composition)
+
+        sampler_name = self.sampler.config.name if self.sampler.config is not None else 'unknown'
+        metrics.sampling_steps.inc(sampler=sampler_name)
+        metrics.sampling_seconds.inc(time.perf_counter() - started, sampler=sampler_name)
 
         if self.need_last_noise_uncond:
             self.last_noise_uncond = (x - uncond_pred) / sigma[:, None, None, None]
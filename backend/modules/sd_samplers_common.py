@@ -86,8 +86,19 @@ def sample_to_image(samples, index=0, approximation=None):
     return single_sample_to_image(samples[index], approximation)
 
 
+def samples_to_images(samples, approximation=None):
+    """Decodes a batch of latents in one pass and returns a list of PIL images."""
+    x_samples = samples_to_images_tensor(samples, approximation) * 0.5 + 0.5
+
+    x_samples = torch.clamp(x_samples, min=0.0, max=1.0)
+    x_samples = 255. * np.moveaxis(x_samples.cpu().numpy(), 1, 3)
+    x_samples = x_samples.astype(np.uint8)
+
+    return [Image.fromarray(x_sample) for x_sample in x_samples]
+
+
 def samples_to_image_grid(samples, approximation=None):
-    return images.image_grid([single_sample_to_image(sample, approximation) for sample in samples])
+    return images.image_grid(samples_to_images(samples, approximation))
 
 
 def images_tensor_to_samples(image, approximation=None, model=None):
@@ -122,7 +133,9 @@ def store_latent(decoded):
 
     if opts.live_previews_enable and opts.show_progress_every_n_steps > 0 and shared.state.sampling_step % opts.show_progress_every_n_steps == 0:
         if not shared.parallel_processing_allowed:
-            shared.state.assign_current_image(sample_to_image(decoded))
+            shared.state.assign_current_image(sample_to_image(decoded), sampling_step=shared.state.sampling_step)
+        else:
+            shared.state.do_set_current_image()
 
 
 def is_sampler_using_eta_noise_seed_delta(p):
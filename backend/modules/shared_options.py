@@ -58,6 +58,11 @@ options_templates.update(options_section(('saving-images', "Saving images/grids"
     "save_mask_composite": OptionInfo(False, "For inpainting, save a masked composite"),
     "jpeg_quality": OptionInfo(80, "Quality for saved jpeg and avif images", gr.Slider, {"minimum": 1, "maximum": 100, "step": 1}),
     "webp_lossless": OptionInfo(False, "Use lossless compression for webp images"),
+    "save_images_in_background": OptionInfo(True, "Save generated images in background threads").info("the next batch is generated while the previous one is written; the job finishes when all files are written"),
+    "save_images_queue_size": OptionInfo(16, "Maximum number of images waiting to be saved", gr.Slider, {"minimum": 1, "maximum": 128, "step": 1}).info("generation pauses when the queue is full").needs_restart(),
+    "save_images_threads": OptionInfo(2, "Number of threads saving images", gr.Slider, {"minimum": 1, "maximum": 8, "step": 1}).needs_restart(),
+    "save_images_fsync": OptionInfo(False, "Flush saved images to disk (fsync)").info("safer against power loss, slower on most drives"),
+    "history_index_enable": OptionInfo(True, "Add saved images to the searchable generation history").info("history.db in the data directory; images saved earlier can be added with POST /sdapi/v1/history/backfill"),
     "export_for_4chan": OptionInfo(True, "Save copy of large images as JPG").info("if the file size is above the limit, or either width or height are above the limit"),
     "img_downscale_threshold": OptionInfo(4.0, "File size limit for the above option, MB", gr.Number),
     "target_side_length": OptionInfo(4000, "Width/height limit for the above option, in pixels", gr.Number),
@@ -129,6 +134,7 @@ options_templates.update(options_section(('system', "System", "system"), {
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
+    "api_warm_up_generation": OptionInfo(True, "Run a one-step generation after loading the checkpoint at API startup (--nowebui)").info("initializes kernels and memory pools so the first request is as fast as the following ones; --skip-load-model-at-start disables loading altogether"),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
 }))
 
@@ -152,6 +158,10 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_result_store": OptionInfo(True, "Keep generated images in the result store").info("API responses include image IDs; images and thumbnails can be fetched by ID and used as img2img inputs"),
+    "api_result_store_dir": OptionInfo("", "Result store directory", restrict_api=True).info("empty = results in the data directory"),
+    "api_result_store_size": OptionInfo(4096, "Result store size limit (MB)", gr.Number, {"precision": 0}).info("oldest results are deleted first; 0 = unlimited"),
+    "api_result_store_thumbnail_size": OptionInfo(256, "Result store thumbnail size", gr.Slider, {"minimum": 64, "maximum": 1024, "step": 32}),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -211,7 +221,8 @@ For img2img, VAE is used to process user's input image before the sampling, and
     "auto_vae_precision_bfloat16": OptionInfo(False, "Automatically convert VAE to bfloat16").info("triggers when a tensor with NaNs is produced in VAE; disabling the option in this case will result in a black square image; if enabled, overrides the option below"),
     "auto_vae_precision": OptionInfo(True, "Automatically revert VAE to 32-bit floats").info("triggers when a tensor with NaNs is produced in VAE; disabling the option in this case will result in a black square image"),
     "sd_vae_encode_method": OptionInfo("Full", "VAE type for encode", gr.Radio, {"choices": ["Full", "TAESD"]}, infotext='VAE Encoder').info("method to encode image to latent (use in img2img, hires-fix or inpaint mask)"),
-    "sd_vae_decode_method": OptionInfo("Full", "VAE type for decode", gr.Radio, {"choices": ["Full", "TAESD"]}, infotext='VAE Decoder').info("method to decode latent to image"),
+    "sd_vae_decode_method": OptionInfo("Full", "VAE type for decode", gr.Radio, {"choices": ["Full", "Streaming", "TAESD"]}, infotext='VAE Decoder').info("method to decode latent to image; Streaming decodes final images in horizontal bands straight to 8-bit, for very large outputs"),
+    "sd_vae_tiled_mode": OptionInfo("Single pass", "Tiled VAE mode", gr.Radio, {"choices": ["Single pass", "Three pass"]}).info("used when VAE runs out of memory or is always tiled; three pass averages three differently shaped tilings at three times the cost"),
 }))
 
 options_templates.update(options_section(('img2img', "img2img", "sd"), {
@@ -387,6 +398,7 @@ options_templates.update(options_section(('ui', "Live previews", "ui"), {
     "live_preview_allow_lowvram_full": OptionInfo(False, "Allow Full live preview method with lowvram/medvram").info("If not, Approx NN will be used instead; Full live preview method is very detrimental to speed if lowvram/medvram optimizations are enabled"),
     "live_preview_content": OptionInfo("Prompt", "Live preview subject", gr.Radio, {"choices": ["Combined", "Prompt", "Negative prompt"]}),
     "live_preview_refresh_period": OptionInfo(1000, "Progressbar and preview update period").info("in milliseconds"),
+    "live_preview_min_decode_interval": OptionInfo(200, "Minimum time between live preview decodes").info("in milliseconds; previews arriving faster are skipped and only the newest one is decoded"),
     "live_preview_fast_interrupt": OptionInfo(False, "Return image with chosen live preview method on interrupt").info("makes interrupts faster"),
     "js_live_preview_in_modal_lightbox": OptionInfo(False, "Show Live preview in full page image viewer"),
     "prevent_screen_sleep_during_generation": OptionInfo(True, "Prevent screen sleep during generation"),
@@ -1,11 +1,13 @@
 import datetime
+import io
 import logging
 import threading
 import time
 import traceback
 import torch
 
-from modules import errors, shared, devices
+from modules import shared, devices, live_preview
+from modules.image_save_queue import save_queue
 from typing import Optional
 
 log = logging.getLogger(__name__)
@@ -24,6 +26,8 @@ class State:
     sampling_steps = 0
     current_latent = None
     current_image = None
+    current_image_bytes = None
+    current_image_format = None
     current_image_sampling_step = 0
     id_live_preview = 0
     textinfo = None
@@ -34,6 +38,7 @@ class State:
 
     def __init__(self):
         self.server_start = time.time()
+        self._current_image_lock = threading.Lock()
 
     @property
     def need_restart(self) -> bool:
@@ -105,6 +110,7 @@ class State:
             "job_no": self.job_no,
             "sampling_step": self.sampling_step,
             "sampling_steps": self.sampling_steps,
+            "save_queue_depth": save_queue.depth(),
         }
 
         return obj
@@ -117,9 +123,13 @@ class State:
         self.job_no = 0
         self.job_timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         self.current_latent = None
-        self.current_image = None
+        with self._current_image_lock:
+            self.current_image = None
+            self.current_image_bytes = None
+            self.current_image_format = None
         self.current_image_sampling_step = 0
         self.id_live_preview = 0
+        live_preview.worker.clear()
         self.skipped = False
         self.interrupted = False
         self.stopping_generation = False
@@ -136,40 +146,47 @@ class State:
 
         devices.torch_gc()
 
-    @torch.inference_mode()
-    def set_current_image(self):
-        """if enough sampling steps have been made after the last call to this, sets self.current_image from self.current_latent, and modifies self.id_live_preview accordingly"""
-        if not shared.parallel_processing_allowed:
-            return
-
-        if self.sampling_step - self.current_image_sampling_step >= shared.opts.show_progress_every_n_steps and shared.opts.live_previews_enable and shared.opts.show_progress_every_n_steps != -1:
-            self.do_set_current_image()
-
-    @torch.inference_mode()
     def do_set_current_image(self):
+        """queues self.current_latent for decoding by the live preview worker; the image is published asynchronously"""
         if self.current_latent is None:
             return
 
-        import modules.sd_samplers
-
-        try:
-            if shared.opts.show_progress_grid:
-                self.assign_current_image(modules.sd_samplers.samples_to_image_grid(self.current_latent))
-            else:
-                self.assign_current_image(modules.sd_samplers.sample_to_image(self.current_latent))
-
-            self.current_image_sampling_step = self.sampling_step
-
-        except Exception as e:
-            # traceback.print_exc()
-            # print(e)
-            # when switching models during genration, VAE would be on CPU, so creating an image will fail.
-            # we silently ignore this error
-            errors.record_exception()
+        self.current_image_sampling_step = self.sampling_step
+        live_preview.worker.submit(self.current_latent, self.sampling_step)
 
     @torch.inference_mode()
-    def assign_current_image(self, image):
-        if shared.opts.live_previews_image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
+    def assign_current_image(self, image, sampling_step=None):
+        """sets self.current_image, encodes it once in the live preview format and increments self.id_live_preview"""
+        image_format = shared.opts.live_previews_image_format
+        if image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
             image = image.convert('RGB')
-        self.current_image = image
-        self.id_live_preview += 1
+
+        if image_format == "png":
+            # using optimize for large images takes an enormous amount of time
+            if max(*image.size) <= 256:
+                save_kwargs = {"optimize": True}
+            else:
+                save_kwargs = {"optimize": False, "compress_level": 1}
+        else:
+            save_kwargs = {}
+
+        buffered = io.BytesIO()
+        image.save(buffered, format=image_format, **save_kwargs)
+
+        with self._current_image_lock:
+            self.current_image = image
+            self.current_image_bytes = buffered.getvalue()
+            self.current_image_format = image_format
+            self.id_live_preview += 1
+            if sampling_step is not None:
+                self.current_image_sampling_step = sampling_step
+
+    def get_current_image(self):
+        """returns (id_live_preview, image) of the last published live preview; image is None if there is none"""
+        with self._current_image_lock:
+            return self.id_live_preview, self.current_image
+
+    def get_current_image_bytes(self):
+        """returns (id_live_preview, format, encoded bytes) of the last published live preview; bytes is None if there is none"""
+        with self._current_image_lock:
+            return self.id_live_preview, self.current_image_format, self.current_image_bytes
@@ -15,6 +15,7 @@ from PIL import Image, PngImagePlugin
 from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes
 
 from modules.textual_inversion.image_embedding import embedding_to_b64, embedding_from_b64, insert_image_data_embed, extract_image_data_embed, caption_image_overlay
+from backend.text_processing import textual_inversion as backend_textual_inversion
 
 
 TextualInversionTemplate = namedtuple("TextualInversionTemplate", ["name", "path"])
@@ -33,16 +34,10 @@ def list_textual_inversion_templates():
     return textual_inversion_templates
 
 
-class Embedding:
+class Embedding(backend_textual_inversion.Embedding):
     def __init__(self, vec, name, step=None):
-        self.vec = vec
-        self.name = name
-        self.step = step
-        self.shape = None
-        self.vectors = 0
+        super().__init__(vec, name, step)
         self.cached_checksum = None
-        self.sd_checkpoint = None
-        self.sd_checkpoint_name = None
         self.optimizer_state_dict = None
         self.filename = None
         self.hash = None
@@ -113,6 +108,7 @@ class EmbeddingDatabase:
         self.expected_shape = -1
         self.embedding_dirs = {}
         self.previously_displayed_embeddings = ()
+        self.file_index = backend_textual_inversion.EmbeddingFileIndex(self.read_file, report_error=lambda message: errors.report(message, exc_info=True))
 
     def add_embedding_dir(self, path):
         self.embedding_dirs[path] = DirWithTextualInversionEmbeddings(path)
@@ -151,7 +147,7 @@ class EmbeddingDatabase:
         vec = shared.sd_model.cond_stage_model.encode_embedding_init_text(",", 1)
         return vec.shape[1]
 
-    def load_from_file(self, path, filename):
+    def read_file(self, path, filename):
         name, ext = os.path.splitext(filename)
         ext = ext.upper()
 
@@ -170,37 +166,25 @@ class EmbeddingDatabase:
                     name = data.get('name', name)
                 else:
                     # if data is None, means this is not an embedding, just a preview image
-                    return
+                    return None
         elif ext in ['.BIN', '.PT']:
             data = torch.load(path, map_location="cpu")
         elif ext in ['.SAFETENSORS']:
-            data = safetensors.torch.load_file(path, device="cpu")
+            # only the header is read, the vectors are loaded on first use
+            return backend_textual_inversion.embedding_from_safetensors_header(path, name, embedding_class=Embedding)
         else:
-            return
+            return None
 
-        if data is not None:
-            embedding = create_embedding_from_data(data, name, filename=filename, filepath=path)
-            self.register_embedding(embedding, None)
-        else:
+        if data is None:
             print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
+            return None
 
+        return create_embedding_from_data(data, name, filename=filename, filepath=path)
 
-    def load_from_dir(self, embdir):
-        if not os.path.isdir(embdir.path):
-            return
-
-        for root, _, fns in os.walk(embdir.path, followlinks=True):
-            for fn in fns:
-                try:
-                    fullfn = os.path.join(root, fn)
-
-                    if os.stat(fullfn).st_size == 0:
-                        continue
-
-                    self.load_from_file(fullfn, fn)
-                except Exception:
-                    errors.report(f"Error loading embedding {fn}", exc_info=True)
-                    continue
+    def load_from_file(self, path, filename):
+        embedding = self.read_file(path, filename)
+        if embedding is not None:
+            self.register_embedding(embedding, None)
 
     def load_textual_inversion_embeddings(self, force_reload=False, sync_with_sd_model=True):
         if not force_reload:
@@ -220,11 +204,14 @@ class EmbeddingDatabase:
         if sync_with_sd_model:
             self.expected_shape = self.get_expected_shape()
 
+        # files that did not change since the last scan are not read again
+        for embedding in self.file_index.scan([embdir.path for embdir in self.embedding_dirs.values()]):
+            self.register_embedding(embedding, None)
+
         for embdir in self.embedding_dirs.values():
-            self.load_from_dir(embdir)
             embdir.update()
 
-        # re-sort word_embeddings because load_from_dir may not load in alphabetic order.
+        # re-sort word_embeddings because the file index may not load in alphabetic order.
         # using a temporary copy so we don't reinitialize self.word_embeddings in case other objects have a reference to it.
         sorted_word_embeddings = {e.name: e for e in sorted(self.word_embeddings.values(), key=lambda e: e.name.lower())}
         self.word_embeddings.clear()
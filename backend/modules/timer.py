@@ -1,5 +1,8 @@
 import time
 import argparse
+import threading
+
+from backend import tracing
 
 
 class TimerSubcategory:
@@ -33,6 +36,7 @@ class Timer:
         self.base_category = ''
         self.print_log = print_log
         self.subcategory_level = 0
+        self.lock = threading.Lock()
 
     def elapsed(self):
         end = time.time()
@@ -41,10 +45,11 @@ class Timer:
         return res
 
     def add_time_to_record(self, category, amount):
-        if category not in self.records:
-            self.records[category] = 0
+        with self.lock:
+            if category not in self.records:
+                self.records[category] = 0
 
-        self.records[category] += amount
+            self.records[category] += amount
 
     def record(self, category, extra_time=0, disable_log=False):
         e = self.elapsed()
@@ -53,6 +58,8 @@ class Timer:
 
         self.total += e + extra_time
 
+        tracing.record(self.base_category + category, e + extra_time)
+
         if self.print_log and not disable_log:
             print(f"{'  ' * self.subcategory_level}{category}: done in {e + extra_time:.3f}s")
 
@@ -76,7 +83,8 @@ class Timer:
         return res
 
     def dump(self):
-        return {'total': self.total, 'records': self.records}
+        with self.lock:
+            return {'total': self.total, 'records': dict(self.records)}
 
     def reset(self):
         self.__init__()
@@ -0,0 +1,106 @@
+# Cache of img2img init latents.
+# Seed sweeps, X/Y plots and repeated API calls with the same source image encode the same pixels with the same VAE
+# over and over. Latents are kept here keyed by a content hash of the prepared init image (after resizing, cropping and
+# masked-content fill) together with the resize mode, target size, VAE identity and encode method, so a repeated
+# img2img skips the VAE encoder. The cache is bounded by the bytes the latents occupy and evicts the least recently used
+# entry first; the budget is read from shared.opts on every insert. Entries are kept in CPU memory so the cache never
+# competes with the models for VRAM, and the cache is cleared whenever a checkpoint is (re)loaded, because the VAE
+# identity includes id() of the VAE module, which a new model may reuse.
+# A cached latent is one sample of the VAE posterior, so repeated runs on the same source start from the same latent.
+
+
+import hashlib
+import threading
+
+from collections import OrderedDict
+from backend import metrics
+
+
+def content_hash(array):
+    """Hash of a numpy array's shape, dtype and contents, without copying contiguous arrays."""
+
+    import numpy as np
+
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{array.dtype.str}{array.shape}'.encode())
+    h.update(memoryview(array).cast('B'))
+    return h.hexdigest()
+
+
+def vae_identity(sd_model):
+    from modules import shared
+    vae = sd_model.forge_objects.vae
+    modules = getattr(shared.opts, 'forge_additional_modules', [])
+    return f'{getattr(sd_model, "sd_model_hash", None)}:{id(vae.first_stage_model)}:{vae.vae_dtype}:{"|".join(modules)}'
+
+
+class InitLatentCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def budget():
+        from modules import shared
+        opts = getattr(shared, 'opts', None)
+        size_mb = 64 if opts is None else opts.data.get('forge_init_latent_cache_size', 64)
+        return int(size_mb) * 1024 * 1024
+
+    @staticmethod
+    def make_key(image, resize_mode, width, height, sd_model, encode_method):
+        return f'{content_hash(image)}:{resize_mode}:{width}x{height}:{vae_identity(sd_model)}:{encode_method}'
+
+    def get(self, key, device=None):
+        with self.lock:
+            latent = self.entries.get(key)
+            if latent is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if latent is None:
+            metrics.cache_miss('init_latent')
+            return None
+
+        metrics.cache_hit('init_latent')
+        return latent.to(device if device is not None else latent.device, copy=True)
+
+    def put(self, key, latent):
+        budget = self.budget()
+        size = latent.numel() * latent.element_size()
+        if size > budget:
+            return
+
+        latent = latent.detach().to('cpu', copy=True)
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.numel() * old.element_size()
+
+            self.entries[key] = latent
+            self.total_bytes += size
+
+            while self.total_bytes > budget and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), bytes=self.total_bytes, max_bytes=self.budget(), hits=self.hits,
+                        misses=self.misses, evictions=self.evictions)
+
+
+init_latent_cache = InitLatentCache()
@@ -0,0 +1,150 @@
+# Shared cache for auxiliary models: ControlNets, T2I adapters, CLIP vision encoders and preprocessor (annotator) models.
+# The cache is bounded by the number of bytes the cached weights occupy, evicts the least recently used model first,
+# and unloads evicted models from the GPU through memory_management so that VRAM is released together with RAM.
+# The budget is read from shared.opts on every insert, so it can be changed at runtime.
+
+
+import threading
+import torch
+
+from collections import OrderedDict
+from backend import memory_management, metrics
+
+
+class CacheEntry:
+    def __init__(self, key, value, size, on_evict=None):
+        self.key = key
+        self.value = value
+        self.size = size
+        self.on_evict = [] if on_evict is None else [on_evict]
+
+
+def collect_modules(obj, depth=0):
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+
+    if obj is None or depth > 4:
+        return []
+
+    modules = []
+    for name in ['model_patcher', 'patcher', 'control_model', 't2i_model', 'model']:
+        child = getattr(obj, name, None)
+        if child is not None and child is not obj:
+            modules += collect_modules(child, depth + 1)
+
+    unique = {}
+    for m in modules:
+        unique[id(m)] = m
+    return list(unique.values())
+
+
+def model_size(obj):
+    return sum(memory_management.module_size(m) for m in collect_modules(obj))
+
+
+def release_modules(obj):
+    modules = collect_modules(obj)
+    if len(modules) > 0:
+        memory_management.unload_models_by_module(modules)
+
+
+class AuxiliaryModelCache:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def budget():
+        from modules import shared
+        opts = getattr(shared, 'opts', None)
+        size_mb = 4096 if opts is None else opts.data.get('forge_aux_model_cache_size', 4096)
+        return int(size_mb) * 1024 * 1024
+
+    def get_or_load(self, key, loader, on_evict=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if on_evict is not None:
+                    entry.on_evict.append(on_evict)
+                return entry.value
+
+            self.misses += 1
+
+        value = loader()
+
+        if value is not None:
+            self.put(key, value, on_evict=on_evict)
+
+        return value
+
+    def put(self, key, value, on_evict=None):
+        entry = CacheEntry(key, value, model_size(value), on_evict)
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_size -= old.size
+                if old.value is not value:
+                    release_modules(old.value)
+
+            self.entries[key] = entry
+            self.total_size += entry.size
+
+            self.shrink(keep=key)
+
+        return value
+
+    def touch(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+    def shrink(self, keep=None):
+        budget = self.budget()
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if self.total_size <= budget:
+                    break
+                if key == keep:
+                    continue
+                self.evict(key)
+
+    def evict(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.total_size -= entry.size
+            self.evictions += 1
+
+        print(f'[Auxiliary Model Cache] Evict {key} ({entry.size / (1024 * 1024):.2f} MB)')
+
+        release_modules(entry.value)
+
+        for callback in entry.on_evict:
+            callback()
+
+    def clear(self):
+        for key in list(self.entries.keys()):
+            self.evict(key)
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                entries=len(self.entries),
+                size=self.total_size,
+                budget=self.budget(),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+
+aux_model_cache = AuxiliaryModelCache()
+metrics.cache_requests.add_source(lambda: {('aux_model', 'hit'): aux_model_cache.hits, ('aux_model', 'miss'): aux_model_cache.misses})
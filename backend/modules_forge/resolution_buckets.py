@@ -0,0 +1,113 @@
+# Resolution bucketing for txt2img.
+# Every new latent shape means new allocations for the UNet activations, the cond/uncond batch and the VAE decode, which
+# fragments the CUDA caching allocator and rules out graph reuse (see backend.compilation). With bucketing enabled, a
+# request is generated at the smallest canonical resolution that contains it and the decoded image is center-cropped
+# back to the requested size, so a serving process only ever sees a handful of shapes. Requests that no bucket
+# contains, or that a bucket would pad by more than `max_padding`, are generated at their own size.
+
+
+import threading
+
+from collections import OrderedDict
+
+
+opt_f = 8
+max_padding = 0.5  # extra area relative to the requested area
+
+
+def parse_buckets(text):
+    buckets = []
+    for item in text.replace(';', ',').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            width, height = (int(x) for x in item.split('x'))
+        except ValueError:
+            print(f'[Resolution Buckets] Ignoring invalid bucket "{item}", expected WIDTHxHEIGHT')
+            continue
+        if width > 0 and height > 0:
+            buckets.append((width // opt_f * opt_f, height // opt_f * opt_f))
+    return sorted(set(buckets), key=lambda b: (b[0] * b[1], b))
+
+
+def choose_bucket(width, height, buckets):
+    """Returns the smallest bucket that contains width x height, or None."""
+
+    width = width // opt_f * opt_f
+    height = height // opt_f * opt_f
+
+    for bucket_width, bucket_height in buckets:
+        if bucket_width >= width and bucket_height >= height:
+            if bucket_width * bucket_height > width * height * (1 + max_padding):
+                return None
+            return bucket_width, bucket_height
+
+    return None
+
+
+def crop_box(width, height, bucket):
+    """Pixel box (left, top, right, bottom) of width x height centered in the bucket, aligned to latent pixels."""
+
+    width = width // opt_f * opt_f
+    height = height // opt_f * opt_f
+    left = (bucket[0] - width) // 2 // opt_f * opt_f
+    top = (bucket[1] - height) // 2 // opt_f * opt_f
+    return left, top, left + width, top + height
+
+
+def crop_decoded(x_samples, box, channels_last):
+    """Crops a batch of decoded images: NCHW tensors or a list of CHW tensors, or NHWC arrays when channels_last."""
+
+    left, top, right, bottom = box
+    if channels_last:
+        return x_samples[:, top:bottom, left:right]
+    if isinstance(x_samples, list):
+        return [x[:, top:bottom, left:right] for x in x_samples]
+    return x_samples[..., top:bottom, left:right]
+
+
+def reserve_during_sampling(unet):
+    """Returns a clone of unet whose sampling run pre-reserves its inference memory in the caching allocator.
+    The block is reserved by sampling_prepare once the models are loaded, since load_models_gpu may empty the cache."""
+
+    unet = unet.clone()
+    unet.set_reserve_inference_memory(True)
+    return unet
+
+
+class BucketStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.misses = 0
+        self.requested_area = 0
+        self.generated_area = 0
+
+    def record(self, width, height, bucket, count):
+        with self.lock:
+            if bucket is None:
+                self.misses += count
+                return
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+            self.requested_area += width * height * count
+            self.generated_area += bucket[0] * bucket[1] * count
+
+    def report(self):
+        with self.lock:
+            hits = sum(self.buckets.values())
+            total = hits + self.misses
+            return dict(
+                hits=hits,
+                misses=self.misses,
+                hit_rate=hits / total if total else 0.0,
+                padding_overhead=self.generated_area / self.requested_area - 1 if self.requested_area else 0.0,
+                buckets={f'{w}x{h}': n for (w, h), n in sorted(self.buckets.items(), key=lambda x: -x[1])},
+            )
+
+    def summary(self):
+        report = self.report()
+        return f"hit rate {report['hit_rate']:.0%} ({report['hits']}/{report['hits'] + report['misses']}), padding overhead {report['padding_overhead']:.0%}"
+
+
+bucket_stats = BucketStats()
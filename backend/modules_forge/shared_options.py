@@ -1,3 +1,38 @@
+import gradio as gr
+
+
+def on_aux_model_cache_size_change():
+    from modules_forge.model_cache import aux_model_cache
+    aux_model_cache.shrink()
+
+
+def on_dequant_cache_size_change():
+    from backend.args import dynamic_args
+    from modules import shared
+    dynamic_args['forge_dequant_cache_size'] = shared.opts.forge_dequant_cache_size
+
+
+def on_layer_prefetch_depth_change():
+    from backend.args import dynamic_args
+    from modules import shared
+    dynamic_args['forge_layer_prefetch_depth'] = shared.opts.forge_layer_prefetch_depth
+
+
+def on_compile_mode_change():
+    from backend.args import dynamic_args
+    from modules import shared
+    dynamic_args['forge_compile_mode'] = shared.opts.forge_compile_mode
+    setup_compile_cache()
+
+
+def setup_compile_cache():
+    import os
+    from backend import compilation
+    from modules import paths, shared
+    if shared.opts.forge_compile_mode != 'None':
+        compilation.setup_cache(os.path.join(paths.models_path, 'compile-cache'))
+
+
 def register(options_templates, options_section, OptionInfo):
     options_templates.update(options_section((None, "Forge Hidden options"), {
         "forge_unet_storage_dtype": OptionInfo('Automatic'),
@@ -7,6 +42,21 @@ def register(options_templates, options_section, OptionInfo):
         "forge_preset": OptionInfo('sd'),
         "forge_additional_modules": OptionInfo([]),
     }))
+    options_templates.update(options_section(('optimizations', "Optimizations", "sd"), {
+        "forge_aux_model_cache_size": OptionInfo(4096, "Auxiliary model cache size (MB)", onchange=on_aux_model_cache_size_change).info("RAM kept for ControlNet, T2I-Adapter, CLIP vision and preprocessor models; least recently used models are unloaded when exceeded"),
+        "forge_unet_quant_cache": OptionInfo(True, "Cache quantized UNet weights on disk").info("for bnb-nf4/fp4 and float8 storage dtypes; the quantized UNet is stored in models/quant-cache after the first load and read from there afterwards"),
+        "forge_unet_quant_cache_size": OptionInfo(20.0, "Quantized UNet cache size (GB)").info("least recently used entries are removed first; 0 = unlimited"),
+        "forge_dequant_cache_size": OptionInfo(0, "Dequantized weight cache size (MB)", onchange=on_dequant_cache_size_change).info("GGUF and bnb-nf4/fp4 UNets only; keeps dequantized layer weights in VRAM during sampling instead of dequantizing them on every step; reserved in addition to inference memory; 0 = disable"),
+        "forge_layer_prefetch_depth": OptionInfo(0, "Layer prefetch depth for low-VRAM swap", gr.Slider, {"minimum": 0, "maximum": 8, "step": 1}, onchange=on_layer_prefetch_depth_change).info("when a model only partly fits in VRAM, copy the weights of this many upcoming swapped layers to the GPU while the current layer runs; uses depth + 1 buffers the size of the largest layer, taken from the VRAM left for the model; applied on the next model load; 0 = disable"),
+        "forge_compile_mode": OptionInfo("None", "Compiled execution (torch.compile)", gr.Radio, {"choices": ["None", "UNet", "UNet + VAE"]}, onchange=on_compile_mode_change).info("compiles the UNet forward (and the VAE decode) once per resolution, batch size and prompt length; the first generation at a new size is slower; runs eagerly with ControlNet, LoRA applied online, GGUF/bnb weights or a model that only partly fits in VRAM; kernels are cached in models/compile-cache and recently used sizes are compiled again on model load"),
+        "forge_init_latent_cache_size": OptionInfo(64, "Init latent cache size (MB)").info("img2img keeps the latents of recently encoded init images, keyed by image content, resize mode, size, VAE and encode method, so repeating img2img on the same source skips the VAE encoder; 0 = disable"),
+        "forge_resolution_bucketing": OptionInfo(False, "Resolution bucketing for txt2img").info("generate at the smallest of the resolutions below that contains the requested size and center-crop the result, so that repeated requests reuse the same latent shapes and allocator segments; not used with hires fix; changes the composition of padded images"),
+        "forge_resolution_buckets": OptionInfo("512x512, 512x768, 768x512, 768x768, 640x1536, 768x1344, 832x1216, 896x1152, 1024x1024, 1152x896, 1216x832, 1344x768, 1536x640", "Resolution buckets").info("comma separated WIDTHxHEIGHT; sizes that no bucket contains, or that would be padded by more than half their area, are generated as requested"),
+        "forge_tracing": OptionInfo(False, "Record a performance trace of every generation").info("per-stage timings (queue, model load, text encoding, LoRA merge, sampling steps, VAE, postprocessing, saving) kept for the last 64 jobs; GET /sdapi/v1/traces/{task id}, or .../chrome for chrome://tracing and Perfetto"),
+        "forge_tracing_sync": OptionInfo(False, "Synchronize the GPU at trace span boundaries").info("makes span timings of GPU work exact at the cost of some speed; only while tracing"),
+        "forge_residency_planner": OptionInfo(True, "Plan model residency per generation").info("when VRAM runs out, unload the model that the job needs again last instead of the least recently loaded one; logs a transfer report per job"),
+        "forge_residency_prefetch": OptionInfo(False, "Preload the next model of a generation in the background").info("requires the residency planner; the next stage's model is moved to the GPU while the current stage runs, when it fits next to it"),
+    }))
     options_templates.update(options_section(('ui_alternatives', "UI alternatives", "ui"), {
         "forge_canvas_plain": OptionInfo(False, "ForgeCanvas: use plain background").needs_reload_ui(),
         "forge_canvas_toolbar_always": OptionInfo(False, "ForgeCanvas: toolbar always visible").needs_reload_ui(),
@@ -8,6 +8,7 @@ from backend.patcher import clipvision
 from modules_forge.utils import resize_image_with_pad
 from modules.modelloader import load_file_from_url
 from modules_forge.utils import numpy_to_pytorch
+from modules_forge.model_cache import aux_model_cache
 
 
 class PreprocessorParameter:
@@ -34,6 +35,7 @@ class Preprocessor:
         self.fill_mask_with_one_when_resize_and_fill = False
         self.use_soft_projection_in_hr_fix = False
         self.expand_mask_when_resize_and_fill = False
+        self.output_depends_on_seed = False  # results are only reused for the same numpy seed when True
 
     def setup_model_patcher(self, model, load_device=None, offload_device=None, dtype=torch.float32, **kwargs):
         if load_device is None:
@@ -50,9 +52,14 @@ class Preprocessor:
 
         self.model_patcher = ModelPatcher(model=model, load_device=load_device, offload_device=offload_device, **kwargs)
         self.model_patcher.dtype = dtype
+        aux_model_cache.put(('preprocessor', self.name), self.model_patcher, on_evict=self.on_model_patcher_evicted)
         return self.model_patcher
 
+    def on_model_patcher_evicted(self):
+        self.model_patcher = None
+
     def move_all_model_patchers_to_gpu(self):
+        aux_model_cache.touch(('preprocessor', self.name))
         memory_management.load_models_gpu([self.model_patcher])
         return
 
@@ -101,8 +108,6 @@ add_supported_preprocessor(PreprocessorCanny())
 
 
 class PreprocessorClipVision(Preprocessor):
-    global_cache = {}
-
     def __init__(self, name, url, filename):
         super().__init__()
         self.name = name
@@ -113,9 +118,11 @@ class PreprocessorClipVision(Preprocessor):
         self.show_control_mode = False
         self.sorting_priority = 1
         self.clipvision = None
+        self.clipvision_key = None
 
     def load_clipvision(self):
         if self.clipvision is not None:
+            aux_model_cache.touch(self.clipvision_key)
             return self.clipvision
 
         ckpt_path = load_file_from_url(
@@ -124,14 +131,18 @@ class PreprocessorClipVision(Preprocessor):
             file_name=self.filename
         )
 
-        if ckpt_path in PreprocessorClipVision.global_cache:
-            self.clipvision = PreprocessorClipVision.global_cache[ckpt_path]
-        else:
-            self.clipvision = clipvision.load(ckpt_path)
-            PreprocessorClipVision.global_cache[ckpt_path] = self.clipvision
+        self.clipvision_key = ('clip_vision', ckpt_path)
+        self.clipvision = aux_model_cache.get_or_load(
+            self.clipvision_key,
+            lambda: clipvision.load(ckpt_path),
+            on_evict=self.on_clipvision_evicted
+        )
 
         return self.clipvision
 
+    def on_clipvision_evicted(self):
+        self.clipvision = None
+
     @torch.no_grad()
     def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
         clipvision = self.load_clipvision()
@@ -136,6 +136,7 @@ class __Quant(ABC):
         block_size, type_size = GGML_QUANT_SIZES[cls.qtype]
         blocks = data.reshape(-1, block_size)
         parent.data = cls.quantize_blocks_pytorch(blocks, block_size, type_size, parent).contiguous()
+        parent.mapped_data = None
         return parent
 
     @classmethod
@@ -20,11 +20,21 @@ startup_timer.record("launcher")
 
 initialize_forge()
 
-initialize.imports()
+from modules.shared_cmd_options import cmd_opts  # noqa: E402
+
+# API-only fast startup: modules.ui is never imported, and the rest of initialization runs in api_only_worker
+# after the server already answers /sdapi/v1/health
+api_fast_startup = cmd_opts.nowebui and cmd_opts.api_fast_startup
+
+initialize.imports(ui=not api_fast_startup)
 
 initialize.check_versions()
 
-initialize.initialize()
+if api_fast_startup:
+    initialize_util.fix_asyncio_event_loop_policy()
+    initialize_util.configure_sigint_handler()
+else:
+    initialize.initialize()
 
 
 def _handle_exception(request: Request, e: Exception):
@@ -48,27 +58,41 @@ def create_api(app):
 
 def api_only_worker():
     from fastapi import FastAPI
-    from modules.shared_cmd_options import cmd_opts
+    from modules.api import startup
+
+    server_name = initialize_util.gradio_server_name()
+    port = cmd_opts.port if cmd_opts.port else 7861
+    root_path = f"/{cmd_opts.subpath}" if cmd_opts.subpath else ""
 
     app = FastAPI(exception_handlers={Exception: _handle_exception})
     initialize_util.setup_middleware(app)
+    startup.setup_startup_api(app)
+
+    server_thread = None
+    if api_fast_startup:
+        server_thread = startup.start_server(app, server_name, port, root_path)
+        initialize.initialize(parallel=True)
+
     api = create_api(app)
 
     from modules import script_callbacks
     script_callbacks.before_ui_callback()
     script_callbacks.app_started_callback(None, app)
 
+    timer.startup_record = startup_timer.dump()
     print(f"Startup time: {startup_timer.summary()}.")
-    api.launch(
-        server_name=initialize_util.gradio_server_name(),
-        port=cmd_opts.port if cmd_opts.port else 7861,
-        root_path=f"/{cmd_opts.subpath}" if cmd_opts.subpath else ""
-    )
 
+    from modules.call_queue import queue_lock
+    startup.start_warm_up(queue_lock)
+
+    if server_thread is None:
+        api.launch(server_name=server_name, port=port, root_path=root_path)
+    else:
+        app.include_router(api.router)
+        server_thread.join()
 
-def webui_worker():
-    from modules.shared_cmd_options import cmd_opts
 
+def webui_worker():
     launch_api = cmd_opts.api
 
     from modules import shared, ui_tempdir, script_callbacks, ui, progress, ui_extra_networks
@@ -185,8 +209,6 @@ def webui():
 
 
 if __name__ == "__main__":
-    from modules.shared_cmd_options import cmd_opts
-
     if cmd_opts.nowebui:
         api_only()
     else: